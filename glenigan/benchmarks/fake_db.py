@@ -0,0 +1,103 @@
+"""An in-process stand-in for the MySQL server, installed in place of ``pymysql.connect``.
+
+It accepts the statements the spider and GleniganPipeline issue, answers the few
+SELECTs with empty results (every application is new), and counts statements,
+round trips and rows so a benchmark can report database work per application.
+An optional per-round-trip latency models a remote server.
+"""
+import re
+import threading
+import time
+from collections import Counter
+
+STATEMENT = re.compile(r"^\s*(\w+)(?:\s+IGNORE)?(?:\s+INTO|\s+FROM)?\s+(\S+)", re.IGNORECASE)
+
+
+class FakeDatabase:
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.lock = threading.Lock()
+        self.statements = Counter()  # "INSERT plan_app" -> statements executed
+        self.rows = Counter()  # "INSERT plan_app" -> rows sent
+        self.round_trips = 0
+        self.commits = 0
+        self.connections = 0
+
+    def connect(self, **config):
+        with self.lock:
+            self.connections += 1
+        return FakeConnection(self)
+
+    def record(self, sql, rows):
+        match = STATEMENT.match(sql)
+        name = f"{match.group(1).upper()} {match.group(2)}" if match else sql.split(None, 1)[0].upper()
+        with self.lock:
+            self.statements[name] += 1
+            self.rows[name] += rows
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "round_trips": self.round_trips,
+                "commits": self.commits,
+                "connections": self.connections,
+                "statements": dict(self.statements),
+                "rows": dict(self.rows),
+            }
+
+
+class FakeCursor:
+    def __init__(self, database):
+        self.database = database
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.database.record(sql, 1)
+        # information_schema lookups ask whether a column exists: say yes so no migration runs
+        self.result = [(1,)] if "information_schema" in sql else []
+        return len(self.result)
+
+    def executemany(self, sql, rows):
+        rows = list(rows)
+        self.database.record(sql, len(rows))
+        self.result = []
+        return len(rows)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return list(self.result)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self):
+        return FakeCursor(self.database)
+
+    def commit(self):
+        with self.database.lock:
+            self.database.commits += 1
+
+    def rollback(self):
+        pass
+
+    def ping(self, reconnect=True):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,73 @@
+"""Measure what logging costs the crawl thread, with the crawl's mix of messages.
+
+Run from the project directory (the one with scrapy.cfg):
+
+    python -m benchmarks.logging_cost --records 200000
+    python -m benchmarks.logging_cost --records 200000 --no-sampling
+
+Reports CPU seconds spent in the logging (reactor) thread, CPU seconds for the whole
+process including any background writer, and the log file size. Console output goes
+to /dev/null, as it would when the crawl runs under a scheduler.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (logger, level, message) in roughly the proportions of a crawl that scrapes new applications
+MESSAGE_MIX = [
+    ("logger", logging.INFO, "Successfully scraped tab summary for 101_25_00001_FUL"),
+    ("logger", logging.INFO, "Successfully scraped tab details for 101_25_00001_FUL"),
+    ("logger", logging.INFO, "Successfully scraped tab contacts for 101_25_00001_FUL"),
+    ("logger", logging.INFO, "Skipping already scraped application: 101_25_00002_FUL"),
+    ("logger", logging.INFO, "Skipping already scraped application: 101_25_00003_FUL"),
+    ("logger", logging.INFO, "Scraping application with status No: 101_25_00004_FUL"),
+    ("logger", logging.INFO, "Saved: 101_25_00001_FUL to html_dumps/101_25_00001_FUL.html"),
+    ("scrapy.core.engine", logging.DEBUG, "Crawled (200) <GET https://example.org/online-applications/applicationDetails.do?activeTab=summary> (referer: None)"),
+    ("scrapy.core.engine", logging.DEBUG, "Crawled (200) <GET https://example.org/online-applications/applicationDetails.do?activeTab=dates> (referer: None)"),
+    ("logger", logging.WARNING, "Tab documents failed for 101_25_00005_FUL (TimeoutError()), retry 1 in 10s"),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure logging CPU cost on the crawl thread")
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--no-sampling", action="store_true", help="log every message (ignore LOG_SAMPLING)")
+    args = parser.parse_args(argv)
+
+    os.chdir(tempfile.mkdtemp(prefix="glenigan-logcost-"))
+    sys.path.insert(0, PROJECT_DIR)
+    sys.stderr = open(os.devnull, "w")
+    from glenigan import logger_config, settings
+
+    # Console handlers were bound to the real stderr when they were created
+    for handler in logging.getLogger().handlers + logging.getLogger("logger").handlers + list(getattr(getattr(logger_config, "listener", None), "handlers", ())):
+        if type(handler) is logging.StreamHandler:
+            handler.setStream(sys.stderr)
+    if hasattr(logger_config, "configure_log_sampling") and not args.no_sampling:
+        logger_config.configure_log_sampling(getattr(settings, "LOG_SAMPLING", {}))
+
+    loggers = [(logging.getLogger(name), level, message) for name, level, message in MESSAGE_MIX]
+    wall, process, thread = time.perf_counter(), time.process_time(), time.thread_time()
+    for number in range(args.records):
+        log, level, message = loggers[number % len(loggers)]
+        log.log(level, message)
+    caller_cpu = time.thread_time() - thread
+    listener = getattr(logger_config, "listener", None)
+    if listener is not None:
+        listener.stop()  # wait for the background writer to drain the queue
+    total_cpu = time.process_time() - process
+    elapsed = time.perf_counter() - wall
+
+    size = os.path.getsize(logger_config.log_filename)
+    print(f"{args.records} records: {caller_cpu:.2f}s CPU on the logging thread "
+          f"({caller_cpu / args.records * 1e6:.1f}us per record), {total_cpu:.2f}s CPU in total, "
+          f"{elapsed:.2f}s wall, {size / 1e6:.1f} MB written", file=sys.__stdout__)
+
+
+if __name__ == "__main__":
+    main()
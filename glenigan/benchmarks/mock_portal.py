@@ -0,0 +1,236 @@
+"""A local stand-in for Idox public access portals.
+
+One threaded HTTP server plays every council; council ``n`` is addressed as
+127.0.0.<n + 1> on the same port, so each gets its own downloader slot as on the
+real portals. It serves the advanced search form, results pages (with the
+resultsPerPage selector and "Showing x-y of z"), the ten ``activeTab`` pages
+of every application, with configurable latency, error rate and body size, and the
+files linked from the documents tab (with Range requests, so downloads can resume).
+PortalProcess serves it from a child process, so it does not compete with the crawl
+being measured for the GIL.
+"""
+import http.server
+import multiprocessing
+import random
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlparse
+
+TABS = ["summary", "details", "contacts", "dates", "makeComment", "neighbourComments", "consulteeComments", "constraints", "documents", "relatedCases"]
+
+
+class PortalConfig:
+    def __init__(self, applications=500, page_size=10, max_page_size=100, latency_ms=20.0, error_rate=0.0, tab_bytes=20000, seed=1, document_bytes=200000):
+        self.applications = applications
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.tab_bytes = tab_bytes
+        self.document_bytes = document_bytes
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.page_sizes = {}  # council -> results per page chosen by the last search
+        self.requests = 0
+        self.errors = 0
+
+    def delay(self):
+        """Sleep for a latency drawn around latency_ms; True if this request should fail with a 503."""
+        with self.lock:
+            self.requests += 1
+            latency = self.random.expovariate(1.0 / self.latency_ms) if self.latency_ms else 0.0
+            fail = self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        time.sleep(latency / 1000.0)
+        return fail
+
+
+def council_of(handler):
+    host = handler.headers.get("Host", "127.0.0.1").split(":")[0]
+    return int(host.rsplit(".", 1)[-1]) - 1
+
+
+def tab_content(key, tab):
+    """Idox-like markup for the tabs that carry fields, so the extraction stage has real work."""
+    number = int(key[1:])
+    rows = {
+        "summary": [("Reference", f"25/{number:05d}/FUL"), ("Application Received", "Wed 19 Feb 2025"),
+                    ("Application Validated", "Wed 19 Feb 2025"), ("Address", f"{number} High Street, Testtown, TT1 1AA"),
+                    ("Proposal", f"Single storey rear extension to dwelling {number}"), ("Status", "Pending Consideration"),
+                    ("Decision", "Not Available"), ("Appeal Status", "Unknown")],
+        "details": [("Application Type", "Householder"), ("Case Officer", "A Officer"), ("Ward", "Central"),
+                    ("Parish", "Testtown"), ("Applicant Name", f"Mr Applicant {number}"), ("Agent Name", "Ms Agent"),
+                    ("Agent Company Name", "Plans Ltd")],
+        "dates": [("Application Received Date", "Wed 19 Feb 2025"), ("Application Validated Date", "Wed 19 Feb 2025"),
+                  ("Expiry Date", "Wed 16 Apr 2025"), ("Neighbour Consultation Expiry Date", "Wed 12 Mar 2025"),
+                  ("Decision Made Date", "Not Available")],
+    }
+    if tab in rows:
+        cells = "".join(f'<tr><th scope="row">{label}</th><td>{value}</td></tr>' for label, value in rows[tab])
+        return f'<table id="simpleDetailsTable">{cells}</table>'
+    if tab == "contacts":
+        return (
+            '<div class="agents"><h3>Agent</h3><p>Ms Agent</p><p>Plans Ltd</p><p>1 Drawing Lane</p>'
+            '<table class="agents"><tr><th>Phone</th><td>01234 567890</td></tr><tr><th>Email</th><td>agent@example.org</td></tr></table></div>'
+        )
+    if tab == "documents":
+        documents = "".join(
+            f'<tr><td>19 Feb 2025</td><td>Plans</td><td>DR-{document}</td><td>Drawing {document}</td>'
+            f'<td><a href="/online-applications/files/{key}-{document}.pdf">View</a></td></tr>'
+            for document in range(1 + number % 6)
+        )
+        return ('<table id="Documents"><tr><th>Date Published</th><th>Document Type</th><th>Drawing Number</th>'
+                f'<th>Description</th><th>View</th></tr>{documents}</table>')
+    return ""
+
+
+def filler(size, seed):
+    """Deterministic markup of roughly ``size`` bytes."""
+    row = f'<tr><th>Field {seed}</th><td>Lorem ipsum dolor sit amet, consectetur adipiscing elit {seed}.</td></tr>'
+    return row * max(1, size // len(row))
+
+
+def document_content(name, size):
+    """Deterministic bytes for a linked file; the first document of every application is the same file."""
+    key, _, number = name.rpartition("-")
+    seed = f"{'shared' if number == '0' else key}-{number}\n".encode("utf-8")
+    return (b"%PDF-1.4\n" + seed * (size // len(seed) + 1))[:size]
+
+
+class PortalHandler(http.server.BaseHTTPRequestHandler):
+    config = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, body, status=200):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_file(self, data):
+        """Send a file, or the part of it asked for by a ``Range: bytes=<start>-`` header."""
+        start = 0
+        requested = self.headers.get("Range", "")
+        if requested.startswith("bytes=") and requested[len("bytes="):].rstrip("-").isdigit():
+            start = int(requested[len("bytes="):].rstrip("-"))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(data) - start))
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+    def results(self, council, page):
+        config = self.config
+        per_page = config.page_sizes.get(council, config.page_size)
+        first = (page - 1) * per_page
+        last = min(config.applications, page * per_page)
+        pages = -(-config.applications // per_page)
+        items = "".join(
+            f'<li class="searchresult"><a href="/online-applications/applicationDetails.do?keyVal=K{number}&amp;activeTab=summary">'
+            f'Application {number}</a><p class="metaInfo">Ref. No: 25/{number:05d}/FUL | Received: Wed 19 Feb 2025</p></li>'
+            for number in range(first, last)
+        )
+        pager = "".join(
+            f'<a class="page" href="/online-applications/pagedSearchResults.do?action=page&amp;searchCriteria.page={number}">{number}</a>'
+            for number in range(max(1, page - 4), min(pages, page + 5) + 1) if number != page
+        )
+        if page < pages:
+            pager += f'<a class="next" href="/online-applications/pagedSearchResults.do?action=page&amp;searchCriteria.page={page + 1}">Next</a>'
+        options = "".join(f'<option value="{size}">{size}</option>' for size in sorted({10, 30, config.max_page_size}))
+        return (
+            '<html><body><form id="searchResults" method="post" action="/online-applications/pagedSearchResults.do">'
+            '<input type="hidden" name="action" value="page"/><input type="hidden" name="searchCriteria.page" value="1"/>'
+            f'<select name="searchCriteria.resultsPerPage">{options}</select></form>'
+            f'<span class="showing">Showing {first + 1}-{last} of {config.applications}</span>'
+            f'<p class="pager">{pager}</p><ul id="searchresults">{items}</ul></body></html>'
+        )
+
+    def do_GET(self):
+        if self.config.delay():
+            return self.send("Service Unavailable", 503)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        council = council_of(self)
+        if url.path.endswith("search.do"):
+            return self.send(
+                '<html><body><form id="advancedSearchForm" method="post">'
+                f'<input type="hidden" name="_csrf" value="{uuid.uuid4()}"/></form></body></html>'
+            )
+        if url.path.endswith("pagedSearchResults.do"):
+            return self.send(self.results(council, int(query["searchCriteria.page"][0])))
+        if "/files/" in url.path:
+            return self.send_file(document_content(url.path.rsplit("/", 1)[-1][:-len(".pdf")], self.config.document_bytes))
+        if url.path.endswith("applicationDetails.do"):
+            key, tab = query["keyVal"][0], query.get("activeTab", ["summary"])[0]
+            return self.send(
+                f'<html><head><meta name="_csrf" content="{uuid.uuid4()}"/></head><body><h1>{key} {tab}</h1>'
+                f'{tab_content(key, tab)}<table class="filler">{filler(self.config.tab_bytes, key + tab)}</table></body></html>'
+            )
+        self.send("Not Found", 404)
+
+    def do_POST(self):
+        form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+        if self.config.delay():
+            return self.send("Service Unavailable", 503)
+        council = council_of(self)
+        if self.path.startswith("/online-applications/pagedSearchResults.do"):
+            self.config.page_sizes[council] = int(form["searchCriteria.resultsPerPage"][0])
+            return self.send(self.results(council, 1))
+        self.config.page_sizes[council] = self.config.page_size
+        return self.send(self.results(council, 1))
+
+
+def start_portal(config, port=0):
+    """Serve the mock portal from a background thread; returns the server (``server_address[1]`` is the port)."""
+    handler = type("ConfiguredPortalHandler", (PortalHandler,), {"config": config})
+    server = http.server.ThreadingHTTPServer(("", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-portal", daemon=True).start()
+    return server
+
+
+def serve(settings, connection):
+    """Child process entry point: serve PortalConfig(**settings), send the port, then the counts once told to stop."""
+    config = PortalConfig(**settings)
+    server = start_portal(config)
+    connection.send(server.server_address[1])
+    connection.recv()
+    server.shutdown()
+    with config.lock:
+        connection.send((config.requests, config.errors))
+
+
+class PortalProcess:
+    """The mock portal in a child process; ``port`` is listening once the constructor returns."""
+
+    def __init__(self, startup_timeout=30.0, **settings):
+        context = multiprocessing.get_context("spawn")
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=serve, args=(settings, child), name="mock-portal", daemon=True)
+        self.process.start()
+        if not self.connection.poll(startup_timeout):
+            self.process.terminate()
+            raise RuntimeError(f"Mock portal did not start within {startup_timeout:.0f}s")
+        self.port = self.connection.recv()
+        self.requests = 0
+        self.errors = 0
+
+    def stop(self):
+        """Stop the portal and collect its request and error counts."""
+        self.connection.send("stop")
+        self.requests, self.errors = self.connection.recv()
+        self.process.join()
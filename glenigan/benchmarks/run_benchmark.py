@@ -0,0 +1,256 @@
+"""End-to-end benchmark: the real ScraperSpider and GleniganPipeline against a mock portal and database.
+
+Run from the project directory (the one with scrapy.cfg):
+
+    python -m benchmarks.run_benchmark --councils 2 --applications 500 --output bench.json
+    python -m benchmarks.run_benchmark --latency-ms 80 --error-rate 0.02 --baseline bench.json
+    python -m benchmarks.run_benchmark --set MAX_OPEN_APPLICATIONS=50 --set HTML_STORAGE=archive
+
+It reports applications per second, response and per-application latency percentiles,
+peak RSS and database statements per application, and writes them with the run's
+configuration and git commit to a JSON file so runs can be compared across commits.
+Everything the crawl writes (dumps, spool, logs, checkpoints) goes to a scratch directory.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Metrics compared against --baseline, and whether higher is better
+HEADLINE_METRICS = {
+    "applications_per_second": True,
+    "application_seconds.p50": False,
+    "application_seconds.p99": False,
+    "response_seconds.p99": False,
+    "peak_rss_mb": False,
+    "db_round_trips_per_application": False,
+}
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """Nearest-rank percentiles of ``values`` as {"p50": ...}; empty input gives None."""
+    ordered = sorted(values)
+    if not ordered:
+        return {f"p{point}": None for point in points}
+    return {f"p{point}": round(ordered[min(len(ordered) - 1, max(0, -(-point * len(ordered) // 100) - 1))], 4) for point in points}
+
+
+def current_rss_mb():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class RssSampler(threading.Thread):
+    """Samples resident memory while the crawl runs (ru_maxrss alone would include interpreter start-up)."""
+
+    def __init__(self, interval=0.2):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.interval = interval
+        self.peak = 0.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_setting(text):
+    name, _, value = text.partition("=")
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return name, value
+
+
+def lookup(results, dotted):
+    value = results
+    for part in dotted.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    for metric, higher_is_better in HEADLINE_METRICS.items():
+        new, old = lookup(results, metric), lookup(baseline["results"], metric)
+        if not new or not old:
+            continue
+        change = (new - old) / old * 100
+        better = change > 0 if higher_is_better else change < 0
+        print(f"  {metric:<34} {old:>10.3f} -> {new:>10.3f}  {change:+6.1f}% {'better' if better else 'worse' if change else ''}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the spider and pipeline against a local mock portal")
+    parser.add_argument("--councils", type=int, default=1)
+    parser.add_argument("--applications", type=int, default=300, help="applications per council")
+    parser.add_argument("--page-size", type=int, default=10, help="default results per page")
+    parser.add_argument("--max-page-size", type=int, default=100, help="largest resultsPerPage option")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="mean portal response time")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of portal requests answered with 503")
+    parser.add_argument("--tab-bytes", type=int, default=20000, help="approximate size of each tab page")
+    parser.add_argument("--document-bytes", type=int, default=200000, help="size of each linked document file")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="time per database round trip")
+    parser.add_argument("--spider-arg", action="append", default=[], metavar="NAME=VALUE", help="pass -a NAME=VALUE to the spider, e.g. crawler_type=decision")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="override a Scrapy setting")
+    parser.add_argument("--workdir", help="scratch directory (default: a new temporary directory)")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare with")
+    parser.add_argument("--verbose", action="store_true", help="keep the crawl's console logging")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="glenigan-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)  # logger_config creates its logs directory in the working directory on import
+    sys.path.insert(0, PROJECT_DIR)
+    os.environ["SCRAPY_SETTINGS_MODULE"] = "glenigan.settings"
+
+    import logging
+
+    import pymysql
+    from scrapy import signals
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    from benchmarks.fake_db import FakeDatabase
+    from benchmarks.mock_portal import PortalProcess
+    from glenigan.items import ApplicationItem, HtmlScraperItem
+    from glenigan.logger_config import listener
+    from glenigan.spiders.scraper import ScraperSpider
+
+    portal = PortalProcess(
+        applications=args.applications, page_size=args.page_size, max_page_size=args.max_page_size, latency_ms=args.latency_ms,
+        error_rate=args.error_rate, tab_bytes=args.tab_bytes, document_bytes=args.document_bytes,
+    )
+    port = portal.port
+    database = FakeDatabase(args.db_latency_ms)
+    pymysql.connect = database.connect
+
+    councils = {
+        f"Council {number}": {"code": number + 1, "url": f"http://127.0.0.{number + 1}:{port}/online-applications/search.do?action=advanced"}
+        for number in range(args.councils)
+    }
+    with open("councils.json", "w") as file:
+        json.dump(councils, file)
+    with open("database.ini", "w") as file:
+        file.write("[mysql]\nhost = localhost\nuser = bench\npassword = bench\ndatabase = bench\nport = 3306\n")
+
+    settings = get_project_settings()
+    settings.set("DB_CONFIG_FILE", os.path.abspath("database.ini"))
+    overrides = dict(parse_setting(text) for text in args.set)
+    for name, value in overrides.items():
+        settings.set(name, value, priority="cmdline")  # as scrapy crawl -s would
+
+    if not args.verbose:
+        for handler in listener.handlers:
+            if not isinstance(handler, logging.FileHandler):
+                handler.setLevel(logging.WARNING)
+    process = CrawlerProcess(settings, install_root_handler=False)
+    crawler = process.create_crawler(ScraperSpider)
+    response_seconds = []
+    application_seconds = []
+    started_at = {}
+    counts = {"applications": 0, "partial": 0, "responses": 0}
+    timing = {}
+
+    def response_received(response, request, spider):
+        counts["responses"] += 1
+        if "download_latency" in request.meta:
+            response_seconds.append(request.meta["download_latency"])
+
+    def item_scraped(item, spider):
+        now = time.monotonic()
+        if isinstance(item, ApplicationItem):
+            started_at[item["ref_no"]] = now
+        elif isinstance(item, HtmlScraperItem):
+            counts["applications"] += 1
+            if item.get("missing_tabs"):
+                counts["partial"] += 1
+            if item["ref_no"] in started_at:
+                application_seconds.append(now - started_at.pop(item["ref_no"]))
+
+    def engine_started():
+        timing["started"] = time.monotonic()
+
+    def spider_closed(spider, reason):
+        timing["finished"] = time.monotonic()
+        timing["reason"] = reason
+
+    crawler.signals.connect(response_received, signal=signals.response_received)
+    crawler.signals.connect(item_scraped, signal=signals.item_scraped)
+    crawler.signals.connect(engine_started, signal=signals.engine_started)
+    crawler.signals.connect(spider_closed, signal=signals.spider_closed)
+
+    sampler = RssSampler()
+    sampler.start()
+    process.crawl(
+        crawler,
+        councils_file=os.path.abspath("councils.json"),
+        db_config_file=os.path.abspath("database.ini"),
+        start_date="19/02/2025",
+        end_date="19/02/2025",
+        **dict(text.split("=", 1) for text in args.spider_arg),
+    )
+    process.start()
+    sampler.stopped.set()
+    portal.stop()
+
+    elapsed = timing["finished"] - timing["started"]
+    db = database.summary()
+    applications = counts["applications"]
+    results = {
+        "finish_reason": timing["reason"],
+        "elapsed_seconds": round(elapsed, 3),
+        "applications": applications,
+        "partial_applications": counts["partial"],
+        "applications_per_second": round(applications / elapsed, 3) if elapsed else None,
+        "responses": counts["responses"],
+        "portal_requests": portal.requests,
+        "portal_errors": portal.errors,
+        "response_seconds": percentiles(response_seconds),
+        "application_seconds": percentiles(application_seconds),
+        "peak_rss_mb": round(sampler.peak, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "db_round_trips_per_application": round(db["round_trips"] / applications, 3) if applications else None,
+        "db_rows_per_application": round(sum(db["rows"].values()) / applications, 3) if applications else None,
+        "db": db,
+        "stats": {name: value for name, value in crawler.stats.get_stats().items() if name.startswith("glenigan/")},
+    }
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {**vars(args), "settings": overrides},
+        "results": results,
+    }
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2, default=str)
+
+    print(f"{applications} applications in {elapsed:.1f}s: {results['applications_per_second']} apps/s, "
+          f"application p50/p99 {results['application_seconds']['p50']}/{results['application_seconds']['p99']}s, "
+          f"peak RSS {results['peak_rss_mb']} MB, {results['db_round_trips_per_application']} DB round trips per application")
+    print(f"Results written to {output} (scratch files in {workdir})")
+    if baseline:
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Compressed, segment-based storage for application HTML.
+
+Each application is appended to the current segment file as its own gzip member:
+a one-line JSON header followed by the concatenated HTML. Segments rotate once
+they reach a size limit. A SQLite index maps ref_no -> (segment, offset, length),
+so a single application is read back by seeking to its member and decompressing
+only that member.
+
+Usage:
+    python -m glenigan.archive migrate html_dumps html_archive [--delete]
+    python -m glenigan.archive read html_archive <ref_no>
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from glenigan.assembler import section_header, split_sections
+from glenigan.logger_config import logger
+
+INDEX_FILENAME = "index.sqlite"
+
+
+class SegmentArchive:
+    """Appends application records to rotating gzip segment files and indexes their offsets."""
+
+    def __init__(self, directory="html_archive", segment_size=256 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+        self.index = sqlite3.connect(os.path.join(directory, INDEX_FILENAME), check_same_thread=False)
+        self.index.execute("PRAGMA journal_mode=WAL")
+        self.index.execute("""
+            CREATE TABLE IF NOT EXISTS records (
+                ref_no TEXT NOT NULL,
+                segment TEXT NOT NULL,
+                "offset" INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                written_at REAL NOT NULL
+            )
+        """)
+        self.index.execute("CREATE INDEX IF NOT EXISTS idx_records_ref_no ON records (ref_no)")
+        columns = [row[1] for row in self.index.execute("PRAGMA table_info(records)")]
+        if "partial" not in columns:
+            self.index.execute("ALTER TABLE records ADD COLUMN partial INTEGER NOT NULL DEFAULT 0")
+        self.index.commit()
+        self.lock = threading.Lock()
+        self.segment_number = self.last_segment_number()
+        self.segment = None
+
+    def last_segment_number(self):
+        numbers = [
+            int(name[len("segment-"):-len(".gz")])
+            for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".gz")
+        ]
+        return max(numbers, default=1)
+
+    def segment_name(self):
+        return f"segment-{self.segment_number:05d}.gz"
+
+    def open_segment(self):
+        """Return the segment file to append to, rotating when the current one is full."""
+        if self.segment is None:
+            self.segment = open(os.path.join(self.directory, self.segment_name()), "ab")
+        if self.segment.tell() >= self.segment_size:
+            self.segment.close()
+            self.segment_number += 1
+            self.segment = open(os.path.join(self.directory, self.segment_name()), "ab")
+        return self.segment
+
+    def write(self, ref_no, chunks, url=None, partial=False):
+        """Append one application, given as an iterable of HTML text chunks; returns (segment, offset, length).
+
+        A partial record holds only the sections that changed; readers overlay it on earlier records.
+        """
+        header = json.dumps({"ref_no": ref_no, "url": url, "written_at": time.time(), "partial": partial}) + "\n"
+        with self.lock:
+            segment = self.open_segment()
+            offset = segment.tell()
+            with gzip.GzipFile(fileobj=segment, mode="wb", mtime=0) as member:
+                member.write(header.encode("utf-8"))
+                for chunk in chunks:
+                    member.write(chunk.encode("utf-8"))
+            segment.flush()
+            length = segment.tell() - offset
+            self.index.execute(
+                'INSERT INTO records (ref_no, segment, "offset", length, written_at, partial) VALUES (?, ?, ?, ?, ?, ?)',
+                (ref_no, self.segment_name(), offset, length, time.time(), int(partial)),
+            )
+            self.index.commit()
+        return self.segment_name(), offset, length
+
+    def sync(self):
+        """Flush the current segment to stable storage."""
+        with self.lock:
+            if self.segment is not None:
+                self.segment.flush()
+                os.fsync(self.segment.fileno())
+
+    def close(self):
+        self.sync()
+        with self.lock:
+            if self.segment is not None:
+                self.segment.close()
+                self.segment = None
+            self.index.close()
+
+
+class ArchiveReader:
+    """Reads single applications back out of a SegmentArchive directory."""
+
+    def __init__(self, directory="html_archive"):
+        self.directory = directory
+        self.index = sqlite3.connect(os.path.join(directory, INDEX_FILENAME))
+
+    def locate(self, ref_no):
+        """Return the (segment, offset, length) records needed to rebuild ref_no, oldest first.
+
+        That is the latest full record plus any partial records written after it.
+        """
+        locations = []
+        for segment, offset, length, partial in self.index.execute(
+            'SELECT segment, "offset", length, partial FROM records WHERE ref_no = ? ORDER BY rowid DESC',
+            (ref_no,),
+        ):
+            locations.append((segment, offset, length))
+            if not partial:
+                break
+        return list(reversed(locations))
+
+    def read_member(self, segment, offset, length):
+        with open(os.path.join(self.directory, segment), "rb") as file:
+            file.seek(offset)
+            data = gzip.decompress(file.read(length)).decode("utf-8")
+        header, _, html = data.partition("\n")
+        return json.loads(header), html
+
+    def read_record(self, ref_no):
+        """Return (header dict, html) for ref_no, or None if it is not archived."""
+        locations = self.locate(ref_no)
+        if not locations:
+            return None
+        header, html = self.read_member(*locations[0])
+        if len(locations) == 1:
+            return header, html
+        sections = split_sections(html)
+        for location in locations[1:]:
+            header, partial_html = self.read_member(*location)
+            sections.update(split_sections(partial_html))
+        return header, "".join(section_header(section) + body for section, body in sections.items())
+
+    def read(self, ref_no):
+        record = self.read_record(ref_no)
+        return record[1] if record else None
+
+    def refs(self):
+        for (ref_no,) in self.index.execute("SELECT DISTINCT ref_no FROM records ORDER BY ref_no"):
+            yield ref_no
+
+    def close(self):
+        self.index.close()
+
+
+def migrate_dumps(dump_dir, archive, delete=False):
+    """One-off import of an existing html_dumps directory into an archive."""
+    migrated = 0
+    for name in sorted(os.listdir(dump_dir)):
+        if not name.endswith(".html"):
+            continue
+        path = os.path.join(dump_dir, name)
+        with open(path, "r", encoding="utf-8") as file:
+            archive.write(name[:-len(".html")], iter(lambda: file.read(64 * 1024), ""))
+        if delete:
+            os.remove(path)
+        migrated += 1
+        if migrated % 1000 == 0:
+            logger.info(f"Migrated {migrated} dumps")
+    logger.info(f"Migrated {migrated} dumps from {dump_dir} to {archive.directory}")
+    return migrated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTML archive tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="import an html_dumps directory")
+    migrate.add_argument("dump_dir")
+    migrate.add_argument("archive_dir")
+    migrate.add_argument("--delete", action="store_true", help="remove each dump once archived")
+    read = commands.add_parser("read", help="print one application's HTML")
+    read.add_argument("archive_dir")
+    read.add_argument("ref_no")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        archive = SegmentArchive(args.archive_dir)
+        try:
+            migrate_dumps(args.dump_dir, archive, delete=args.delete)
+        finally:
+            archive.close()
+    else:
+        reader = ArchiveReader(args.archive_dir)
+        html = reader.read(args.ref_no)
+        reader.close()
+        if html is None:
+            sys.exit(f"{args.ref_no} is not in {args.archive_dir}")
+        sys.stdout.write(html)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import os
+import re
+from collections import deque
+
+from glenigan.fingerprint import content_hash
+
+SECTION_MARKER = re.compile(r"\n<!-- (Main Page|Tab: (\w+)) -->\n")
+
+
+def section_header(section):
+    """Return the marker written in front of a section of the concatenated HTML."""
+    return "\n<!-- Main Page -->\n" if section == "main" else f"\n<!-- Tab: {section} -->\n"
+
+
+def iter_html(segments, chunk_size=64 * 1024):
+    """Yield the concatenated HTML of spooled segments in chunks, without loading whole pages."""
+    for section, path in segments:
+        yield section_header(section)
+        with open(path, "r", encoding="utf-8") as segment:
+            while True:
+                chunk = segment.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def write_html(segments, file):
+    """Stream spooled segments into an open text file in the concatenated format."""
+    for chunk in iter_html(segments):
+        file.write(chunk)
+
+
+def discard_segments(segments):
+    """Remove spooled segment files and their directory once they are no longer needed."""
+    directories = set()
+    for _, path in segments:
+        directories.add(os.path.dirname(path))
+        if os.path.exists(path):
+            os.remove(path)
+    for directory in directories:
+        if os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+
+
+def fill_fingerprints(fingerprints, segments):
+    """Hash the spooled sections whose fingerprint was recorded without a hash; called off the reactor."""
+    paths = dict(segments)
+    for section, (digest, etag, last_modified) in list(fingerprints.items()):
+        if digest is None and section in paths:
+            with open(paths[section], "r", encoding="utf-8") as file:
+                fingerprints[section] = (content_hash(file.read()), etag, last_modified)
+
+
+def split_sections(html):
+    """Split concatenated HTML back into an ordered {section: body} dict."""
+    sections = {}
+    matches = list(SECTION_MARKER.finditer(html))
+    for position, match in enumerate(matches):
+        end = matches[position + 1].start() if position + 1 < len(matches) else len(html)
+        sections[match.group(2) or "main"] = html[match.end():end]
+    return sections
+
+
+def merge_sections(existing_html, segments):
+    """Overlay spooled segments onto previously saved concatenated HTML, keeping section order."""
+    sections = split_sections(existing_html) if existing_html else {}
+    for section, path in segments:
+        with open(path, "r", encoding="utf-8") as segment:
+            sections[section] = segment.read()
+    return "".join(section_header(section) + body for section, body in sections.items())
+
+
+class TabAssembler:
+    """Collects an application's main page and tabs as they arrive, in any order.
+
+    Each body is spooled to its own segment file as soon as it arrives, so only the
+    small assembler handle is kept in memory and nothing large travels in request meta.
+
+    For a rescrape with ``stored`` fingerprints (section -> (hash, etag, last_modified))
+    only the ``probe_tabs`` are requested first. If they and the main page are unchanged
+    the application is finished without fetching the rest; otherwise the remaining tabs
+    are released. Sections whose hash matches the stored one are not spooled, so only
+    changed sections end up in ``segments()``.
+
+    ``tabs`` is the application's tab profile. A rescrape may fetch fewer tabs than were
+    saved before, so its sections are always merged into the stored HTML, never replace it.
+    """
+
+    def __init__(self, ref_no, base_url, tabs, rescrape=False, spool_dir="spool", stored=None, probe_tabs=()):
+        self.ref_no = ref_no
+        self.base_url = base_url
+        self.tabs = list(tabs)
+        self.rescrape = rescrape
+        self.directory = os.path.join(spool_dir, ref_no)
+        self.stored = stored or {}
+        self.main = None
+        self.pages = {}
+        self.failed = {}
+        self.unchanged = set()
+        self.fingerprints = {}
+        probe_tabs = [tab_name for tab_name in self.tabs if tab_name in probe_tabs] if self.stored else []
+        self.queued = deque(probe_tabs or self.tabs)
+        self.held = [tab_name for tab_name in self.tabs if tab_name not in self.queued]
+        self.requested = 0
+        self.repairing = False
+
+    def next_tab(self):
+        """Return the next tab that has not been requested yet, or None."""
+        if not self.queued:
+            return None
+        self.requested += 1
+        return self.queued.popleft()
+
+    def spool(self, section, html):
+        """Write one section body to its segment file and return the path."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{section}.html")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(html)
+        return path
+
+    def record(self, section, html, etag=None, last_modified=None):
+        """Fingerprint a section; return True if it differs from the stored fingerprint.
+
+        Only a section with a stored fingerprint is hashed here, on the reactor. Any other section
+        is new, so it is recorded without a hash, to be hashed by the extraction workers or, with
+        extraction off, by fill_fingerprints in the writer thread.
+        """
+        if section not in self.stored:
+            self.fingerprints[section] = (None, etag, last_modified)
+            return True
+        digest = content_hash(html)
+        self.fingerprints[section] = (digest, etag, last_modified)
+        return self.stored.get(section, (None,))[0] != digest
+
+    def set_main(self, html):
+        if self.record("main", html):
+            self.main = self.spool("main", html)
+        else:
+            self.unchanged.add("main")
+
+    def add(self, tab_name, html, etag=None, last_modified=None):
+        if self.record(tab_name, html, etag, last_modified):
+            self.pages[tab_name] = self.spool(tab_name, html)
+        else:
+            self.unchanged.add(tab_name)
+
+    def not_modified(self, tab_name):
+        """The portal answered 304: keep the stored fingerprint."""
+        self.fingerprints[tab_name] = self.stored[tab_name]
+        self.unchanged.add(tab_name)
+
+    def resume(self, sections):
+        """Restore sections spooled before a restart ({section: (path, fingerprint)}) and queue only the rest."""
+        for section, (path, fingerprint) in sections.items():
+            if fingerprint:
+                self.fingerprints[section] = fingerprint
+            if section == "main":
+                self.main = path
+            elif section in self.tabs:
+                self.pages[section] = path
+        missing = [tab_name for tab_name in self.tabs if tab_name not in self.pages]
+        if not missing:
+            # Fetch the last tab again so the item is still emitted from a callback
+            missing = [self.tabs[-1]]
+            del self.pages[self.tabs[-1]]
+        self.queued = deque(missing)
+        self.held = []
+        self.requested = len(self.pages)  # Restored tabs count as requested and settled
+
+    def repair(self, tab_names):
+        """Fetch only the given tabs of an already saved application; they are merged into what is stored."""
+        self.queued = deque(tab_name for tab_name in self.tabs if tab_name in tab_names)
+        self.held = []
+        self.repairing = True
+
+    def fail(self, tab_name, error):
+        self.failed[tab_name] = error
+
+    @property
+    def settled(self):
+        """Number of requested tabs that have arrived, failed or were unchanged."""
+        return len(self.pages) + len(self.failed) + len(self.unchanged - {"main"})
+
+    def release_held(self):
+        """After a probe, decide whether the held tabs are needed; returns True if they were released."""
+        if not self.held or self.queued or self.settled < self.requested:
+            return False
+        if not self.pages and not self.failed and self.main is None:
+            self.held = []  # Probe tabs and main page are unchanged, skip the rest
+            return False
+        self.queued.extend(self.held)
+        self.held = []
+        return True
+
+    @property
+    def done(self):
+        """True once every requested tab has either arrived or failed and nothing is held back."""
+        return not self.held and not self.queued and self.settled == self.requested
+
+    @property
+    def missing_tabs(self):
+        """Tabs that could not be fetched, in tab order."""
+        return [tab_name for tab_name in self.tabs if tab_name in self.failed]
+
+    @property
+    def changed_tabs(self):
+        """Sections to write: None means everything (no stored fingerprints to compare with)."""
+        if not self.rescrape and not self.repairing:
+            return None
+        return [section for section, _ in self.segments()]
+
+    @property
+    def captured_tabs(self):
+        """Tabs fetched (or confirmed unchanged) by this scrape, in tab order."""
+        return [tab_name for tab_name in self.tabs if tab_name in self.pages or tab_name in self.unchanged]
+
+    def segments(self):
+        """Return (section, path) pairs for the main page and tabs in the fixed tab order."""
+        segments = [("main", self.main)] if self.main else []
+        segments.extend((tab_name, self.pages[tab_name]) for tab_name in self.tabs if tab_name in self.pages)
+        return segments
+
+    def discard(self):
+        discard_segments(self.segments())
@@ -0,0 +1,118 @@
+import json
+import sqlite3
+import threading
+
+from twisted.internet import defer, task, threads
+
+from glenigan.logger_config import logger
+
+
+class CheckpointStore:
+    """Local SQLite record of crawl progress, so a restarted crawl only fetches what is missing.
+
+    It records which applications were started, which of their sections (main page and
+    tabs) have been spooled, and which results pages of each search were processed.
+    Writes are buffered and committed in one transaction every ``flush_interval``
+    seconds or ``batch_size`` operations, in a worker thread.
+    """
+
+    def __init__(self, path="checkpoints.sqlite", flush_interval=2.0, batch_size=500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS apps (
+                ref_no TEXT PRIMARY KEY,
+                meta TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sections (
+                ref_no TEXT NOT NULL,
+                section TEXT NOT NULL,
+                path TEXT NOT NULL,
+                fingerprint TEXT,
+                PRIMARY KEY (ref_no, section)
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                search TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                PRIMARY KEY (search, page)
+            );
+        """)
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.flush_lock = defer.DeferredLock()
+        self.pending = []
+        self.flush_loop = None
+
+    def start(self):
+        self.flush_loop = task.LoopingCall(self.flush)
+        self.flush_loop.start(self.flush_interval, now=False)
+
+    def queue(self, sql, params):
+        self.pending.append((sql, params))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def start_app(self, ref_no, meta):
+        """Record an application whose main page has been requested; ``meta`` is enough to request it again."""
+        self.queue("INSERT OR REPLACE INTO apps (ref_no, meta) VALUES (?, ?)", (ref_no, json.dumps(meta)))
+
+    def section_done(self, ref_no, section, path, fingerprint=None):
+        self.queue(
+            "INSERT OR REPLACE INTO sections (ref_no, section, path, fingerprint) VALUES (?, ?, ?, ?)",
+            (ref_no, section, path, json.dumps(fingerprint) if fingerprint else None),
+        )
+
+    def finish_app(self, ref_no):
+        self.queue("DELETE FROM sections WHERE ref_no = ?", (ref_no,))
+        self.queue("DELETE FROM apps WHERE ref_no = ?", (ref_no,))
+
+    def page_done(self, search, page):
+        self.queue("INSERT OR IGNORE INTO pages (search, page) VALUES (?, ?)", (search, page))
+
+    def flush(self):
+        """Commit the buffered operations in a worker thread."""
+        if not self.pending:
+            return defer.succeed(None)
+        operations, self.pending = self.pending, []
+        d = self.flush_lock.run(threads.deferToThread, self.write, operations)
+        d.addErrback(lambda failure: logger.error(f"Failed to write {len(operations)} checkpoints: {failure.value}"))
+        return d
+
+    def write(self, operations):
+        with self.lock:
+            with self.db:
+                for sql, params in operations:
+                    self.db.execute(sql, params)
+
+    def unfinished_apps(self):
+        """Return [(ref_no, meta, {section: (path, fingerprint)})] for applications that were not saved."""
+        with self.lock:
+            apps = self.db.execute("SELECT ref_no, meta FROM apps").fetchall()
+            sections = {}
+            for ref_no, section, path, fingerprint in self.db.execute("SELECT ref_no, section, path, fingerprint FROM sections"):
+                sections.setdefault(ref_no, {})[section] = (path, tuple(json.loads(fingerprint)) if fingerprint else None)
+        return [(ref_no, json.loads(meta), sections.get(ref_no, {})) for ref_no, meta in apps]
+
+    def done_pages(self, search):
+        with self.lock:
+            return {page for (page,) in self.db.execute("SELECT page FROM pages WHERE search = ?", (search,))}
+
+    def close(self, finished=False):
+        """Flush and close; a crawl that finished cleanly forgets its page cursors."""
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+        d = self.flush()
+
+        def close_db(_):
+            with self.lock:
+                if finished:
+                    self.db.execute("DELETE FROM pages")
+                    self.db.commit()
+                self.db.close()
+
+        d.addBoth(lambda _: self.flush_lock.run(threads.deferToThread, close_db, None))
+        return d
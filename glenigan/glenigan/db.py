@@ -0,0 +1,153 @@
+import configparser
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+from glenigan.logger_config import logger
+
+
+def load_db_config(path):
+    """Read the [mysql] section of a database.ini file."""
+    config = configparser.ConfigParser()
+    config.read(path)
+    return {
+        "host": config["mysql"]["host"],
+        "user": config["mysql"]["user"],
+        "password": config["mysql"]["password"],
+        "database": config["mysql"]["database"],
+        "port": int(config["mysql"]["port"])
+    }
+
+
+class PoolTimeout(pymysql.err.OperationalError):
+    """No connection became free within the pool's acquire timeout."""
+
+
+class ConnectionPool:
+    """A small thread-safe pool of pymysql connections.
+
+    Connections are created lazily up to ``size``. A connection that has been idle
+    for longer than ``health_check_interval`` seconds is pinged (and transparently
+    reconnected) before it is handed out, and a connection that raised is rolled back
+    and dropped rather than returned to the pool. A caller that finds every connection
+    in use waits at most ``acquire_timeout`` seconds before PoolTimeout is raised.
+    """
+
+    def __init__(self, db_config, size=5, health_check_interval=30, acquire_timeout=30):
+        self.db_config = db_config
+        self.size = max(1, size)
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self, timeout=None):
+        """Take a healthy connection from the pool, opening one if the pool is not full yet.
+
+        Waits up to ``timeout`` seconds (default: the pool's acquire_timeout) for a connection to be released.
+        """
+        if timeout is None:
+            timeout = self.acquire_timeout
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    return pymysql.connect(**self.db_config)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                conn, last_used = self._idle.get(timeout=timeout)
+            except queue.Empty:
+                raise PoolTimeout(f"All {self.size} database connections stayed in use for {timeout}s") from None
+
+        if time.monotonic() - last_used > self.health_check_interval:
+            try:
+                conn.ping(reconnect=True)
+            except pymysql.MySQLError as e:
+                logger.warning(f"Discarding unhealthy database connection: {e}")
+                self.discard(conn)
+                return self.acquire(timeout)
+        return conn
+
+    def release(self, conn):
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    def discard(self, conn):
+        """Close a broken connection and free its slot."""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a ``with`` block."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            self.discard(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_config, size=5, health_check_interval=30, acquire_timeout=30):
+    """Return the process-wide pool for ``db_config``, creating it on first use."""
+    key = tuple(sorted(db_config.items()))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = _pools[key] = ConnectionPool(db_config, size, health_check_interval, acquire_timeout)
+        return pool
+
+
+def get_pool_from_settings(db_config, settings):
+    return get_pool(
+        db_config,
+        size=settings.getint("DB_POOL_SIZE", 5),
+        health_check_interval=settings.getfloat("DB_POOL_HEALTH_CHECK_INTERVAL", 30),
+        acquire_timeout=settings.getfloat("DB_POOL_ACQUIRE_TIMEOUT", 30),
+    )
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
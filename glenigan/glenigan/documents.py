@@ -0,0 +1,328 @@
+"""Downloads the files (plans, drawings, reports) linked from the documents tab.
+
+Files are fetched outside Scrapy's downloader, which holds every response body in memory:
+each download runs in a thread of its own pool and is streamed to a ``.part`` file in
+chunks, so a large drawing set never passes through the spider. Every council gets its
+own concurrency and bandwidth budget. An interrupted download resumes from its ``.part``
+file with a Range request. A SQLite manifest records each file by URL, size and SHA-1:
+URLs already stored are not fetched again, and a file whose content is already stored
+under another URL is kept once.
+
+DocumentPipeline downloads the links ExtractionPipeline parses during a crawl; the
+download command fetches the links already in the <app table>_document table.
+
+Usage:
+    python -m glenigan.documents download --db-config database.ini --directory documents
+    python -m glenigan.documents stats documents
+"""
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import urllib.request
+from urllib.error import HTTPError, URLError
+from urllib.parse import unquote, urlparse
+
+from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
+
+from glenigan.logger_config import logger
+from glenigan.status_index import council_code_of
+
+MANIFEST_FILENAME = "documents.sqlite"
+UNSAFE_CHARACTERS = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+class IncompleteDownload(Exception):
+    """The connection closed before the whole file arrived; the .part file is kept for resuming."""
+
+
+class Bandwidth:
+    """Token bucket shared by the downloads of one council; a rate of 0 means no limit."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.available = float(rate)
+        self.updated = time.monotonic()
+
+    def consume(self, amount):
+        """Take ``amount`` bytes from the bucket, sleeping until they are available."""
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(float(self.rate), self.available + (now - self.updated) * self.rate)
+            self.updated = now
+            self.available -= amount
+            wait = -self.available / self.rate if self.available < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+class DocumentStore:
+    """Files under <directory>/<council code>/<ref_no>/ and a manifest of what is stored."""
+
+    def __init__(self, directory="documents"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = sqlite3.connect(os.path.join(directory, MANIFEST_FILENAME), check_same_thread=False)
+        self.manifest.execute("PRAGMA journal_mode=WAL")
+        self.manifest.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                url TEXT PRIMARY KEY,
+                ref_no TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                sha1 CHAR(40) NOT NULL,
+                content_type TEXT,
+                downloaded_at REAL NOT NULL
+            )
+        """)
+        self.manifest.execute("CREATE INDEX IF NOT EXISTS idx_sha1 ON documents (sha1)")
+        self.manifest.commit()
+        self.lock = threading.Lock()
+
+    def path_for(self, ref_no, position, url):
+        """Where a document is stored: its position on the tab, then the file name from its URL."""
+        name = UNSAFE_CHARACTERS.sub("_", unquote(os.path.basename(urlparse(url).path))).strip("._") or "document"
+        return os.path.join(self.directory, council_code_of(ref_no), ref_no.replace("/", "_"), f"{position:03d}_{name[:120]}")
+
+    def stored(self, url):
+        """Return the path of url if it is stored and its file still has the recorded size, else None."""
+        with self.lock:
+            row = self.manifest.execute("SELECT path, size FROM documents WHERE url = ?", (url,)).fetchone()
+        if row and os.path.exists(row[0]) and os.path.getsize(row[0]) == row[1]:
+            return row[0]
+        return None
+
+    def path_of_hash(self, sha1):
+        with self.lock:
+            for (path,) in self.manifest.execute("SELECT path FROM documents WHERE sha1 = ?", (sha1,)):
+                if os.path.exists(path):
+                    return path
+        return None
+
+    def record(self, url, ref_no, path, size, sha1, content_type):
+        with self.lock:
+            self.manifest.execute(
+                "INSERT OR REPLACE INTO documents (url, ref_no, path, size, sha1, content_type, downloaded_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, ref_no, path, size, sha1, content_type, time.time()),
+            )
+            self.manifest.commit()
+
+    def stats(self):
+        """Return (documents, distinct files, bytes referenced, bytes on disk)."""
+        with self.lock:
+            return self.manifest.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT sha1), COALESCE(SUM(size), 0), "
+                "(SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM documents GROUP BY sha1)) FROM documents"
+            ).fetchone()
+
+    def close(self):
+        with self.lock:
+            self.manifest.commit()
+            self.manifest.close()
+
+
+def hash_file(path, chunk_size):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest
+
+
+def stream_to(path, url, bandwidth, chunk_size, timeout, headers):
+    """Download url into path, continuing a partial file; returns (bytes received, content type)."""
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    request_headers = dict(headers)
+    if offset:
+        request_headers["Range"] = f"bytes={offset}-"
+    try:
+        response = urllib.request.urlopen(urllib.request.Request(url, headers=request_headers), timeout=timeout)
+    except HTTPError as e:
+        if e.code == 416 and offset:
+            # The partial file is as long as the server's copy, or the file changed; start again
+            os.remove(path)
+            return stream_to(path, url, bandwidth, chunk_size, timeout, headers)
+        raise
+    with response:
+        if offset and response.status != 206:
+            offset = 0  # Range was ignored, the whole file is coming
+        expected = response.headers.get("Content-Length")
+        received = 0
+        with open(path, "ab" if offset else "wb") as file:
+            for chunk in iter(lambda: response.read(chunk_size), b""):
+                bandwidth.consume(len(chunk))
+                file.write(chunk)
+                received += len(chunk)
+        if expected is not None and received < int(expected):
+            raise IncompleteDownload(f"{url}: {received} of {expected} bytes")
+        return received, response.headers.get_content_type()
+
+
+def fetch_document(store, ref_no, position, url, bandwidth, chunk_size=64 * 1024, timeout=60, headers=None, retries=2):
+    """Runs in a download thread: stores one document unless it is stored already.
+
+    Returns (path, bytes received, outcome) where outcome is "stored", "duplicate" (the same
+    content is already stored under another URL) or "skipped" (the URL is stored already).
+    """
+    path = store.stored(url)
+    if path is not None:
+        return path, 0, "skipped"
+    path = store.path_for(ref_no, position, url)
+    partial = f"{path}.part"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    received = 0
+    for attempt in range(retries + 1):
+        try:
+            size, content_type = stream_to(partial, url, bandwidth, chunk_size, timeout, headers or {})
+            received += size
+            break
+        except (URLError, OSError, IncompleteDownload) as e:
+            if isinstance(e, HTTPError) and e.code < 500 or attempt == retries:
+                raise
+            logger.warning(f"Document download failed for {ref_no} ({e!r}), resuming {url} (retry {attempt + 1})")
+            time.sleep(2 ** attempt)
+    size = os.path.getsize(partial)
+    sha1 = hash_file(partial, chunk_size).hexdigest()
+    existing = store.path_of_hash(sha1)
+    if existing is not None and existing != path:
+        os.remove(partial)
+        store.record(url, ref_no, existing, size, sha1, content_type)
+        return existing, received, "duplicate"
+    os.replace(partial, path)
+    store.record(url, ref_no, path, size, sha1, content_type)
+    return path, received, "stored"
+
+
+class DocumentDownloader:
+    """Schedules document downloads from the reactor thread.
+
+    Downloads run on a pool of ``threads`` threads, at most ``concurrency`` at a time per
+    council, and each council's downloads share ``bandwidth`` bytes a second.
+    """
+
+    def __init__(self, store, threads=8, concurrency=2, bandwidth=0, chunk_size=64 * 1024, timeout=60, retries=2, headers=None, stats=None):
+        self.store = store
+        self.concurrency = max(1, concurrency)
+        self.bandwidth = bandwidth
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retries = retries
+        self.headers = headers or {}
+        self.stats = stats
+        self.pool = ThreadPool(minthreads=1, maxthreads=max(1, threads), name="document-downloader")
+        self.pool.start()
+        self.slots = {}  # council code -> DeferredSemaphore
+        self.limits = {}  # council code -> Bandwidth
+        self.pending = set()
+        self.in_flight = set()  # URLs queued or downloading, so one file is never written twice at once
+
+    def download(self, ref_no, position, url):
+        """Queue one document; the Deferred fires with fetch_document's result (failures are logged)."""
+        from twisted.internet import reactor
+
+        if url in self.in_flight:
+            return defer.succeed(None)
+        self.in_flight.add(url)
+        council = council_code_of(ref_no)
+        if council not in self.slots:
+            self.slots[council] = defer.DeferredSemaphore(self.concurrency)
+            self.limits[council] = Bandwidth(self.bandwidth)
+        d = self.slots[council].run(
+            threads.deferToThreadPool, reactor, self.pool, fetch_document, self.store, ref_no, position, url,
+            self.limits[council], self.chunk_size, self.timeout, self.headers, self.retries,
+        )
+        d.addCallback(self.downloaded, ref_no)
+        d.addErrback(self.download_failed, ref_no, url)
+        self.pending.add(d)
+        d.addBoth(self.forget, d, url)
+        return d
+
+    def downloaded(self, result, ref_no):
+        path, received, outcome = result
+        if outcome != "skipped":
+            logger.debug(f"Document for {ref_no} {outcome}: {path} ({received} bytes)")
+        if self.stats:
+            self.stats.inc_value(f"glenigan/documents/{outcome}")
+            self.stats.inc_value("glenigan/documents/bytes", received)
+        return result
+
+    def download_failed(self, failure, ref_no, url):
+        logger.error(f"Document download failed for {ref_no}: {url} ({failure.value!r})")
+        if self.stats:
+            self.stats.inc_value("glenigan/documents/failed")
+
+    def forget(self, result, d, url):
+        self.pending.discard(d)
+        self.in_flight.discard(url)
+        return result
+
+    def close(self):
+        """Wait for queued downloads, then stop the threads and close the manifest."""
+        d = defer.DeferredList(list(self.pending), consumeErrors=True)
+        d.addBoth(lambda _: self.pool.stop())
+        d.addBoth(lambda _: self.store.close())
+        return d
+
+
+def stored_document_links(pool, crawler_type="planning"):
+    """Yield (ref_no, position, url) for every document link in the extraction tables."""
+    from glenigan.extraction import extraction_tables
+
+    _, _, document_table = extraction_tables(crawler_type)
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT ref_no, position, url FROM {document_table} WHERE url IS NOT NULL ORDER BY ref_no, position")
+            yield from cursor.fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Document downloads")
+    commands = parser.add_subparsers(dest="command", required=True)
+    download = commands.add_parser("download", help="download the documents listed in the extraction tables")
+    download.add_argument("--db-config", required=True, help="database.ini")
+    download.add_argument("--crawler-type", default="planning", choices=["planning", "decision"])
+    download.add_argument("--directory", default="documents")
+    download.add_argument("--council", help="only this council code")
+    download.add_argument("--threads", type=int, default=8)
+    download.add_argument("--concurrency", type=int, default=2, help="downloads at once per council")
+    download.add_argument("--bandwidth", type=int, default=0, help="bytes a second per council (0: no limit)")
+    stats = commands.add_parser("stats", help="print what the document store holds")
+    stats.add_argument("directory")
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        store = DocumentStore(args.directory)
+        documents, files, referenced, stored = store.stats()
+        store.close()
+        print(f"{documents} documents in {files} files, {referenced / 1e6:.1f} MB referenced, {stored / 1e6:.1f} MB stored")
+        return
+
+    from twisted.internet import task
+
+    from glenigan.db import get_pool, load_db_config
+
+    links = [
+        link for link in stored_document_links(get_pool(load_db_config(args.db_config)), args.crawler_type)
+        if args.council is None or council_code_of(link[0]) == args.council
+    ]
+
+    def run(reactor):
+        downloader = DocumentDownloader(DocumentStore(args.directory), threads=args.threads, concurrency=args.concurrency, bandwidth=args.bandwidth)
+        for ref_no, position, url in links:
+            downloader.download(ref_no, position, url)
+        logger.info(f"Downloading {len(links)} documents into {args.directory}")
+        return downloader.close()
+
+    task.react(run)
+
+
+if __name__ == "__main__":
+    main()
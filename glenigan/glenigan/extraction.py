@@ -0,0 +1,246 @@
+"""Structured fields extracted from application HTML, in normalized tables.
+
+The ExtractionPipeline parses every scraped application in a pool of worker processes
+(glenigan.idox_fields) and writes the results here in batches:
+
+    <app table>_fields     one row per application: address, proposal, decision, dates, ...
+    <app table>_contact    one row per agent/applicant/councillor contact
+    <app table>_document   one row per entry of the documents tab
+
+The backfill command does the same for dumps saved before extraction existed.
+
+Usage:
+    python -m glenigan.extraction backfill --db-config database.ini --dumps html_dumps --processes 4
+    python -m glenigan.extraction backfill --db-config database.ini --archive html_archive
+    python -m glenigan.extraction backfill --db-config database.ini --tab-store tab_store
+    python -m glenigan.extraction parse html_dumps/101_25_00001_FUL.html
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from glenigan.archive import ArchiveReader
+from glenigan.db import get_pool, load_db_config
+from glenigan.idox_fields import APPLICATION_FIELDS, CONTACT_FIELDS, DATE_FIELDS, DOCUMENT_FIELDS, extract_dump, extract_html
+from glenigan.logger_config import logger
+from glenigan.tabstore import TabStoreReader
+
+
+def extraction_tables(crawler_type):
+    """Return the (fields, contact, document) table names for a crawler_type."""
+    app_table = "decision_app" if crawler_type == "decision" else "plan_app"
+    return f"{app_table}_fields", f"{app_table}_contact", f"{app_table}_document"
+
+
+def create_executor(processes):
+    """Process pool for parsing. Workers are spawned rather than forked, so they start without the reactor's threads."""
+    return ProcessPoolExecutor(max_workers=max(1, processes), mp_context=multiprocessing.get_context("spawn"))
+
+
+class ExtractionStore:
+    """Creates the extraction tables and writes batches of extraction results to them."""
+
+    def __init__(self, pool, crawler_type="planning"):
+        self.pool = pool
+        self.fields_table, self.contact_table, self.document_table = extraction_tables(crawler_type)
+
+    def create_tables(self):
+        columns = ",\n".join(
+            f"{field} DATE" if field in DATE_FIELDS else f"{field} TEXT"
+            for field in APPLICATION_FIELDS
+        )
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.fields_table} (
+                        ref_no VARCHAR(255) PRIMARY KEY,
+                        {columns},
+                        extracted_at DATETIME
+                    )
+                """)
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.contact_table} (
+                        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                        ref_no VARCHAR(255) NOT NULL,
+                        role VARCHAR(255),
+                        name TEXT,
+                        address TEXT,
+                        email VARCHAR(255),
+                        phone VARCHAR(64),
+                        INDEX idx_ref_no (ref_no)
+                    )
+                """)
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.document_table} (
+                        ref_no VARCHAR(255) NOT NULL,
+                        position INT NOT NULL,
+                        published_date DATE,
+                        document_type VARCHAR(255),
+                        description TEXT,
+                        drawing_number VARCHAR(255),
+                        url TEXT,
+                        PRIMARY KEY (ref_no, position)
+                    )
+                """)
+            conn.commit()
+
+    def write(self, results):
+        """Upsert a batch of extraction results in one transaction.
+
+        A field that was not extracted (its tab was not part of a rescrape) keeps its stored
+        value. Contacts and documents are replaced per application, but only when their tab
+        was parsed.
+        """
+        if not results:
+            return 0
+        applications = [
+            (result["ref_no"], *(result["application"][field] for field in APPLICATION_FIELDS))
+            for result in results
+        ]
+        contact_refs = [(result["ref_no"],) for result in results if result["contacts"] is not None]
+        contacts = [
+            (result["ref_no"], *(contact[field] for field in CONTACT_FIELDS))
+            for result in results if result["contacts"] for contact in result["contacts"]
+        ]
+        document_refs = [(result["ref_no"],) for result in results if result["documents"] is not None]
+        documents = [
+            (result["ref_no"], *(document[field] for field in DOCUMENT_FIELDS))
+            for result in results if result["documents"] for document in result["documents"]
+        ]
+        placeholders = ", ".join(["%s"] * (len(APPLICATION_FIELDS) + 1))
+        updates = ", ".join(f"{field} = COALESCE(VALUES({field}), {field})" for field in APPLICATION_FIELDS)
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT INTO {self.fields_table} (ref_no, {', '.join(APPLICATION_FIELDS)}, extracted_at) "
+                    f"VALUES ({placeholders}, NOW()) ON DUPLICATE KEY UPDATE {updates}, extracted_at = NOW()",
+                    applications,
+                )
+                if contact_refs:
+                    cursor.executemany(f"DELETE FROM {self.contact_table} WHERE ref_no = %s", contact_refs)
+                if contacts:
+                    cursor.executemany(
+                        f"INSERT INTO {self.contact_table} (ref_no, {', '.join(CONTACT_FIELDS)}) "
+                        f"VALUES ({', '.join(['%s'] * (len(CONTACT_FIELDS) + 1))})",
+                        contacts,
+                    )
+                if document_refs:
+                    cursor.executemany(f"DELETE FROM {self.document_table} WHERE ref_no = %s", document_refs)
+                if documents:
+                    cursor.executemany(
+                        f"INSERT INTO {self.document_table} (ref_no, {', '.join(DOCUMENT_FIELDS)}) "
+                        f"VALUES ({', '.join(['%s'] * (len(DOCUMENT_FIELDS) + 1))})",
+                        documents,
+                    )
+            conn.commit()
+        return len(applications) + len(contacts) + len(documents)
+
+    def application_urls(self, crawler_type="planning"):
+        """Return {ref_no: Url} from the application table, to resolve relative document links."""
+        app_table = "decision_app" if crawler_type == "decision" else "plan_app"
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT ref_no, Url FROM {app_table}")
+                return dict(cursor.fetchall())
+
+
+def archived_applications(archive_dir):
+    """Yield (ref_no, html) for every application in an HTML archive."""
+    reader = ArchiveReader(archive_dir)
+    try:
+        for ref_no in reader.refs():
+            yield ref_no, reader.read(ref_no)
+    finally:
+        reader.close()
+
+
+def stored_applications(store_dir):
+    """Yield (ref_no, html) for every application in a tab store."""
+    reader = TabStoreReader(store_dir)
+    try:
+        for ref_no in reader.refs():
+            yield ref_no, reader.read(ref_no)
+    finally:
+        reader.close()
+
+
+def backfill_jobs(dump_dir=None, archive_dir=None, urls=None, store_dir=None):
+    """Yield (worker function, args) for every saved application; archived or stored HTML is read lazily."""
+    urls = urls or {}
+    if archive_dir or store_dir:
+        applications = archived_applications(archive_dir) if archive_dir else stored_applications(store_dir)
+        for ref_no, html in applications:
+            yield extract_html, (ref_no, html, urls.get(ref_no))
+    else:
+        for name in sorted(os.listdir(dump_dir)):
+            if name.endswith(".html"):
+                yield extract_dump, (os.path.join(dump_dir, name), urls.get(name[:-len(".html")]))
+
+
+def backfill(store, executor, jobs, batch_size=500, in_flight=64):
+    """Run extraction jobs in the pool and write the results in batches; returns (applications, failures).
+
+    At most ``in_flight`` jobs are submitted at a time, so a large archive is never held in memory.
+    """
+    started = time.monotonic()
+    pending = deque()
+    batch, done, failures = [], 0, 0
+
+    def collect(future):
+        nonlocal done, failures
+        try:
+            batch.append(future.result())
+            done += 1
+        except Exception as e:
+            failures += 1
+            logger.error(f"Extraction failed: {e}")
+
+    for function, args in jobs:
+        pending.append(executor.submit(function, *args))
+        if len(pending) >= in_flight:
+            collect(pending.popleft())
+        if len(batch) >= batch_size:
+            store.write(batch)
+            batch = []
+            logger.info(f"Extracted {done} applications ({done / (time.monotonic() - started):.1f}/s), {failures} failed")
+    while pending:
+        collect(pending.popleft())
+    store.write(batch)
+    logger.info(f"Extracted {done} applications in {time.monotonic() - started:.1f}s, {failures} failed")
+    return done, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Structured field extraction")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fill = commands.add_parser("backfill", help="extract fields from saved dumps, an archive or a tab store")
+    fill.add_argument("--db-config", required=True, help="database.ini")
+    fill.add_argument("--crawler-type", default="planning", choices=["planning", "decision"])
+    source = fill.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dumps", help="html_dumps directory")
+    source.add_argument("--archive", help="html_archive directory")
+    source.add_argument("--tab-store", help="tab_store directory")
+    fill.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    fill.add_argument("--batch-size", type=int, default=500)
+    parse = commands.add_parser("parse", help="print the fields extracted from one dump as JSON")
+    parse.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "parse":
+        print(json.dumps(extract_dump(args.path), indent=2))
+        return
+
+    store = ExtractionStore(get_pool(load_db_config(args.db_config)), args.crawler_type)
+    store.create_tables()
+    urls = store.application_urls(args.crawler_type)
+    with create_executor(args.processes) as executor:
+        jobs = backfill_jobs(dump_dir=args.dumps, archive_dir=args.archive, urls=urls, store_dir=args.tab_store)
+        backfill(store, executor, jobs, batch_size=args.batch_size, in_flight=args.processes * 8)
+
+
+if __name__ == "__main__":
+    main()
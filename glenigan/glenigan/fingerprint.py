@@ -0,0 +1,54 @@
+import hashlib
+import re
+
+# Per-request tokens: csrf fields, session ids in links and script nonces differ on every fetch of a page
+CSRF_FIELD = re.compile(r'<(?:input|meta)[^>]*name="_csrf[^"]*"[^>]*>')
+SESSION_ID = re.compile(r';jsessionid=[0-9A-Za-z._-]+')
+NONCE = re.compile(r'(?<=nonce=")[^"]*|(?<=data-csrf=")[^"]*|(?<=data-token=")[^"]*')
+NONCE_ATTRIBUTES = ('nonce="', 'data-csrf="', 'data-token="')
+
+# Cache busters and page timestamps. Times are only stripped where the portal stamps the page ("Last
+# updated: 19 Feb 2025 14:05", "19/02/2025 14:05:10"), so drawing scales such as 1:50 and other
+# colon-separated content still count. Letter case is spelled out: a case-insensitive pattern scans
+# several times slower
+CACHE_BUSTER = re.compile(r'[?&](?:_|t|ts|timestamp)=\d{9,}')
+STAMP = re.compile(
+    r'(?:[Ll]ast (?:[Uu]pdated|[Mm]odified|[Rr]efreshed)|[Gg]enerated [Oo]n)'
+    r'[^<\d]{0,20}(?:[^<]{0,20}?\d{4})?,?\s*\d{1,2}:\d{2}(?::\d{2})?(?:\s*[AaPp][Mm])?'
+)
+STAMP_WORDS = ("last updated", "last modified", "last refreshed", "generated on")
+DATE_TIME = re.compile(r'(?<=\d\d[ T])\d{1,2}:\d{2}:\d{2}')
+
+# Each substitution only runs on pages where a literal search finds what it strips: one pattern per pass
+# keeps the regex engine's literal-prefix scan, which a single alternation loses, and most tabs need none
+CACHE_BUSTER_HINT = re.compile(r'=\d{9}')
+DATE_TIME_HINT = re.compile(r':\d\d:\d\d')
+
+
+def strip_tokens(html):
+    """Remove per-request tokens, leaving whitespace, timestamps and everything else as fetched."""
+    if "_csrf" in html:
+        html = CSRF_FIELD.sub("", html)
+    if "jsessionid" in html:
+        html = SESSION_ID.sub("", html)
+    if any(attribute in html for attribute in NONCE_ATTRIBUTES):
+        html = NONCE.sub("", html)
+    return html
+
+
+def normalize_html(html):
+    """Strip per-request tokens, session ids and page timestamps so equal content normalizes equally."""
+    html = strip_tokens(html)
+    if CACHE_BUSTER_HINT.search(html):
+        html = CACHE_BUSTER.sub("", html)
+    lowered = html.lower()
+    if any(word in lowered for word in STAMP_WORDS):
+        html = STAMP.sub("", html)
+    if DATE_TIME_HINT.search(html):
+        html = DATE_TIME.sub("", html)
+    return " ".join(html.split())
+
+
+def content_hash(html):
+    """Return the hex SHA-1 of the normalized HTML."""
+    return hashlib.sha1(normalize_html(html).encode("utf-8")).hexdigest()
@@ -0,0 +1,242 @@
+"""Parse the tabs of an Idox application into typed fields.
+
+These functions run in extraction worker processes (see glenigan.extraction), so this
+module must not import anything that sets up logging, the database or Scrapy.
+"""
+import os
+import re
+from datetime import datetime
+from urllib.parse import urljoin
+
+import lxml.html
+
+from glenigan.assembler import split_sections
+from glenigan.fingerprint import content_hash
+
+# Sections that carry fields; the main page is the summary tab under another name
+FIELD_SECTIONS = ["main", "summary", "details", "dates", "contacts", "documents"]
+
+# Normalized row label -> application field. Portals word some labels differently
+FIELD_LABELS = {
+    "reference": "reference",
+    "application reference": "reference",
+    "address": "address",
+    "site address": "address",
+    "proposal": "proposal",
+    "status": "status",
+    "decision": "decision",
+    "appeal status": "appeal_status",
+    "application type": "application_type",
+    "case officer": "case_officer",
+    "ward": "ward",
+    "parish": "parish",
+    "applicant name": "applicant_name",
+    "agent name": "agent_name",
+    "agent company name": "agent_company",
+    "application received": "received_date",
+    "application received date": "received_date",
+    "application validated": "validated_date",
+    "application validated date": "validated_date",
+    "expiry date": "expiry_date",
+    "determination deadline": "expiry_date",
+    "neighbour consultation expiry date": "consultation_expiry_date",
+    "standard consultation expiry date": "consultation_expiry_date",
+    "actual committee date": "committee_date",
+    "committee date": "committee_date",
+    "decision made date": "decision_date",
+    "decision date": "decision_date",
+    "decision issued date": "decision_issued_date",
+}
+
+APPLICATION_FIELDS = [
+    "reference", "address", "proposal", "status", "decision", "appeal_status", "application_type",
+    "case_officer", "ward", "parish", "applicant_name", "agent_name", "agent_company",
+    "received_date", "validated_date", "expiry_date", "consultation_expiry_date", "committee_date",
+    "decision_date", "decision_issued_date",
+]
+DATE_FIELDS = {field for field in APPLICATION_FIELDS if field.endswith("_date")}
+
+CONTACT_FIELDS = ["role", "name", "address", "email", "phone"]
+CONTACT_LABELS = {
+    "name": "name",
+    "address": "address",
+    "email": "email",
+    "personal email": "email",
+    "e-mail": "email",
+    "phone": "phone",
+    "personal phone": "phone",
+    "telephone": "phone",
+    "mobile phone": "phone",
+}
+
+DOCUMENT_FIELDS = ["position", "published_date", "document_type", "description", "drawing_number", "url"]
+DOCUMENT_COLUMNS = {
+    "date published": "published_date",
+    "document type": "document_type",
+    "description": "description",
+    "drawing number": "drawing_number",
+}
+
+DATE_FORMATS = ["%a %d %b %Y", "%d %b %Y", "%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d %B %Y"]
+WHITESPACE = re.compile(r"\s+")
+
+
+def clean(text):
+    text = WHITESPACE.sub(" ", text or "").strip()
+    return text or None
+
+
+def element_text(element):
+    return clean(" ".join(element.itertext()))
+
+
+def label_of(element):
+    return (element_text(element) or "").lower().rstrip(":").strip()
+
+
+def parse_date(text):
+    """Return an ISO date for the portal's date formats, or None ("Not Available", blanks)."""
+    text = clean(text)
+    if not text:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def key_values(document):
+    """Yield (label, value) for every table row with a header cell and a data cell."""
+    for row in document.iter("tr"):
+        header = row.find("th")
+        cell = row.find("td")
+        if header is not None and cell is not None:
+            yield label_of(header), element_text(cell)
+
+
+def parse_application_fields(document, fields):
+    """Fill ``fields`` from summary, details and dates rows; the first non-empty value wins."""
+    for label, value in key_values(document):
+        field = FIELD_LABELS.get(label)
+        if field is None or value is None or fields.get(field) is not None:
+            continue
+        fields[field] = parse_date(value) if field in DATE_FIELDS else value
+
+
+def parse_contacts(document):
+    """Return one dict per contact block: an h3 heading (the role) and what follows it up to the next heading."""
+    contacts = []
+    for heading in document.iter("h3"):
+        contact = {"role": element_text(heading)}
+        paragraphs = []
+        for sibling in heading.itersiblings():
+            if sibling.tag == "h3":
+                break
+            if sibling.tag == "p":
+                paragraphs.append(element_text(sibling))
+            for row in sibling.iter("tr"):
+                header, cell = row.find("th"), row.find("td")
+                if header is not None and cell is not None:
+                    field = CONTACT_LABELS.get(label_of(header))
+                    if field and contact.get(field) is None:
+                        contact[field] = element_text(cell)
+        paragraphs = [paragraph for paragraph in paragraphs if paragraph]
+        if paragraphs and contact.get("name") is None:
+            contact["name"] = paragraphs[0]
+        if len(paragraphs) > 1 and contact.get("address") is None:
+            contact["address"] = ", ".join(paragraphs[1:])
+        if any(contact.get(field) for field in CONTACT_FIELDS if field != "role"):
+            contacts.append({field: contact.get(field) for field in CONTACT_FIELDS})
+    return contacts
+
+
+def parse_documents(document, base_url=None):
+    """Return one dict per row of the documents table, with the link to the document."""
+    for table in document.iter("table"):
+        rows = list(table.iter("tr"))
+        if not rows:
+            continue
+        headers = [label_of(cell) for cell in rows[0] if cell.tag in ("th", "td")]
+        if "document type" not in headers and "description" not in headers:
+            continue
+        documents = []
+        for row in rows[1:]:
+            cells = [cell for cell in row if cell.tag in ("th", "td")]
+            if not cells:
+                continue
+            document_row = {field: None for field in DOCUMENT_FIELDS}
+            document_row["position"] = len(documents)
+            for header, cell in zip(headers, cells):
+                field = DOCUMENT_COLUMNS.get(header)
+                if field == "published_date":
+                    document_row[field] = parse_date(element_text(cell))
+                elif field:
+                    document_row[field] = element_text(cell)
+            links = row.xpath(".//a/@href")
+            if links:
+                document_row["url"] = urljoin(base_url, links[0]) if base_url else links[0]
+            documents.append(document_row)
+        return documents
+    return []
+
+
+def extract_sections(ref_no, sections, base_url=None):
+    """Parse {section: html} into {"application": {...}, "contacts": [...] or None, "documents": [...] or None}.
+
+    Contacts and documents are None when their tab is not among ``sections`` (a rescrape
+    carries only changed tabs), so callers can tell "no rows" from "not fetched".
+    """
+    fields = {}
+    contacts = documents = None
+    for section in FIELD_SECTIONS:
+        html = sections.get(section)
+        if not html or not html.strip():
+            continue
+        document = lxml.html.fromstring(html)
+        if section == "contacts":
+            contacts = parse_contacts(document)
+        elif section == "documents":
+            documents = parse_documents(document, base_url)
+        else:
+            parse_application_fields(document, fields)
+    return {
+        "ref_no": ref_no,
+        "application": {field: fields.get(field) for field in APPLICATION_FIELDS},
+        "sections": [section for section in FIELD_SECTIONS if section in sections],
+        "contacts": contacts,
+        "documents": documents,
+    }
+
+
+def extract_segments(ref_no, segments, base_url=None, unhashed=()):
+    """Worker entry point for the crawl: parse the spooled (section, path) segments of one application.
+
+    The ``unhashed`` sections are fingerprinted here too, off the crawl's process, into result["hashes"].
+    """
+    sections = {}
+    hashes = {}
+    for section, path in segments:
+        if section in FIELD_SECTIONS or section in unhashed:
+            with open(path, "r", encoding="utf-8") as file:
+                html = file.read()
+            if section in FIELD_SECTIONS:
+                sections[section] = html
+            if section in unhashed:
+                hashes[section] = content_hash(html)
+    result = extract_sections(ref_no, sections, base_url)
+    result["hashes"] = hashes
+    return result
+
+
+def extract_html(ref_no, html, base_url=None):
+    """Worker entry point for backfills: parse one application's concatenated HTML."""
+    return extract_sections(ref_no, split_sections(html), base_url)
+
+
+def extract_dump(path, base_url=None):
+    """Worker entry point for backfills: parse html_dumps/<ref_no>.html."""
+    with open(path, "r", encoding="utf-8") as file:
+        html = file.read()
+    return extract_html(os.path.basename(path)[:-len(".html")], html, base_url)
@@ -8,15 +8,22 @@ import scrapy
 class ApplicationItem(scrapy.Item):
     """Defines the structure of the scraped data."""
     ref_no = scrapy.Field()
+    council_code = scrapy.Field()
     link = scrapy.Field()
     is_rescrape = scrapy.Field()
 
 class HtmlScraperItem(scrapy.Item):
     ref_no = scrapy.Field()
     url = scrapy.Field()
-    html_content = scrapy.Field()
+    segments = scrapy.Field()  # (section, spool file path) pairs in page order
+    changed_tabs = scrapy.Field()  # None for a full scrape, else the sections in segments
+    fingerprints = scrapy.Field()  # section -> (content hash, etag, last_modified)
+    missing_tabs = scrapy.Field()  # tabs that still failed after retries; empty for a complete scrape
+    captured_tabs = scrapy.Field()  # tabs fetched or confirmed unchanged by this scrape (its tab profile, less failures)
     is_rescrape = scrapy.Field()
+    is_repair = scrapy.Field()  # fetched only the tabs a previous scrape was missing
+    documents = scrapy.Field()  # rows parsed from the documents tab by ExtractionPipeline, if it was fetched
 
     def __repr__(self):
         """Avoid logging large HTML content"""
-        return f"HtmlScraperItem(ref_no={self.get('ref_no')}, url={self.get('url')}, html_content=<hidden>)"
+        return f"HtmlScraperItem(ref_no={self.get('ref_no')}, url={self.get('url')}, segments={len(self.get('segments') or [])})"
@@ -1,5 +1,10 @@
+import atexit
 import logging.config
+import logging.handlers
 import os
+import queue
+import threading
+import time
 from datetime import datetime
 import scrapy.utils.log  # <-- Important to override Scrapy's logging behavior
 
@@ -10,85 +15,151 @@ os.makedirs(log_dir, exist_ok=True)
 # Use a fixed log filename to capture everything
 log_filename = os.path.join(log_dir, datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + '.log')
 
+# Records are handed to a queue by the logging thread and formatted and written once,
+# by a background listener, to the log file and the console
+log_queue = queue.SimpleQueue()
+
+
+class MessageSampler(logging.Filter):
+    """Thins out high-volume messages, matched by the start of the message.
+
+    A rule is {"every": n} (log one in n) or {"per_second": r} (at most r a second).
+    The number of messages dropped since the last one logged is appended to it.
+    Warnings and errors are never dropped.
+    """
+
+    def __init__(self, rules=None):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.configure(rules or {})
+
+    def configure(self, rules):
+        with self.lock:
+            self.rules = {prefix: dict(rule) for prefix, rule in rules.items()}
+            self.seen = {prefix: 0 for prefix in self.rules}
+            self.suppressed = {prefix: 0 for prefix in self.rules}
+            self.window = {prefix: (0.0, 0) for prefix in self.rules}
+
+    def filter(self, record):
+        if not self.rules or record.levelno > logging.INFO or not isinstance(record.msg, str):
+            return True
+        for prefix, rule in self.rules.items():
+            if record.msg.startswith(prefix):
+                return self.admit(record, prefix, rule)
+        return True
+
+    def admit(self, record, prefix, rule):
+        with self.lock:
+            if "every" in rule:
+                self.seen[prefix] += 1
+                allowed = (self.seen[prefix] - 1) % max(1, int(rule["every"])) == 0
+            else:
+                now = time.monotonic()
+                started, count = self.window[prefix]
+                if now - started >= 1.0:
+                    started, count = now, 0
+                allowed = count < rule["per_second"]
+                self.window[prefix] = (started, count + 1)
+            if not allowed:
+                self.suppressed[prefix] += 1
+                return False
+            suppressed, self.suppressed[prefix] = self.suppressed[prefix], 0
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+sampler = MessageSampler()
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener as they are, resolving only the message arguments in the logging thread."""
+
+    def prepare(self, record):
+        if record.args:
+            record.msg, record.args = record.getMessage(), None
+        return record
+
+
+def configure_log_sampling(rules):
+    """Apply LOG_SAMPLING rules ({message prefix: rule}) to every logger."""
+    sampler.configure(rules)
+
+
 # Define logging configuration
 def get_logging_config():
     return {
         'version': 1,
         'disable_existing_loggers': False,  # Ensure Scrapy logs are not blocked
-        'formatters': {
-            'detailed': {
-                'format': '%(asctime)s - %(levelname)s - %(name)s - %(filename)s - %(funcName)s - Line %(lineno)d - %(message)s',
-            },
-            'scrapy': {
-                'format': '%(asctime)s - %(levelname)s - %(name)s - %(message)s',
-            },
+        'filters': {
+            'sampling': {'()': lambda: sampler},
         },
         'handlers': {
-            'file': {
-                'level': 'DEBUG',  # Capture everything
-                'class': 'logging.FileHandler',
-                'filename': log_filename,
-                'formatter': 'detailed',
-            },
-            'console': {
-                'level': 'INFO',
-                'class': 'logging.StreamHandler',
-                'formatter': 'detailed',
-            },
-            'scrapy_log': {
-                'level': 'DEBUG',
-                'class': 'logging.FileHandler',
-                'filename': log_filename,
-                'formatter': 'scrapy',
+            # The only handler loggers write to; see start_listener for where records end up
+            'queue': {
+                '()': LogQueueHandler,
+                'queue': log_queue,
+                'filters': ['sampling'],
             },
         },
         'loggers': {
             '': {  # Root logger (captures everything)
-                'handlers': ['file', 'console'],
+                'handlers': ['queue'],
                 'level': 'DEBUG',
-                'propagate': True,
             },
             'logger': {  # Custom logger
-                'handlers': ['file', 'console'],
                 'level': 'DEBUG',
-                'propagate': False,
+                'propagate': True,
             },
             # Capture all Scrapy logs
             'scrapy': {
-                'handlers': ['scrapy_log', 'file', 'console'],
                 'level': 'DEBUG',
                 'propagate': True,
             },
             # Capture Scrapy retry and HTTP errors
             'scrapy.downloadermiddlewares.retry': {
-                'handlers': ['scrapy_log', 'file'],
                 'level': 'WARNING',
                 'propagate': True,
             },
             'scrapy.spidermiddlewares.httperror': {
-                'handlers': ['scrapy_log', 'file'],
                 'level': 'INFO',
                 'propagate': True,
             },
             'scrapy.extensions.logstats': {
-                'handlers': ['scrapy_log', 'file'],
                 'level': 'INFO',
                 'propagate': True,
             },
             'scrapy.core.engine': {
-                'handlers': ['scrapy_log', 'file'],
                 'level': 'DEBUG',
                 'propagate': True,
             },
         },
     }
 
+
+def start_listener():
+    """Start the background thread that writes queued records to the log file (everything) and the console (INFO and up)."""
+    detailed = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(filename)s - %(funcName)s - Line %(lineno)d - %(message)s')
+    file_handler = logging.FileHandler(log_filename, encoding='utf-8')
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(detailed)
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(detailed)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    # Drain the queue before the interpreter exits so the last records are not lost
+    atexit.register(listener.stop)
+    return listener
+
+
 # Apply logging configuration
 logging.config.dictConfig(get_logging_config())
+listener = start_listener()
 
 # Create logger instance
 logger = logging.getLogger('logger')
 
-# Override Scrapy’s logging to ensure it uses our settings
-scrapy.utils.log.configure_logging(get_logging_config())
-
+# Route Twisted and warnings into logging without a second root handler; settings.py sets
+# LOG_ENABLED = False so `scrapy crawl` does not install its own console handler either
+scrapy.utils.log.configure_logging(install_root_handler=False)
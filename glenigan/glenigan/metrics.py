@@ -0,0 +1,280 @@
+"""Per-stage latency histograms, counters and gauges in the Prometheus text format.
+
+The spider, pipeline and MetricsExporter record into one Metrics registry per crawler
+(see get_metrics). Recording is a dict lookup and a few additions, always on the reactor
+thread, so no locking is needed. With ``METRICS_ENABLED`` the MetricsExporter extension
+writes the registry to ``METRICS_FILE`` every ``METRICS_EXPORT_INTERVAL`` seconds, where
+node_exporter's textfile collector can pick it up. With ``METRICS_PORT`` it also serves
+the registry at http://METRICS_HOST:METRICS_PORT/metrics.
+
+Usage:
+    scrapy crawl scraper -s METRICS_ENABLED=1 -s METRICS_PORT=9410
+    curl -s localhost:9410/metrics | grep glenigan_fetch_seconds
+"""
+import os
+import time
+from bisect import bisect_left
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task, threads
+
+from glenigan.logger_config import logger
+from glenigan.status_index import council_code_of
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Callback of a request -> the crawl stage its latency is recorded under
+CALLBACK_STAGES = {"parse": "search", "parse_results": "results", "parse_html": "application", "parse_tab": "tab"}
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Family:
+    """A named metric with a fixed set of label names; one series per combination of label values."""
+
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.series = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Family):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self, const_names, const_values):
+        lines = self.header()
+        for values, total in sorted(self.series.items()):
+            lines.append(f"{self.name}{format_labels(const_names + self.labels, const_values + values)} {format_value(total)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *label_values, value):
+        self.series[label_values] = value
+
+
+class Histogram(Family):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            # Per-bucket counts (the last one is +Inf), then sum and count
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self, const_names, const_values):
+        lines = self.header()
+        names = const_names + self.labels
+        for values, (counts, total, count) in sorted(self.series.items()):
+            values = const_values + values
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(names, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(names, values)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(names, values)} {count}")
+        return lines
+
+
+class Metrics:
+    """The crawl's metric families; every series carries the crawler_type label.
+
+    Gauges are not kept up to date on the hot path: components register a sampler
+    (add_sampler) that sets them just before each export.
+    """
+
+    def __init__(self, crawler_type="planning"):
+        self.crawler_type = crawler_type
+        self.samplers = []
+        self.fetch_seconds = Histogram(
+            "glenigan_fetch_seconds", "Download latency of portal requests by crawl stage.", ("stage", "council")
+        )
+        self.db_seconds = Histogram(
+            "glenigan_db_seconds", "Duration of pipeline database writes.", ("operation",)
+        )
+        self.write_seconds = Histogram(
+            "glenigan_html_write_seconds", "Duration of application HTML writes.", ("council",)
+        )
+        self.applications = Counter(
+            "glenigan_applications_total",
+            "Applications by outcome: scraped, rescraped or skipped when found in search results; "
+            "partial or failed (main page) in the spider; saved or store_failed in the pipeline.",
+            ("council", "outcome"),
+        )
+        self.responses = Counter(
+            "glenigan_responses_total", "Portal responses by crawl stage and status code.", ("stage", "council", "status")
+        )
+        self.in_flight = Gauge("glenigan_applications_in_flight", "Applications whose tabs are being fetched.")
+        self.queue_depth = Gauge(
+            "glenigan_queue_depth",
+            "Requests waiting: in the scheduler, in the downloader, or held back by MAX_OPEN_APPLICATIONS.",
+            ("queue",),
+        )
+        self.pending_rows = Gauge("glenigan_db_pending_rows", "Rows buffered by the pipeline for the next database flush.")
+        self.pending_writes = Gauge("glenigan_html_pending_writes", "HTML writes handed to writer threads and not yet finished.")
+        self.families = [
+            self.fetch_seconds, self.db_seconds, self.write_seconds, self.applications, self.responses,
+            self.in_flight, self.queue_depth, self.pending_rows, self.pending_writes,
+        ]
+
+    def application(self, ref_no, outcome):
+        self.applications.inc(council_code_of(ref_no), outcome)
+
+    def add_sampler(self, sampler):
+        """Call ``sampler(metrics)`` before every export to refresh gauges."""
+        self.samplers.append(sampler)
+
+    def render(self):
+        """Return every family in the Prometheus text exposition format."""
+        for sampler in self.samplers:
+            try:
+                sampler(self)
+            except Exception as e:
+                logger.error(f"Metrics sampler {sampler!r} failed: {e}")
+        lines = []
+        for family in self.families:
+            lines.extend(family.render(("crawler_type",), (self.crawler_type,)))
+        return "\n".join(lines) + "\n"
+
+
+def get_metrics(crawler):
+    """Return the crawler's Metrics, creating it on first use so components can be built in any order."""
+    metrics = getattr(crawler, "glenigan_metrics", None)
+    if metrics is None:
+        metrics = crawler.glenigan_metrics = Metrics()
+    return metrics
+
+
+def write_atomically(path, text):
+    """Replace ``path`` in one step so a collector never reads a half-written file."""
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(temporary, path)
+
+
+class MetricsExporter:
+    """Records download latencies and exports the registry as a file and over HTTP."""
+
+    def __init__(self, crawler):
+        if not crawler.settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+        self.crawler = crawler
+        self.metrics = get_metrics(crawler)
+        self.path = crawler.settings.get("METRICS_FILE", "glenigan.prom")
+        self.interval = crawler.settings.getfloat("METRICS_EXPORT_INTERVAL", 15.0)
+        self.host = crawler.settings.get("METRICS_HOST", "127.0.0.1")
+        self.port = crawler.settings.getint("METRICS_PORT", 0)
+        self.export_loop = None
+        self.listener = None
+        self.writing = False
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.response_received, signal=signals.response_received)
+        self.metrics.add_sampler(self.sample_engine)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        self.export_loop = task.LoopingCall(self.export)
+        self.export_loop.start(self.interval, now=False)
+        if self.port:
+            self.listen()
+
+    def listen(self):
+        from twisted.internet import reactor
+        from twisted.web.resource import Resource
+        from twisted.web.server import Site
+
+        exporter = self
+
+        class MetricsResource(Resource):
+            isLeaf = True
+
+            def render_GET(self, request):
+                request.setHeader(b"Content-Type", b"text/plain; version=0.0.4; charset=utf-8")
+                return exporter.metrics.render().encode("utf-8")
+
+        self.listener = reactor.listenTCP(self.port, Site(MetricsResource()), interface=self.host)
+        logger.info(f"Serving metrics at http://{self.host}:{self.listener.getHost().port}/metrics")
+
+    def response_received(self, response, request, spider):
+        callback = getattr(request.callback, "__name__", None)
+        stage = CALLBACK_STAGES.get(callback, "other")
+        if stage == "results" and request.method == "POST":
+            stage = "search"  # the search form submission itself
+        council = request.meta.get("council_code") or council_code_of(request.meta.get("ref_no") or "")
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            self.metrics.fetch_seconds.observe(latency, stage, council)
+        self.metrics.responses.inc(stage, council, response.status)
+
+    def sample_engine(self, metrics):
+        engine = self.crawler.engine
+        if engine is not None and engine.slot is not None:
+            metrics.queue_depth.set("scheduler", value=len(engine.slot.scheduler))
+            metrics.queue_depth.set("downloader", value=len(engine.downloader.active))
+
+    def export(self):
+        """Render on the reactor thread and write the file in a worker thread; a slow disk skips a round."""
+        if self.writing:
+            return None
+        self.writing = True
+        started = time.monotonic()
+        d = threads.deferToThread(write_atomically, self.path, self.metrics.render())
+        d.addErrback(lambda failure: logger.error(f"Could not write metrics to {self.path}: {failure.value}"))
+        d.addBoth(self.exported, started)
+        return d
+
+    def exported(self, _, started):
+        self.writing = False
+        self.crawler.stats.inc_value("glenigan/metrics/export_seconds", time.monotonic() - started)
+
+    def spider_closed(self, spider):
+        if self.export_loop is not None and self.export_loop.running:
+            self.export_loop.stop()
+        if self.listener is not None:
+            self.listener.stopListening()
+        # Final figures for the finished crawl
+        try:
+            write_atomically(self.path, self.metrics.render())
+        except OSError as e:
+            logger.error(f"Could not write metrics to {self.path}: {e}")
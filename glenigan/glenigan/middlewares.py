@@ -3,7 +3,15 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+from urllib.parse import urlparse
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.httpobj import urlparse_cached
+
+from glenigan.replay import ReplayStore, request_key
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
@@ -101,3 +109,187 @@ class GleniganDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class CouncilBudget:
+    """Adaptive concurrency and delay for one council host (additive increase, multiplicative decrease)."""
+
+    def __init__(self, concurrency, max_concurrency, min_delay, max_delay, target_latency, fixed_concurrency=False):
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min_delay
+        self.target_latency = target_latency
+        self.fixed_concurrency = fixed_concurrency
+        self.latency = None
+
+    def record_success(self, latency):
+        if latency is not None:
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.delay = max(self.min_delay, self.delay * 0.75)
+        if self.delay < 0.05:
+            self.delay = self.min_delay
+        if self.fixed_concurrency or self.latency is None:
+            return
+        if self.latency <= self.target_latency:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+        elif self.latency > 2 * self.target_latency:
+            self.concurrency = max(1, self.concurrency - 1)
+
+    def record_error(self, retry_after=None):
+        if not self.fixed_concurrency:
+            self.concurrency = max(1, self.concurrency // 2)
+        delay = max(self.delay * 2, self.min_delay, 0.5)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        self.delay = min(self.max_delay, delay)
+
+
+class CouncilThrottleMiddleware:
+    """Keeps a separate concurrency and delay budget per council host.
+
+    The budget of each downloader slot is adapted from the observed latency and
+    the rate of 429/5xx responses and download errors, so fast portals run at full
+    speed while overloaded ones are backed off instead of retried into the ground.
+    Councils can pin ``concurrency``, ``download_delay`` and ``download_timeout``
+    in councils.json.
+    """
+
+    OVERRIDE_KEYS = ("concurrency", "download_delay", "download_timeout")
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool("COUNCIL_THROTTLE_ENABLED"):
+            raise NotConfigured
+        self.crawler = crawler
+        self.start_concurrency = settings.getint("COUNCIL_THROTTLE_START_CONCURRENCY", 4)
+        self.max_concurrency = settings.getint("COUNCIL_THROTTLE_MAX_CONCURRENCY", 16)
+        self.min_delay = settings.getfloat("COUNCIL_THROTTLE_MIN_DELAY", 0.0)
+        self.max_delay = settings.getfloat("COUNCIL_THROTTLE_MAX_DELAY", 30.0)
+        self.target_latency = settings.getfloat("COUNCIL_THROTTLE_TARGET_LATENCY", 2.0)
+        self.budgets = {}
+        self.overrides = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        return middleware
+
+    def spider_opened(self, spider):
+        for council_info in getattr(spider, "councils", {}).values():
+            override = {key: council_info[key] for key in self.OVERRIDE_KEYS if key in council_info}
+            if override:
+                self.overrides[urlparse(council_info["url"]).hostname] = override
+
+    def process_request(self, request, spider):
+        override = self.overrides.get(urlparse_cached(request).hostname)
+        if override and "download_timeout" in override:
+            request.meta["download_timeout"] = override["download_timeout"]
+        return None
+
+    def process_response(self, request, response, spider):
+        if "replay" in response.flags:
+            return response
+        if response.status == 429 or response.status >= 500:
+            retry_after = response.headers.get("Retry-After")
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            self.observe(request, error=True, retry_after=retry_after)
+        else:
+            self.observe(request)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.observe(request, error=True)
+        return None
+
+    def get_budget(self, request):
+        host = urlparse_cached(request).hostname
+        budget = self.budgets.get(host)
+        if budget is None:
+            override = self.overrides.get(host, {})
+            fixed = "concurrency" in override
+            budget = self.budgets[host] = CouncilBudget(
+                concurrency=override.get("concurrency", self.start_concurrency),
+                max_concurrency=override.get("concurrency", self.max_concurrency),
+                min_delay=override.get("download_delay", self.min_delay),
+                max_delay=self.max_delay,
+                target_latency=self.target_latency,
+                fixed_concurrency=fixed,
+            )
+        return host, budget
+
+    def observe(self, request, error=False, retry_after=None):
+        downloader = self.crawler.engine.downloader
+        key = request.meta.get("download_slot") or downloader.get_slot_key(request)
+        slot = downloader.slots.get(key)
+        if slot is None:
+            return
+        host, budget = self.get_budget(request)
+        if error:
+            budget.record_error(retry_after)
+            self.crawler.stats.inc_value(f"glenigan/throttle/{host}/errors")
+        else:
+            budget.record_success(request.meta.get("download_latency"))
+        slot.concurrency = budget.concurrency
+        slot.delay = budget.delay
+        self.crawler.stats.set_value(f"glenigan/throttle/{host}/concurrency", budget.concurrency)
+        self.crawler.stats.set_value(f"glenigan/throttle/{host}/delay", round(budget.delay, 3))
+
+
+class HttpReplayMiddleware:
+    """Records every response to a ReplayStore, or serves the crawl from one (see glenigan.replay).
+
+    It sits next to the download handler, so redirects, retried 5xx responses and
+    compressed bodies are recorded raw and replayed through the same middlewares.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.mode = settings.get("HTTP_REPLAY_MODE")
+        if self.mode not in ("record", "replay"):
+            raise NotConfigured
+        self.crawler = crawler
+        self.fetch_missing = settings.getbool("HTTP_REPLAY_FETCH_MISSING", False)
+        self.store = ReplayStore(settings.get("HTTP_REPLAY_PATH", "http_replay.sqlite"))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def key(self, request):
+        return request_key(request.method, request.url, request.body, request.meta.get("cookiejar"))
+
+    def process_request(self, request, spider):
+        if self.mode != "replay":
+            return None
+        recorded = self.store.get(self.key(request))
+        if recorded is None:
+            self.crawler.stats.inc_value("glenigan/replay/missing")
+            if self.fetch_missing:
+                return None
+            raise IgnoreRequest(f"No recorded response for {request.method} {request.url}")
+        status, headers, body = recorded
+        self.crawler.stats.inc_value("glenigan/replay/hits")
+        headers = Headers(headers)
+        response_class = responsetypes.from_args(headers=headers, url=request.url, body=body)
+        return response_class(url=request.url, status=status, headers=headers, body=body, request=request, flags=["replay"])
+
+    def process_response(self, request, response, spider):
+        if self.mode == "record" and "replay" not in response.flags:
+            headers = {
+                name.decode("latin-1"): [value.decode("latin-1") for value in values]
+                for name, values in response.headers.items()
+            }
+            self.store.put(self.key(request), request.method, request.url, response.status, headers, response.body)
+            self.crawler.stats.inc_value("glenigan/replay/recorded")
+        return response
+
+    def spider_closed(self, spider):
+        self.store.close()
@@ -6,98 +6,343 @@
 
 # useful for handling different item types with a single interface
 import os
+import time
+from datetime import datetime
 import pymysql
 import logging
-from scrapy.exceptions import DropItem
-import configparser
+from scrapy.exceptions import DropItem, NotConfigured
+from twisted.internet import defer, task, threads
+from twisted.python.threadpool import ThreadPool
 from glenigan.logger_config import logger
+from glenigan.db import load_db_config, get_pool_from_settings
+from glenigan.status_index import council_code_of
+from glenigan.archive import SegmentArchive
+from glenigan.tabstore import TabStore
+from glenigan.assembler import iter_html, write_html, merge_sections, discard_segments, fill_fingerprints
 from glenigan.items import ApplicationItem, HtmlScraperItem
+from glenigan.metrics import get_metrics
+from glenigan.extraction import ExtractionStore, create_executor
+from glenigan.idox_fields import extract_segments
+from glenigan.documents import DocumentDownloader, DocumentStore
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
+DEFAULT_DB_CONFIG = r"C:\Users\naafiah.fathima\Desktop\glenigan_scrapy\glenigan\glenigan\database.ini"
+
 class GleniganPipeline:
-    def __init__(self):
+    """Saves HTML dumps and writes application rows and scrape statuses behind the crawl.
+
+    Inserts and status updates are buffered and flushed as multi-row upserts in a
+    worker thread, either when a batch fills up or every DB_FLUSH_INTERVAL seconds,
+    so database round-trips never block the reactor.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=5.0, stats=None, settings=None, metrics=None):
         self.output_folder = "html_dumps"
-        self.db_config = self.load_db_config()
-        
+        self.html_storage = settings.get("HTML_STORAGE", "files") if settings else "files"
+        self.archive = None
+        self.tab_store = None
+        self.db_config = load_db_config(settings.get("DB_CONFIG_FILE", DEFAULT_DB_CONFIG) if settings else DEFAULT_DB_CONFIG)
+        self.settings = settings
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.stats = stats
+        self.metrics = metrics
+
         if not os.path.exists(self.output_folder):
             os.makedirs(self.output_folder)
 
-    def load_db_config(self):
-        config = configparser.ConfigParser()
-        config.read(r"C:\Users\naafiah.fathima\Desktop\glenigan_scrapy\glenigan\glenigan\database.ini")
-        return {
-            "host": config["mysql"]["host"],
-            "user": config["mysql"]["user"],
-            "password": config["mysql"]["password"],
-            "database": config["mysql"]["database"],
-            "port": int(config["mysql"]["port"])
-        }
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            batch_size=crawler.settings.getint("DB_BATCH_SIZE", 500),
+            flush_interval=crawler.settings.getfloat("DB_FLUSH_INTERVAL", 5.0),
+            stats=crawler.stats,
+            settings=crawler.settings,
+            metrics=get_metrics(crawler),
+        )
 
     def open_spider(self, spider):
-        self.conn = pymysql.connect(**self.db_config)
-        self.cursor = self.conn.cursor()
+        self.pool = get_pool_from_settings(self.db_config, self.settings or spider.settings)
         # Determine crawler_type from the spider (default to "planning")
         crawler_type = getattr(spider, "crawler_type", "planning")
         if crawler_type == "decision":
             self.table_app = "decision_app"
             self.table_err = "decision_error"
+            self.table_hash = "decision_tab_hash"
         else:
             self.table_app = "plan_app"
             self.table_err = "plan_error"
+            self.table_hash = "plan_tab_hash"
         # Create dynamic tables based on crawler_type
-        self.cursor.execute(f"""
-            CREATE TABLE IF NOT EXISTS {self.table_app} (
-                ref_no VARCHAR(255) PRIMARY KEY,
-                Url TEXT,
-                scrape_status VARCHAR(10) DEFAULT 'No'
-            )
-        """)
-        self.cursor.execute(f"""
-            CREATE TABLE IF NOT EXISTS {self.table_err} (
-                ref_no VARCHAR(255),
-                error TEXT,
-                PRIMARY KEY (ref_no)
-            )
-        """)
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.table_app} (
+                        ref_no VARCHAR(255) PRIMARY KEY,
+                        Url TEXT,
+                        scrape_status VARCHAR(10) DEFAULT 'No',
+                        council_code VARCHAR(32),
+                        captured_tabs TEXT,
+                        last_scraped_at DATETIME,
+                        last_changed_at DATETIME,
+                        INDEX idx_council_code (council_code)
+                    )
+                """)
+                self.add_council_code_column(cursor)
+                self.add_captured_tabs_column(cursor)
+                self.add_scrape_time_columns(cursor)
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.table_err} (
+                        ref_no VARCHAR(255),
+                        error TEXT,
+                        missing_tabs TEXT,
+                        Url TEXT,
+                        PRIMARY KEY (ref_no)
+                    )
+                """)
+                self.add_missing_tabs_columns(cursor)
+                cursor.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self.table_hash} (
+                        ref_no VARCHAR(255),
+                        tab VARCHAR(64),
+                        hash CHAR(40),
+                        etag VARCHAR(255),
+                        last_modified VARCHAR(64),
+                        PRIMARY KEY (ref_no, tab)
+                    )
+                """)
+            conn.commit()
         # Capture the check_updates flag from the spider
         self.check_updates = getattr(spider, "check_updates", "no")
+        # Keep the spider's status index in step with what has been committed
+        self.status_index = getattr(spider, "status_index", None)
+        # Applications are checkpointed as finished once their HTML is stored
+        self.checkpoints = getattr(spider, "checkpoints", None)
+        # Leased work units are completed only once their rows are written (see ScraperSpider.lease_more)
+        spider.flush_pipeline = self.flush
+        # Every tab in page order, to keep captured_tabs lists in a stable order
+        self.tab_order = getattr(spider, "tabs", [])
+
+        if self.html_storage == "archive":
+            self.archive = SegmentArchive(
+                self.settings.get("HTML_ARCHIVE_DIR", "html_archive"),
+                segment_size=self.settings.getint("HTML_ARCHIVE_SEGMENT_SIZE", 256 * 1024 * 1024),
+            )
+        elif self.html_storage == "cas":
+            self.tab_store = TabStore(self.settings.get("HTML_TAB_STORE_DIR", "tab_store"))
+
+        # Write-behind buffers, flushed together so an application row always lands before its status
+        self.pending_applications = []
+        self.pending_statuses = {}
+        self.pending_captured_merges = set()
+        self.pending_fingerprints = {}
+        self.pending_repaired = set()
+        self.flush_lock = defer.DeferredLock()
+        self.flush_loop = task.LoopingCall(self.flush)
+        self.flush_loop.start(self.flush_interval, now=False)
+
+        # HTML is written by a bounded pool of writer threads; at most HTML_WRITER_QUEUE_SIZE
+        # writes are outstanding, further items wait (and hold back the crawl) until a slot frees up
+        self.writer_pool = ThreadPool(minthreads=1, maxthreads=self.settings.getint("HTML_WRITER_THREADS", 4), name="html-writer")
+        self.writer_pool.start()
+        self.write_slots = defer.DeferredSemaphore(self.settings.getint("HTML_WRITER_QUEUE_SIZE", 64))
+        self.fsync_writes = self.settings.getbool("HTML_WRITER_FSYNC", False)
+        self.pending_writes = set()
+        if self.metrics is not None:
+            self.metrics.add_sampler(self.sample_metrics)
+
+    def sample_metrics(self, metrics):
+        metrics.pending_rows.set(value=len(self.pending_applications) + len(self.pending_statuses) + len(self.pending_fingerprints))
+        metrics.pending_writes.set(value=len(self.pending_writes))
+
+    def has_column(self, cursor, table, column):
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.columns "
+            "WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s",
+            (table, column)
+        )
+        return bool(cursor.fetchone()[0])
+
+    def add_council_code_column(self, cursor):
+        """Adds and backfills the indexed council_code column on tables created before it existed."""
+        if self.has_column(cursor, self.table_app, "council_code"):
+            return
+        logger.info(f"Adding council_code column to {self.table_app}")
+        cursor.execute(f"ALTER TABLE {self.table_app} ADD COLUMN council_code VARCHAR(32), ADD INDEX idx_council_code (council_code)")
+        cursor.execute(f"UPDATE {self.table_app} SET council_code = SUBSTRING_INDEX(ref_no, '_', 1) WHERE council_code IS NULL")
+
+    def add_captured_tabs_column(self, cursor):
+        """Adds the captured_tabs column to application tables created before tab profiles; NULL means every tab."""
+        if self.has_column(cursor, self.table_app, "captured_tabs"):
+            return
+        logger.info(f"Adding captured_tabs column to {self.table_app}")
+        cursor.execute(f"ALTER TABLE {self.table_app} ADD COLUMN captured_tabs TEXT")
+
+    def add_scrape_time_columns(self, cursor):
+        """Adds the last_scraped_at and last_changed_at columns used by the rescrape planner."""
+        if self.has_column(cursor, self.table_app, "last_scraped_at"):
+            return
+        logger.info(f"Adding last_scraped_at and last_changed_at columns to {self.table_app}")
+        cursor.execute(f"ALTER TABLE {self.table_app} ADD COLUMN last_scraped_at DATETIME, ADD COLUMN last_changed_at DATETIME")
+
+    def add_missing_tabs_columns(self, cursor):
+        """Adds the missing_tabs and Url columns used by repair crawls to error tables created before them."""
+        if self.has_column(cursor, self.table_err, "missing_tabs"):
+            return
+        logger.info(f"Adding missing_tabs and Url columns to {self.table_err}")
+        cursor.execute(f"ALTER TABLE {self.table_err} ADD COLUMN missing_tabs TEXT, ADD COLUMN Url TEXT")
 
     def process_item(self, item, spider):
         """Process items based on their type."""
         if isinstance(item, ApplicationItem):
             self.process_application_item(item)
         elif isinstance(item, HtmlScraperItem):
-            self.process_html_scraper_item(item)
+            return self.process_html_scraper_item(item)
         return item
 
     def process_application_item(self, item):
-        """Inserts application data into the dynamic table."""
+        """Queues the application row for the next batched insert."""
         ref_no = item["ref_no"]
-        url = item["link"]
-        self.cursor.execute(f"SELECT * FROM {self.table_app} WHERE ref_no = %s", (ref_no,))
-        if self.cursor.fetchone():
-            raise DropItem(f"Duplicate entry: {ref_no}")
-
-        try:
-            self.cursor.execute(f"INSERT INTO {self.table_app} (ref_no, Url) VALUES (%s, %s)", (ref_no, url))
-            self.conn.commit()
-            logger.info(f"Inserted Application: {ref_no}")
-        except Exception as e:
-            logger.error(f"Unexpected error processing {ref_no}: {e}")
-            raise DropItem(f"Unexpected error processing {ref_no}: {e}")
-    
-    
+        self.pending_applications.append((ref_no, item.get("council_code") or council_code_of(ref_no), item["link"]))
+        self.flush_if_full()
 
     def process_html_scraper_item(self, item):
-        """Process HTML scraper item and update scrape status immediately."""
+        """Hands the HTML to a writer thread; the scrape status is queued only once the write succeeded."""
+        from twisted.internet import reactor
+
+        started = time.monotonic()
+        d = self.write_slots.run(threads.deferToThreadPool, reactor, self.writer_pool, self.store_html, item)
+        d.addCallback(self.html_stored, item)
+        d.addErrback(self.html_store_failed, item)
+        self.pending_writes.add(d)
+        d.addBoth(self.forget_write, d)
+        if self.stats:
+            self.stats.inc_value("glenigan/html/reactor_seconds", time.monotonic() - started)
+        return d
+
+    def store_html(self, item):
+        """Runs in a writer thread: writes the spooled segments to the configured storage.
+
+        A rescrape carries only its changed sections (``changed_tabs``); they are merged into
+        the saved dump, appended as a partial archive record, or replace their entries in the
+        tab store manifest. Nothing is written if no section changed.
+        Returns (location, seconds, (HTML bytes, bytes written) or None).
+        """
+        started = time.monotonic()
         ref_no = item['ref_no']
-        html_content = item['html_content']
-        sanitized_ref_no = ref_no.replace("/", "_")
-        filename = os.path.join(self.output_folder, f"{sanitized_ref_no}.html")
-        with open(filename, "w", encoding="utf-8") as file:
-            file.write(html_content)
-        logger.info(f"Saved: {filename}")
-        self.update_scrape_status(ref_no, item.get("is_rescrape", False))
+        changed_tabs = item.get("changed_tabs")
+        partial = changed_tabs is not None
+        sizes = None
+        # Sections fetched for the first time are hashed here rather than on the reactor, unless the
+        # extraction workers already did
+        fill_fingerprints(item.get("fingerprints") or {}, item['segments'])
+        if partial and not changed_tabs:
+            location = "unchanged"
+        elif self.tab_store is not None:
+            sizes = self.tab_store.write_segments(ref_no, item['segments'], url=item.get("url"))
+            location = f"tab store ({sizes[1]} new bytes)"
+        elif self.archive is not None:
+            segment, offset, _ = self.archive.write(ref_no, iter_html(item['segments']), url=item.get("url"), partial=partial)
+            location = f"{segment} at {offset}"
+        else:
+            sanitized_ref_no = ref_no.replace("/", "_")
+            location = os.path.join(self.output_folder, f"{sanitized_ref_no}.html")
+            existing_html = None
+            if partial and os.path.exists(location):
+                with open(location, "r", encoding="utf-8") as file:
+                    existing_html = file.read()
+            with open(location, "w", encoding="utf-8") as file:
+                if partial:
+                    file.write(merge_sections(existing_html, item['segments']))
+                else:
+                    write_html(item['segments'], file)
+                if self.fsync_writes:
+                    file.flush()
+                    os.fsync(file.fileno())
+        discard_segments(item['segments'])
+        return location, time.monotonic() - started, sizes
+
+    def html_stored(self, result, item):
+        location, elapsed, sizes = result
+        logger.info(f"Saved: {item['ref_no']} to {location}")
+        if self.stats:
+            self.stats.inc_value("glenigan/html/writes")
+            self.stats.inc_value("glenigan/html/write_seconds", elapsed)
+            if sizes is not None:
+                self.stats.inc_value("glenigan/html/bytes", sizes[0])
+                self.stats.inc_value("glenigan/html/bytes_written", sizes[1])
+        if self.metrics is not None:
+            self.metrics.write_seconds.observe(elapsed, council_code_of(item['ref_no']))
+            self.metrics.application(item['ref_no'], "saved")
+        for section, (digest, etag, last_modified) in (item.get("fingerprints") or {}).items():
+            if digest is None:
+                continue
+            self.pending_fingerprints[(item['ref_no'], section)] = (item['ref_no'], section, digest, etag, last_modified)
+        partial = bool(item.get("missing_tabs"))
+        if item.get("is_repair") and not partial:
+            self.pending_repaired.add(item['ref_no'])
+        self.update_scrape_status(
+            item['ref_no'], item.get("url"), item.get("is_rescrape", False), partial,
+            captured_tabs=item.get("captured_tabs"),
+            # A rescrape or repair adds to the tabs captured before instead of replacing them
+            merge_captured=bool(item.get("is_rescrape") or item.get("is_repair")),
+            # Only a rescrape compares with a previous scrape; first scrapes, repairs and fills change nothing
+            changed=bool(item.get("is_rescrape") and item.get("changed_tabs")),
+        )
+        if self.checkpoints is not None:
+            self.checkpoints.finish_app(item['ref_no'])
+        return item
+
+    def html_store_failed(self, failure, item):
+        if self.metrics is not None:
+            self.metrics.application(item['ref_no'], "store_failed")
+        if self.checkpoints is not None:
+            self.checkpoints.finish_app(item['ref_no'])
+        logger.error(f"Failed to save HTML for {item['ref_no']}: {failure.value}")
+        discard_segments(item.get('segments') or [])
+        raise DropItem(f"Failed to save HTML for {item['ref_no']}: {failure.value}")
+
+    def forget_write(self, result, d):
+        self.pending_writes.discard(d)
+        return result
+
+    def update_scrape_status(self, ref_no, url, is_rescrape=False, partial=False, captured_tabs=None, merge_captured=False, changed=False):
+        """Queues a scrape_status update, the tabs captured and the scrape time; the latest status per ref_no wins within a batch.
+
+        last_changed_at moves only when a rescrape found sections that differed from the previous scrape.
+        """
+        if partial:
+            new_status = "Partial"
+        else:
+            new_status = "Yes(R)" if is_rescrape else "Yes"
+        captured = ",".join(captured_tabs) if captured_tabs is not None else None
+        now = datetime.now().replace(microsecond=0)
+        self.pending_statuses[ref_no] = (ref_no, council_code_of(ref_no), url, new_status, captured, now, now if changed else None)
+        if merge_captured:
+            self.pending_captured_merges.add(ref_no)
+        self.flush_if_full()
+
+    def flush_if_full(self):
+        if len(self.pending_applications) + len(self.pending_statuses) + len(self.pending_fingerprints) + len(self.pending_repaired) >= self.batch_size:
+            self.flush()
+
+    def flush(self, raise_failure=False):
+        """Hands the buffered rows to a worker thread; flushes run one at a time.
+
+        A failed flush is logged; with ``raise_failure`` the returned Deferred fails as well.
+        """
+        if not self.pending_applications and not self.pending_statuses and not self.pending_fingerprints and not self.pending_repaired:
+            return defer.succeed(None)
+        applications, self.pending_applications = self.pending_applications, []
+        statuses, self.pending_statuses = list(self.pending_statuses.values()), {}
+        merges, self.pending_captured_merges = self.pending_captured_merges, set()
+        fingerprints, self.pending_fingerprints = list(self.pending_fingerprints.values()), {}
+        repaired, self.pending_repaired = [(ref_no,) for ref_no in self.pending_repaired], set()
+        d = self.flush_lock.run(threads.deferToThread, self.write_batch, applications, statuses, fingerprints, repaired, merges)
+        d.addCallback(self.record_flush)
+        d.addCallback(self.update_status_index, applications, statuses)
+        d.addErrback(self.flush_failed, len(applications), len(statuses), raise_failure)
+        return d
 
     @retry(
         retry=retry_if_exception_type(pymysql.MySQLError),
@@ -105,23 +350,247 @@ class GleniganPipeline:
         wait=wait_exponential(multiplier=2, min=1, max=10),
         reraise=True,
     )
-    def update_scrape_status(self, ref_no, is_rescrape=False):
-        new_status = "Yes(R)" if is_rescrape else "Yes"
-        self.cursor.execute(f"SELECT scrape_status FROM {self.table_app} WHERE ref_no = %s", (ref_no,))
-        result = self.cursor.fetchone()
-        if result:
-            current_status = result[0]
-            if current_status == "Yes(R)":
-                logger.info(f"Status is already Yes(R) for {ref_no}. Not updating.")
-                return
-        try:
-            self.cursor.execute(f"UPDATE {self.table_app} SET scrape_status = %s WHERE ref_no = %s", (new_status, ref_no))
-            self.conn.commit()
-            logger.info(f"Updated scrape_status to '{new_status}' for {ref_no}")
-        except Exception as e:
-            logger.error(f"Error updating scrape_status for {ref_no}: {e}")
+    def write_batch(self, applications, statuses, fingerprints=(), repaired=(), merges=()):
+        """Runs in a worker thread: upserts a batch of application rows and statuses in one transaction; returns its duration."""
+        started = time.monotonic()
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                if merges:
+                    statuses = self.merge_captured_tabs(cursor, statuses, merges)
+                if applications:
+                    cursor.executemany(
+                        f"INSERT INTO {self.table_app} (ref_no, council_code, Url) VALUES (%s, %s, %s) "
+                        f"ON DUPLICATE KEY UPDATE ref_no = ref_no",
+                        applications,
+                    )
+                if statuses:
+                    # Never downgrade (No < Partial < Yes < Yes(R)), so workers finishing in any order agree
+                    cursor.executemany(
+                        f"INSERT INTO {self.table_app} (ref_no, council_code, Url, scrape_status, captured_tabs, last_scraped_at, last_changed_at) "
+                        f"VALUES (%s, %s, %s, %s, %s, %s, %s) "
+                        f"ON DUPLICATE KEY UPDATE scrape_status = IF("
+                        f"FIELD(VALUES(scrape_status), 'No', 'Partial', 'Yes', 'Yes(R)') >= FIELD(scrape_status, 'No', 'Partial', 'Yes', 'Yes(R)'), "
+                        f"VALUES(scrape_status), scrape_status), "
+                        f"captured_tabs = VALUES(captured_tabs), last_scraped_at = VALUES(last_scraped_at), "
+                        f"last_changed_at = COALESCE(VALUES(last_changed_at), last_changed_at)",
+                        statuses,
+                    )
+                if fingerprints:
+                    cursor.executemany(
+                        f"INSERT INTO {self.table_hash} (ref_no, tab, hash, etag, last_modified) VALUES (%s, %s, %s, %s, %s) "
+                        f"ON DUPLICATE KEY UPDATE hash = VALUES(hash), etag = VALUES(etag), last_modified = VALUES(last_modified)",
+                        fingerprints,
+                    )
+                if repaired:
+                    # The missing tabs have been fetched, so the error row is resolved
+                    cursor.executemany(f"DELETE FROM {self.table_err} WHERE ref_no = %s", repaired)
+            conn.commit()
+        elapsed = time.monotonic() - started
+        if self.stats:
+            self.stats.inc_value("glenigan/db/flushes")
+            self.stats.inc_value("glenigan/db/rows_written", len(applications) + len(statuses) + len(fingerprints) + len(repaired))
+            self.stats.inc_value("glenigan/db/flush_seconds", elapsed)
+        logger.info(f"Flushed {len(applications)} applications and {len(statuses)} status updates in {elapsed:.3f}s")
+        return elapsed
+
+    def merge_captured_tabs(self, cursor, statuses, merges):
+        """Add the tabs captured before to the status rows of rescraped and repaired applications.
+
+        An application saved before captured_tabs was recorded has NULL, meaning every tab; it stays NULL.
+        """
+        refs = [row[0] for row in statuses if row[0] in merges]
+        if not refs:
+            return statuses
+        cursor.execute(
+            f"SELECT ref_no, scrape_status, captured_tabs FROM {self.table_app} WHERE ref_no IN ({', '.join(['%s'] * len(refs))})",
+            refs,
+        )
+        stored = {ref_no: (status, captured) for ref_no, status, captured in cursor.fetchall()}
+        merged = []
+        for ref_no, council_code, url, status, captured, *times in statuses:
+            if ref_no in merges and ref_no in stored:
+                old_status, old_captured = stored[ref_no]
+                if old_captured is None and old_status != "No":
+                    captured = None
+                elif old_captured:
+                    tabs = set(old_captured.split(",")) | set((captured or "").split(","))
+                    captured = ",".join(tab_name for tab_name in self.tab_order if tab_name in tabs)
+            merged.append((ref_no, council_code, url, status, captured, *times))
+        return merged
+
+    def record_flush(self, elapsed):
+        if self.metrics is not None:
+            self.metrics.db_seconds.observe(elapsed, "flush")
+
+    def update_status_index(self, _, applications, statuses):
+        if self.status_index is None:
+            return
+        for ref_no, _code, _url in applications:
+            self.status_index.update(ref_no, "No", only_new=True)
+        for ref_no, _code, _url, status, *_ in statuses:
+            self.status_index.update(ref_no, status)
+
+    def flush_failed(self, failure, application_count, status_count, raise_failure=False):
+        logger.error(f"Failed to flush {application_count} applications and {status_count} status updates: {failure.value}")
+        if raise_failure:
+            return failure
+
+    def close_spider(self, spider):
+        """Waits for outstanding HTML writes, then flushes pending rows; the shared pool is closed when the engine stops."""
+        if self.flush_loop.running:
+            self.flush_loop.stop()
+        d = defer.DeferredList(list(self.pending_writes), consumeErrors=True)
+        d.addBoth(lambda _: self.close_writers())
+        d.addBoth(lambda _: self.flush())
+        return d
+
+    def close_writers(self):
+        self.writer_pool.stop()
+        if self.archive is not None:
+            self.archive.close()
+        if self.tab_store is not None:
+            self.tab_store.close()
+
+
+class ExtractionPipeline:
+    """Parses each application's tabs into typed fields in worker processes and writes them in batches.
+
+    Runs before GleniganPipeline, which removes the spooled tab files once the HTML is stored;
+    the item moves on when its tabs have been parsed. Parsing never blocks the reactor, and
+    an application whose parsing fails is still saved. See glenigan.extraction for the tables.
+    """
+
+    def __init__(self, settings, stats=None):
+        self.settings = settings
+        self.stats = stats
+        self.db_config = load_db_config(settings.get("DB_CONFIG_FILE", DEFAULT_DB_CONFIG))
+        self.batch_size = max(1, settings.getint("EXTRACTION_BATCH_SIZE", 200))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("EXTRACTION_ENABLED"):
+            raise NotConfigured
+        return cls(crawler.settings, stats=crawler.stats)
+
+    def open_spider(self, spider):
+        self.store = ExtractionStore(get_pool_from_settings(self.db_config, self.settings), getattr(spider, "crawler_type", "planning"))
+        self.store.create_tables()
+        self.executor = create_executor(self.settings.getint("EXTRACTION_PROCESSES", 2))
+        self.pending_results = []
+        self.flush_lock = defer.DeferredLock()
+        self.flush_loop = task.LoopingCall(self.flush)
+        self.flush_loop.start(self.settings.getfloat("DB_FLUSH_INTERVAL", 5.0), now=False)
+
+    def process_item(self, item, spider):
+        if not isinstance(item, HtmlScraperItem) or item.get("changed_tabs") == []:
+            return item
+        started = time.monotonic()
+        # New sections are hashed in the worker as well (see GleniganPipeline.store_html for the fallback)
+        unhashed = [section for section, (digest, _, _) in (item.get("fingerprints") or {}).items() if digest is None]
+        d = self.submit(extract_segments, item['ref_no'], item['segments'], item.get("url"), unhashed)
+        d.addCallback(self.extracted, item, started)
+        d.addErrback(self.extraction_failed, item)
+        return d
+
+    def submit(self, function, *args):
+        """Run ``function`` in the process pool; the Deferred fires on the reactor thread."""
+        from twisted.internet import reactor
+
+        d = defer.Deferred()
+
+        def done(future):
+            if future.exception() is not None:
+                reactor.callFromThread(d.errback, future.exception())
+            else:
+                reactor.callFromThread(d.callback, future.result())
+
+        self.executor.submit(function, *args).add_done_callback(done)
+        return d
+
+    def extracted(self, result, item, started):
+        if self.stats:
+            self.stats.inc_value("glenigan/extraction/applications")
+            self.stats.inc_value("glenigan/extraction/seconds", time.monotonic() - started)
+        fingerprints = item.get("fingerprints") or {}
+        for section, digest in result.pop("hashes", {}).items():
+            _, etag, last_modified = fingerprints[section]
+            fingerprints[section] = (digest, etag, last_modified)
+        self.pending_results.append(result)
+        if len(self.pending_results) >= self.batch_size:
+            self.flush()
+        if result["documents"] is not None:
+            item["documents"] = result["documents"]
+        return item
+
+    def extraction_failed(self, failure, item):
+        logger.error(f"Field extraction failed for {item['ref_no']}: {failure.value!r}")
+        if self.stats:
+            self.stats.inc_value("glenigan/extraction/failed")
+        return item
+
+    def flush(self):
+        if not self.pending_results:
+            return defer.succeed(None)
+        results, self.pending_results = self.pending_results, []
+        d = self.flush_lock.run(threads.deferToThread, self.store.write, results)
+        d.addCallback(self.flushed, len(results))
+        d.addErrback(lambda failure: logger.error(f"Failed to write extracted fields for {len(results)} applications: {failure.value}"))
+        return d
+
+    def flushed(self, rows, applications):
+        if self.stats:
+            self.stats.inc_value("glenigan/extraction/rows_written", rows)
+        logger.info(f"Wrote extracted fields for {applications} applications ({rows} rows)")
+
+    def close_spider(self, spider):
+        """Stops the workers once every item has been parsed, then writes what is left."""
+        if self.flush_loop.running:
+            self.flush_loop.stop()
+        d = threads.deferToThread(self.executor.shutdown)
+        d.addBoth(lambda _: self.flush())
+        return d
+
+
+class DocumentPipeline:
+    """Downloads the files linked from each application's documents tab (see glenigan.documents).
+
+    Runs after ExtractionPipeline, which parses the links. The item moves on at once;
+    downloads are queued per council and streamed to disk by their own threads, and the
+    spider closes once the queue has drained.
+    """
+
+    def __init__(self, settings, stats=None):
+        self.settings = settings
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("DOCUMENTS_ENABLED"):
+            raise NotConfigured
+        if not crawler.settings.getbool("EXTRACTION_ENABLED"):
+            logger.warning("DOCUMENTS_ENABLED needs EXTRACTION_ENABLED to find document links; no documents will be downloaded")
+            raise NotConfigured
+        return cls(crawler.settings, stats=crawler.stats)
+
+    def open_spider(self, spider):
+        self.downloader = DocumentDownloader(
+            DocumentStore(self.settings.get("DOCUMENTS_DIR", "documents")),
+            threads=self.settings.getint("DOCUMENT_THREADS", 8),
+            concurrency=self.settings.getint("DOCUMENT_CONCURRENCY_PER_COUNCIL", 2),
+            bandwidth=self.settings.getint("DOCUMENT_BANDWIDTH_PER_COUNCIL", 0),
+            chunk_size=self.settings.getint("DOCUMENT_CHUNK_SIZE", 64 * 1024),
+            timeout=self.settings.getfloat("DOCUMENT_TIMEOUT", 60.0),
+            retries=self.settings.getint("DOCUMENT_RETRY_TIMES", 2),
+            headers={"User-Agent": self.settings.get("USER_AGENT")},
+            stats=self.stats,
+        )
+
+    def process_item(self, item, spider):
+        if isinstance(item, HtmlScraperItem):
+            for document in item.get("documents") or []:
+                if document["url"]:
+                    self.downloader.download(item["ref_no"], document["position"], document["url"])
+        return item
 
     def close_spider(self, spider):
-        """Closes the database connection when the spider finishes."""
-        self.cursor.close()
-        self.conn.close()
+        return self.downloader.close()
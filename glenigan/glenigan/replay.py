@@ -0,0 +1,107 @@
+"""Record portal exchanges once and replay them offline.
+
+With ``HTTP_REPLAY_MODE = "record"`` every response the crawl receives is stored in a
+SQLite file (bodies zlib-compressed). With ``"replay"`` the HttpReplayMiddleware serves
+those responses instead of going to the network, so development runs and benchmarks
+are fast, repeatable and leave the portals alone.
+
+Requests are keyed by method, canonical URL and search cookie jar (the same results
+page URL returns different results in different searches). A POST is also keyed by its
+form data without ``_csrf``, whose value changes on every visit to the search form.
+
+Usage:
+    scrapy crawl scraper -s HTTP_REPLAY_MODE=record -s HTTP_REPLAY_PATH=feb.sqlite
+    scrapy crawl scraper -s HTTP_REPLAY_MODE=replay -s HTTP_REPLAY_PATH=feb.sqlite
+    python -m glenigan.replay feb.sqlite
+"""
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import parse_qsl, urlencode
+
+from w3lib.url import canonicalize_url
+
+# Form fields that differ between otherwise identical submissions
+VOLATILE_FORM_FIELDS = {"_csrf"}
+
+
+def request_key(method, url, body=b"", cookiejar=None):
+    """Return the lookup key for a request."""
+    parts = [method.upper(), canonicalize_url(url), str(cookiejar or "")]
+    if method.upper() == "POST" and body:
+        fields = parse_qsl(body.decode("utf-8", "replace"), keep_blank_values=True)
+        parts.append(urlencode(sorted((name, value) for name, value in fields if name not in VOLATILE_FORM_FIELDS)))
+    return hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class ReplayStore:
+    """SQLite file of recorded responses, keyed by request_key()."""
+
+    def __init__(self, path="http_replay.sqlite", commit_every=200):
+        self.path = path
+        self.commit_every = commit_every
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS exchanges (
+                key TEXT PRIMARY KEY,
+                method TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                recorded_at REAL NOT NULL
+            )
+        """)
+        self.db.commit()
+        self.lock = threading.Lock()
+        self.uncommitted = 0
+
+    def put(self, key, method, url, status, headers, body):
+        """Store one response; ``headers`` is {name: [values]}. The last response for a key wins."""
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO exchanges (key, method, url, status, headers, body, recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, method, url, status, json.dumps(headers), zlib.compress(body, 6), time.time()),
+            )
+            self.uncommitted += 1
+            if self.uncommitted >= self.commit_every:
+                self.db.commit()
+                self.uncommitted = 0
+
+    def get(self, key):
+        """Return (status, headers, body) or None."""
+        with self.lock:
+            row = self.db.execute("SELECT status, headers, body FROM exchanges WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        status, headers, body = row
+        return status, json.loads(headers), zlib.decompress(body)
+
+    def summary(self):
+        """Return (exchange count, compressed body bytes) per method."""
+        with self.lock:
+            return self.db.execute("SELECT method, COUNT(*), SUM(LENGTH(body)) FROM exchanges GROUP BY method").fetchall()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarise a recorded HTTP replay file")
+    parser.add_argument("path")
+    args = parser.parse_args(argv)
+    store = ReplayStore(args.path)
+    for method, count, size in store.summary():
+        print(f"{method:<6} {count:>8} exchanges {size or 0:>12} compressed bytes")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
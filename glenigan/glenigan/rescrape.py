@@ -0,0 +1,189 @@
+"""Chooses which saved applications a rescrape run fetches again.
+
+Each saved application is put in a class by what is known about it: when it last changed
+(last_changed_at), and, from the extraction tables, when it was validated and whether it
+has been decided. Every class has a rescrape interval (RESCRAPE_INTERVALS, in days), and an
+application's priority is the time since it was last scraped divided by its interval. An
+application is due once its priority reaches 1. Due applications are rescraped in order of
+priority until the run's request budget is spent, so an undecided application validated last
+week is fetched every few days while one decided years ago waits months.
+
+`-a crawl_mode=rescrape` runs a plan; the plan command shows what a run would fetch.
+
+Usage:
+    python -m glenigan.rescrape plan --db-config database.ini --councils councils.json --budget 20000
+"""
+import argparse
+import heapq
+import json
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from glenigan.db import get_pool, load_db_config
+from glenigan.extraction import extraction_tables
+from glenigan.logger_config import logger
+
+DEFAULT_INTERVALS = {
+    "changed_recently": 2,  # last changed within the recent window
+    "new": 3,  # validated within the recent window and not decided
+    "undecided": 7,
+    "decided_recently": 14,  # decided within the recent window: conditions, appeals, late documents
+    "decided": 180,
+    "unknown": 14,  # no extracted fields to go by
+}
+
+# Decision values that mean the application is still open
+UNDECIDED = {"", "not available", "pending consideration", "pending decision", "undecided", "unknown"}
+
+
+def as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return None
+
+
+class RescrapePlanner:
+    """Ranks rescrape candidates and picks the most overdue within a request budget."""
+
+    def __init__(self, intervals=None, recent_days=30, max_age_days=365, budget=20000):
+        self.intervals = {**DEFAULT_INTERVALS, **(intervals or {})}
+        self.recent = timedelta(days=recent_days)
+        self.max_age = timedelta(days=max_age_days)
+        self.budget = budget
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            intervals=settings.getdict("RESCRAPE_INTERVALS"),
+            recent_days=settings.getfloat("RESCRAPE_RECENT_DAYS", 30),
+            max_age_days=settings.getfloat("RESCRAPE_MAX_AGE_DAYS", 365),
+            budget=settings.getint("RESCRAPE_REQUEST_BUDGET", 20000),
+        )
+
+    def classify(self, now, last_changed_at, validated_date, decision_date, decision):
+        """Return the class of an application (a key of the intervals)."""
+        last_changed_at = as_datetime(last_changed_at)
+        validated_date = as_datetime(validated_date)
+        decision_date = as_datetime(decision_date)
+        if last_changed_at is not None and now - last_changed_at <= self.recent:
+            return "changed_recently"
+        decided = decision_date is not None or (decision is not None and decision.strip().lower() not in UNDECIDED)
+        if decided:
+            if decision_date is not None and now - decision_date <= self.recent:
+                return "decided_recently"
+            return "decided"
+        if validated_date is not None:
+            return "new" if now - validated_date <= self.recent else "undecided"
+        return "unknown" if decision is None else "undecided"
+
+    def priority(self, now, last_scraped_at, reason):
+        """How overdue an application is: 1.0 means exactly one interval since it was last scraped.
+
+        Applications scraped before timestamps were recorded count as max_age_days old.
+        """
+        last_scraped_at = as_datetime(last_scraped_at)
+        age = self.max_age if last_scraped_at is None else min(now - last_scraped_at, self.max_age)
+        return age / timedelta(days=self.intervals[reason])
+
+    def plan(self, candidates, cost, now=None):
+        """Return [(priority, ref_no, url, reason)] to rescrape, most overdue first.
+
+        ``candidates`` yields (ref_no, url, last_scraped_at, last_changed_at, validated_date,
+        decision_date, decision); ``cost(ref_no)`` is the most requests a rescrape of it can take.
+        Only the candidates that can fit in the budget are kept in memory.
+        """
+        now = now or datetime.now()
+        heap = []
+        spent = 0
+        for ref_no, url, last_scraped_at, last_changed_at, validated_date, decision_date, decision in candidates:
+            reason = self.classify(now, last_changed_at, validated_date, decision_date, decision)
+            priority = self.priority(now, last_scraped_at, reason)
+            if priority < 1.0:
+                continue
+            entry = (priority, ref_no, url, reason, cost(ref_no))
+            heapq.heappush(heap, entry)
+            spent += entry[4]
+            # Drop the least overdue while the rest still fill the budget without them
+            while heap and spent - heap[0][4] >= self.budget:
+                spent -= heapq.heappop(heap)[4]
+        ranked = sorted(heap, reverse=True)
+        plan, spent = [], 0
+        for priority, ref_no, url, reason, requests in ranked:
+            if spent + requests > self.budget:
+                break
+            spent += requests
+            plan.append((priority, ref_no, url, reason))
+        return plan
+
+
+def has_table(cursor, table):
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s",
+        (table,),
+    )
+    return bool(cursor.fetchone()[0])
+
+
+def load_candidates(pool, crawler_type, council_code):
+    """Return the saved applications of one council with what the planner ranks them by.
+
+    Fields come from the extraction table when it exists; without it every application is "unknown"
+    unless it changed recently.
+    """
+    app_table = "decision_app" if crawler_type == "decision" else "plan_app"
+    fields_table, _, _ = extraction_tables(crawler_type)
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            if has_table(cursor, fields_table):
+                cursor.execute(
+                    f"SELECT a.ref_no, a.Url, a.last_scraped_at, a.last_changed_at, f.validated_date, f.decision_date, f.decision "
+                    f"FROM {app_table} a LEFT JOIN {fields_table} f ON f.ref_no = a.ref_no "
+                    f"WHERE a.council_code = %s AND a.scrape_status IN ('Yes', 'Yes(R)')",
+                    (str(council_code),),
+                )
+            else:
+                cursor.execute(
+                    f"SELECT ref_no, Url, last_scraped_at, last_changed_at, NULL, NULL, NULL FROM {app_table} "
+                    f"WHERE council_code = %s AND scrape_status IN ('Yes', 'Yes(R)')",
+                    (str(council_code),),
+                )
+            return cursor.fetchall()
+
+
+def council_candidates(pool, crawler_type, council_codes):
+    """Yield candidates council by council, so only one council's rows are held at a time."""
+    for council_code in council_codes:
+        yield from load_candidates(pool, crawler_type, council_code)
+
+
+def summarize(plan):
+    """Return {reason: applications} for a plan."""
+    return dict(Counter(reason for _, _, _, reason in plan))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rescrape planning")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("plan", help="print what a crawl_mode=rescrape run would fetch")
+    show.add_argument("--db-config", required=True, help="database.ini")
+    show.add_argument("--councils", required=True, help="councils.json")
+    show.add_argument("--crawler-type", default="planning", choices=["planning", "decision"])
+    show.add_argument("--budget", type=int, default=20000, help="requests the run may make")
+    show.add_argument("--requests-per-application", type=int, default=4, help="main page plus rescrape tabs")
+    show.add_argument("--limit", type=int, default=20, help="applications to list")
+    args = parser.parse_args(argv)
+
+    with open(args.councils, "r") as file:
+        council_codes = [council_info["code"] for council_info in json.load(file).values()]
+    planner = RescrapePlanner(budget=args.budget)
+    candidates = council_candidates(get_pool(load_db_config(args.db_config)), args.crawler_type, council_codes)
+    plan = planner.plan(candidates, cost=lambda ref_no: args.requests_per_application)
+    logger.info(f"Planned {len(plan)} rescrapes within {args.budget} requests: {summarize(plan)}")
+    for priority, ref_no, url, reason in plan[:args.limit]:
+        print(f"{priority:8.2f}  {reason:17}  {ref_no}  {url}")
+
+
+if __name__ == "__main__":
+    main()
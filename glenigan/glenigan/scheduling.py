@@ -0,0 +1,75 @@
+from collections import deque
+
+# Request priorities: tabs of started applications first, then new applications, then results pages,
+# so open applications finish (and free their spool and assembler) before more are started
+TAB_PRIORITY = 20
+APPLICATION_PRIORITY = 10
+RESULTS_PRIORITY = 0
+
+
+class ApplicationGate:
+    """Caps how many applications are open (main page requested, item not yet emitted) at once.
+
+    Application requests beyond ``max_open`` wait here instead of in the scheduler, and results
+    pages are held back while applications are waiting, so the crawl frontier stays the same
+    size however many results a search returns. Up to ``max_pages`` results pages are fetched
+    at once while there is room. ``max_open`` of 0 lets everything through.
+    """
+
+    def __init__(self, max_open=0, max_pages=1):
+        self.max_open = max_open
+        self.max_pages = max_pages
+        self.open = set()
+        self.waiting = deque()
+        self.pages = deque()
+        self.pages_in_flight = 0
+
+    def __len__(self):
+        return len(self.waiting) + len(self.pages)
+
+    def has_room(self):
+        return not self.max_open or len(self.open) < self.max_open
+
+    def submit_application(self, ref_no, request):
+        """Return the requests to schedule now for a new application."""
+        self.waiting.append((ref_no, request))
+        return self.release()
+
+    def submit_page(self, request):
+        """Return the requests to schedule now for a results page."""
+        request.meta["gated"] = True
+        self.pages.append(request)
+        return self.release()
+
+    def opened(self, ref_no):
+        """Count an application that was started without going through the gate (resume, repair)."""
+        self.open.add(ref_no)
+
+    def close(self, ref_no):
+        self.open.discard(ref_no)
+
+    def page_arrived(self):
+        self.pages_in_flight = max(0, self.pages_in_flight - 1)
+
+    def release(self):
+        """Return the waiting requests that fit under the cap; a results page only once no application waits."""
+        requests = []
+        while self.waiting and self.has_room():
+            ref_no, request = self.waiting.popleft()
+            self.open.add(ref_no)
+            requests.append(request)
+        if not self.max_open:
+            requests.extend(self.pages)
+            self.pages.clear()
+        else:
+            # Results pages only while their applications could start right away
+            while self.pages and not self.waiting and self.has_room() and self.pages_in_flight < self.max_pages:
+                self.pages_in_flight += 1
+                requests.append(self.pages.popleft())
+        return requests
+
+    def unstick(self, active):
+        """Forget open applications that are no longer ``active`` and in-flight pages; used when the crawl goes idle."""
+        self.open &= set(active)
+        self.pages_in_flight = 0
+        return self.release()
@@ -20,7 +20,8 @@ NEWSPIDER_MODULE = "glenigan.spiders"
 ROBOTSTXT_OBEY = False
 
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
-#CONCURRENT_REQUESTS = 32
+# Per-council budgets are managed by CouncilThrottleMiddleware, so the global cap only bounds the total
+CONCURRENT_REQUESTS = 64
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
@@ -53,19 +54,72 @@ ROBOTSTXT_OBEY = False
 #DOWNLOADER_MIDDLEWARES = {
 #    "glenigan.middlewares.GleniganDownloaderMiddleware": 543,
 #}
+# CouncilThrottleMiddleware sits above RetryMiddleware (550) so it sees 429/5xx responses before they are retried
+# HttpReplayMiddleware sits next to the download handler so it records and replays raw responses
+DOWNLOADER_MIDDLEWARES = {
+    "glenigan.middlewares.CouncilThrottleMiddleware": 590,
+    "glenigan.middlewares.HttpReplayMiddleware": 950,
+}
+
+# "record" stores every portal response in HTTP_REPLAY_PATH; "replay" serves the crawl from it without
+# touching the network (requests that were never recorded are dropped unless HTTP_REPLAY_FETCH_MISSING).
+# Empty disables both. See glenigan/replay.py
+HTTP_REPLAY_MODE = ""
+HTTP_REPLAY_PATH = "http_replay.sqlite"
+HTTP_REPLAY_FETCH_MISSING = False
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 #EXTENSIONS = {
 #    "scrapy.extensions.telnet.TelnetConsole": None,
 #}
+EXTENSIONS = {
+    "glenigan.metrics.MetricsExporter": 500,
+}
+
+# Per-stage latency histograms, application counters and queue gauges (see glenigan/metrics.py).
+# With METRICS_ENABLED they are written in the Prometheus text format to METRICS_FILE every
+# METRICS_EXPORT_INTERVAL seconds (for node_exporter's textfile collector), and served at
+# http://METRICS_HOST:METRICS_PORT/metrics when METRICS_PORT is set
+METRICS_ENABLED = False
+METRICS_FILE = "glenigan.prom"
+METRICS_EXPORT_INTERVAL = 15.0
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 0
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
+# ExtractionPipeline runs first: GleniganPipeline removes the spooled tabs it parses, and
+# DocumentPipeline downloads the document links it finds
 ITEM_PIPELINES = {
+   "glenigan.pipelines.ExtractionPipeline": 200,
+   "glenigan.pipelines.DocumentPipeline": 250,
    "glenigan.pipelines.GleniganPipeline": 300,
 }
 
+# Address, proposal, decision, dates, contacts and documents are parsed from every scraped application
+# by EXTRACTION_PROCESSES worker processes and written EXTRACTION_BATCH_SIZE applications at a time to
+# <app table>_fields, _contact and _document. `python -m glenigan.extraction backfill` covers older dumps.
+# Off by default: parsing during the crawl holds it back, so the backfill is usually run afterwards
+EXTRACTION_ENABLED = False
+EXTRACTION_PROCESSES = 2
+EXTRACTION_BATCH_SIZE = 200
+
+# Files linked from the documents tab are downloaded into DOCUMENTS_DIR/<council code>/<ref_no>/ by
+# DOCUMENT_THREADS threads outside Scrapy's downloader, streamed to disk DOCUMENT_CHUNK_SIZE bytes at a
+# time. Each council gets DOCUMENT_CONCURRENCY_PER_COUNCIL downloads at once sharing
+# DOCUMENT_BANDWIDTH_PER_COUNCIL bytes a second (0: no limit). Failed downloads resume from their
+# .part file up to DOCUMENT_RETRY_TIMES times. URLs already in DOCUMENTS_DIR/documents.sqlite are
+# skipped and identical files are kept once. Needs EXTRACTION_ENABLED; see glenigan/documents.py
+DOCUMENTS_ENABLED = False
+DOCUMENTS_DIR = "documents"
+DOCUMENT_THREADS = 8
+DOCUMENT_CONCURRENCY_PER_COUNCIL = 2
+DOCUMENT_BANDWIDTH_PER_COUNCIL = 0
+DOCUMENT_CHUNK_SIZE = 64 * 1024
+DOCUMENT_TIMEOUT = 60.0
+DOCUMENT_RETRY_TIMES = 2
+
 DUPEFILTER_CLASS = "scrapy.dupefilters.BaseDupeFilter"  # Allow duplicate URLs for different tabs
 
 RETRY_ENABLED = True  # Enable retries
@@ -74,6 +128,125 @@ RETRY_HTTP_CODES = [500, 502, 503, 504, 522, 524, 408, 429]  # Retry these error
 
 DOWNLOAD_TIMEOUT = 15  # Increase timeout to avoid 504 errors
 
+# Adaptive per-council throttling (see CouncilThrottleMiddleware).
+# Each council host starts at COUNCIL_THROTTLE_START_CONCURRENCY and ramps up to the max while its
+# latency stays under the target; 429/5xx responses and download errors halve its concurrency and
+# double its delay. "concurrency", "download_delay" and "download_timeout" in councils.json pin a council.
+COUNCIL_THROTTLE_ENABLED = True
+COUNCIL_THROTTLE_START_CONCURRENCY = 4
+COUNCIL_THROTTLE_MAX_CONCURRENCY = 16
+COUNCIL_THROTTLE_MIN_DELAY = 0.0
+COUNCIL_THROTTLE_MAX_DELAY = 30.0
+COUNCIL_THROTTLE_TARGET_LATENCY = 2.0
+
+# Tabs fetched per application, by crawler_type and scrape mode: "scrape" for a first scrape and "rescrape"
+# for a check_updates rescrape. A missing entry fetches every tab. A council in councils.json can override
+# any of these with its own "tab_profiles" of the same shape. The tabs each application got are recorded in
+# captured_tabs; -a crawl_mode=fill later fetches whatever its "scrape" profile has that was not captured
+TAB_PROFILES = {
+    "planning": {
+        "rescrape": ["summary", "dates", "documents"],
+    },
+    "decision": {
+        "scrape": ["summary", "details", "dates", "documents"],
+        "rescrape": ["summary", "dates", "documents"],
+    },
+}
+
+# Number of tab requests sent at once for a single application (1 fetches tabs one after another)
+TAB_CONCURRENCY_PER_APPLICATION = 10
+
+# At most this many applications are open (main page requested, HTML not yet handed to the pipeline)
+# at once. Further applications, and the results pages that would add more, wait until one finishes;
+# tabs of open applications are scheduled ahead of both. 0 removes the cap
+MAX_OPEN_APPLICATIONS = 200
+# Results pages fetched at once while the cap has room, so pagination still runs in parallel
+MAX_PAGES_IN_FLIGHT = 4
+
+# Distributed mode (-a work_queue=mysql or sqlite:<path>): units are leased WORK_QUEUE_BATCH_SIZE at a
+# time for WORK_QUEUE_LEASE_SECONDS and renewed every WORK_QUEUE_HEARTBEAT_INTERVAL seconds, so a crashed
+# worker's units are leased again once they expire. A unit is given up after WORK_QUEUE_MAX_ATTEMPTS leases
+WORK_QUEUE_BATCH_SIZE = 20
+WORK_QUEUE_LEASE_SECONDS = 300
+WORK_QUEUE_HEARTBEAT_INTERVAL = 60.0
+WORK_QUEUE_MAX_ATTEMPTS = 3
+
+# A tab that fails after the download retries is re-scheduled on its own up to TAB_RETRY_TIMES
+# times, waiting TAB_RETRY_BACKOFF seconds before the first retry and doubling each time.
+# An application whose tabs still fail is saved without them, marked Partial, and its missing
+# tabs are listed in the error table for a crawl_mode=repair run
+TAB_RETRY_TIMES = 2
+TAB_RETRY_BACKOFF = 10.0
+
+# -a crawl_mode=rescrape refetches saved applications by how overdue they are: the time since
+# last_scraped_at over the interval (in days) of their class, from last_changed_at and the extracted
+# validated/decision dates. "Recently" means within RESCRAPE_RECENT_DAYS; applications scraped before
+# timestamps were recorded count as RESCRAPE_MAX_AGE_DAYS old. The most overdue are fetched first, until
+# RESCRAPE_REQUEST_BUDGET requests are planned. See glenigan/rescrape.py
+RESCRAPE_INTERVALS = {
+    "changed_recently": 2,
+    "new": 3,
+    "undecided": 7,
+    "decided_recently": 14,
+    "decided": 180,
+    "unknown": 14,
+}
+RESCRAPE_RECENT_DAYS = 30
+RESCRAPE_MAX_AGE_DAYS = 365
+RESCRAPE_REQUEST_BUDGET = 20000
+
+# A check_updates rescrape fetches these tabs first and skips the rest when they and the main page
+# still match the content hashes stored at the last scrape
+RESCRAPE_PROBE_TABS = ["summary", "dates"]
+
+# Directory where tab bodies are spooled until an application's HTML is assembled
+SPOOL_DIR = "spool"
+
+# Where application HTML is stored: "files" writes one html_dumps/<ref_no>.html per application,
+# "archive" appends gzip records to rotating segment files in HTML_ARCHIVE_DIR (see glenigan.archive),
+# "cas" stores each distinct tab body and page head once in HTML_TAB_STORE_DIR with a per-application
+# manifest of hashes (see glenigan.tabstore; compare the glenigan/html/bytes and bytes_written stats)
+HTML_STORAGE = "files"
+HTML_ARCHIVE_DIR = "html_archive"
+HTML_ARCHIVE_SEGMENT_SIZE = 256 * 1024 * 1024
+HTML_TAB_STORE_DIR = "tab_store"
+
+# HTML is written off the reactor by HTML_WRITER_THREADS threads with at most HTML_WRITER_QUEUE_SIZE
+# writes outstanding. HTML_WRITER_FSYNC forces each dump file to disk before its status is updated.
+# Compare the glenigan/html/write_seconds and glenigan/html/reactor_seconds stats for the stall saved.
+HTML_WRITER_THREADS = 4
+HTML_WRITER_QUEUE_SIZE = 64
+HTML_WRITER_FSYNC = False
+
+# Checkpoints of started applications, their spooled tabs and processed results pages, so a restarted
+# crawl fetches only what is missing. Writes are batched every CHECKPOINT_FLUSH_INTERVAL seconds.
+# {crawler_type} in the path keeps planning and decision crawls from resuming each other's progress.
+# Work queue workers must each be given their own CHECKPOINT_PATH (-s on the command line)
+CHECKPOINT_ENABLED = True
+CHECKPOINT_PATH = "checkpoints_{crawler_type}.sqlite"
+CHECKPOINT_FLUSH_INTERVAL = 2.0
+CHECKPOINT_BATCH_SIZE = 500
+
+# Application rows and scrape statuses are written in batches off the reactor thread.
+# A batch is flushed when it reaches DB_BATCH_SIZE rows or every DB_FLUSH_INTERVAL seconds.
+# DB_BATCH_SIZE = 1 approximates the old row-at-a-time path for comparisons (see the glenigan/db/* stats).
+DB_BATCH_SIZE = 500
+DB_FLUSH_INTERVAL = 5.0
+
+# database.ini read by GleniganPipeline (the spider takes -a db_config_file=...); unset keeps the default path
+#DB_CONFIG_FILE = "database.ini"
+
+# Connection pool shared by the spider and GleniganPipeline.
+# Connections idle for longer than the health check interval are pinged (and reconnected) before reuse.
+# A thread that finds every connection busy gives up with PoolTimeout after DB_POOL_ACQUIRE_TIMEOUT seconds.
+DB_POOL_SIZE = 5
+DB_POOL_HEALTH_CHECK_INTERVAL = 30
+DB_POOL_ACQUIRE_TIMEOUT = 30
+
+# Spider error rows are coalesced per ref_no and upserted in batches
+ERROR_LOG_BATCH_SIZE = 100
+ERROR_LOG_FLUSH_INTERVAL = 5.0
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 #AUTOTHROTTLE_ENABLED = True
@@ -95,6 +268,21 @@ DOWNLOAD_TIMEOUT = 15  # Increase timeout to avoid 504 errors
 #HTTPCACHE_IGNORE_HTTP_CODES = []
 #HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
 
+# Logging is set up by glenigan/logger_config.py: every record goes through one queue to a background
+# thread that writes it once to logs/<start time>.log and (INFO and up) to the console. Scrapy's own
+# root handler would write every record a second time, so it is disabled
+LOG_ENABLED = False
+
+# High-volume INFO messages, matched by how the message starts. {"every": n} logs one in n,
+# {"per_second": r} at most r a second; the number dropped is appended to the next one logged.
+# An empty dict logs everything
+LOG_SAMPLING = {
+    "Skipping already scraped application": {"every": 100},
+    "Scraping application with status No": {"every": 100},
+    "Successfully scraped tab": {"every": 100},
+    "Saved: ": {"per_second": 10},
+}
+
 # Set settings whose default value is deprecated to a future-proof value
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
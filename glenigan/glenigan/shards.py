@@ -0,0 +1,46 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+DATE_FORMAT = "%d/%m/%Y"
+
+
+class DateShard(namedtuple("DateShard", ["start", "end"])):
+    """An inclusive date window for one advanced search."""
+
+    @classmethod
+    def parse(cls, start, end):
+        return cls(datetime.strptime(start, DATE_FORMAT).date(), datetime.strptime(end, DATE_FORMAT).date())
+
+    @property
+    def days(self):
+        return (self.end - self.start).days + 1
+
+    @property
+    def label(self):
+        return f"{self.start:%Y%m%d}-{self.end:%Y%m%d}"
+
+    def form_dates(self):
+        """Return the (start, end) strings the Idox search form expects."""
+        return self.start.strftime(DATE_FORMAT), self.end.strftime(DATE_FORMAT)
+
+    def split(self):
+        """Split the window into two halves; a single day cannot be split."""
+        if self.days < 2:
+            return [self]
+        middle = self.start + timedelta(days=self.days // 2 - 1)
+        return [DateShard(self.start, middle), DateShard(middle + timedelta(days=1), self.end)]
+
+
+def shard_range(start, end, shard_days=1):
+    """Cut the inclusive range start..end (dd/mm/yyyy strings) into shards of shard_days days."""
+    whole = DateShard.parse(start, end)
+    if whole.end < whole.start:
+        raise ValueError(f"end_date {end} is before start_date {start}")
+    shard_days = max(1, int(shard_days))
+    shards = []
+    current = whole.start
+    while current <= whole.end:
+        shard_end = min(whole.end, current + timedelta(days=shard_days - 1))
+        shards.append(DateShard(current, shard_end))
+        current = shard_end + timedelta(days=1)
+    return shards
@@ -1,12 +1,29 @@
 import scrapy
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 from scrapy.http import FormRequest
-import pymysql
-import configparser
+from scrapy.settings import SETTINGS_PRIORITIES
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import defer, task, threads
 import os
+import time
 import re
 import json
+from glenigan.assembler import TabAssembler
+from glenigan.checkpoints import CheckpointStore
+from glenigan.scheduling import ApplicationGate, APPLICATION_PRIORITY, RESULTS_PRIORITY, TAB_PRIORITY
+from glenigan.shards import DateShard, shard_range
+from glenigan.status_index import StatusIndex, council_code_of
+from glenigan.workqueue import application_unit, open_work_queue
+from glenigan.db import load_db_config, get_pool_from_settings, close_pools
 from glenigan.items import ApplicationItem, HtmlScraperItem
-from glenigan.logger_config import logger
+from glenigan.metrics import Metrics, get_metrics
+from glenigan.rescrape import RescrapePlanner, council_candidates, summarize
+from glenigan.logger_config import logger, configure_log_sampling
+
+PAGE_NUMBER = re.compile(r"searchCriteria\.page=(\d+)")
+PAGE_RANGE = re.compile(r"(\d+)\s*-\s*(\d+)\s+of\s+(\d+)")
+
 
 class ScraperSpider(scrapy.Spider):
     name = "scraper"
@@ -15,50 +32,264 @@ class ScraperSpider(scrapy.Spider):
         super().__init__(*args, **kwargs)
         self.check_updates = kwargs.get("check_updates", "no")
         self.crawler_type = kwargs.get("crawler_type", "planning")
+        # "search" walks the advanced search; "repair" only fetches the tabs listed as missing in the error table;
+        # "fill" fetches the tabs a smaller tab profile left out of applications already saved;
+        # "rescrape" refetches the saved applications most likely to have changed (see glenigan.rescrape)
+        self.crawl_mode = kwargs.get("crawl_mode", "search")
+        # "mysql" or "sqlite:<path>": take searches and applications from a shared work queue (see glenigan.workqueue)
+        self.work_queue_spec = kwargs.get("work_queue")
+
+        # Search window, split into shards that are searched concurrently
+        if self.crawler_type == "decision":
+            start_date, end_date = kwargs.get("start_date", "18/02/2025"), kwargs.get("end_date", "20/02/2025")
+        else:
+            start_date, end_date = kwargs.get("start_date", "19/02/2025"), kwargs.get("end_date", "19/02/2025")
+        self.shards = shard_range(start_date, end_date, kwargs.get("shard_days", 1))
 
         # Load council details
-        json_path = r"C:\Users\naafiah.fathima\Desktop\glenigan_scrapy1\glenigan\glenigan\councils.json"
+        json_path = kwargs.get("councils_file", r"C:\Users\naafiah.fathima\Desktop\glenigan_scrapy1\glenigan\glenigan\councils.json")
         if not os.path.exists(json_path):
             raise FileNotFoundError(f"Councils JSON file not found at: {json_path}")
         with open(json_path, "r") as file:
             self.councils = json.load(file)
 
         # Load database configuration
-        config_path = r"C:\Users\naafiah.fathima\Desktop\glenigan_scrapy1\glenigan\glenigan\database.ini"
-        self.db_config = self.load_db_config(config_path)
-        
-        # Define tabs to scrape
-        self.tabs = ["summary", "details", "contacts", "dates", "makeComment", "neighbourComments", "consulteeComments", "constraints", "documents", "relatedCases"]
+        config_path = kwargs.get("db_config_file", r"C:\Users\naafiah.fathima\Desktop\glenigan_scrapy1\glenigan\glenigan\database.ini")
+        self.db_config = load_db_config(config_path)
 
-    def load_db_config(self, path):
-        config = configparser.ConfigParser()
-        config.read(path)
-        return {
-            "host": config["mysql"]["host"],
-            "user": config["mysql"]["user"],
-            "password": config["mysql"]["password"],
-            "database": config["mysql"]["database"],
-            "port": int(config["mysql"]["port"])
+        # Every tab, in page order; TAB_PROFILES picks which of them an application fetches
+        self.tabs = ["summary", "details", "contacts", "dates", "makeComment", "neighbourComments", "consulteeComments", "constraints", "documents", "relatedCases"]
+        # Per-council TAB_PROFILES overrides from councils.json, keyed by council code
+        self.council_tab_profiles = {
+            str(council_info["code"]): council_info["tab_profiles"]
+            for council_info in self.councils.values() if "tab_profiles" in council_info
         }
 
+        # In-flight applications, keyed by ref_no, whose tabs are still arriving
+        self.assemblers = {}
+
+        # Results page numbers already requested, per search cookie jar
+        self.scheduled_pages = {}
+
+        # Holds new applications and results pages back while MAX_OPEN_APPLICATIONS are open
+        self.gate = ApplicationGate()
+
+        # crawl_mode=rescrape: the plan being made in a worker thread, None once it is scheduled
+        self.planning = None
+
+        # Distributed mode: units leased from the work queue, and applications found for it
+        self.work_queue = None
+        self.leased_units = []
+        self.leasing = False
+        self.discovered_units = []
+        self.heartbeat_loop = None
+        # GleniganPipeline.flush, set by the pipeline when it opens
+        self.flush_pipeline = None
+
+        # Tab retries waiting out their backoff outside the downloader (see handle_tab_error)
+        self.waiting_retries = set()
+
+        # Crawl progress store for resuming after a crash (see CHECKPOINT_ENABLED)
+        self.checkpoints = None
+
+        # Statuses of already-scraped applications, loaded per council on first use
+        self.status_index = StatusIndex(self.load_council_records)
+        self.opened_at = None
+
+        # Latency histograms and application counters, shared with the pipeline (see glenigan.metrics)
+        self.metrics = Metrics(self.crawler_type)
+
+        # Error rows waiting to be written in one batched upsert, keyed by ref_no
+        self.pending_errors = {}
+        self.error_flush_lock = defer.DeferredLock()
+        self.error_flush_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        if crawler.settings.getbool("CHECKPOINT_ENABLED"):
+            # Workers sharing a directory would resume and clear each other's progress from one file
+            if spider.work_queue_spec and crawler.settings.getpriority("CHECKPOINT_PATH") <= SETTINGS_PRIORITIES["project"]:
+                raise ValueError(
+                    "A work_queue worker needs its own checkpoint file: pass -s CHECKPOINT_PATH=<worker>_{crawler_type}.sqlite "
+                    "or -s CHECKPOINT_ENABLED=False"
+                )
+            spider.checkpoints = CheckpointStore(
+                crawler.settings.get("CHECKPOINT_PATH", "checkpoints_{crawler_type}.sqlite").format(crawler_type=spider.crawler_type),
+                flush_interval=crawler.settings.getfloat("CHECKPOINT_FLUSH_INTERVAL", 2.0),
+                batch_size=crawler.settings.getint("CHECKPOINT_BATCH_SIZE", 500),
+            )
+        spider.gate.max_open = crawler.settings.getint("MAX_OPEN_APPLICATIONS", 0)
+        spider.gate.max_pages = max(1, crawler.settings.getint("MAX_PAGES_IN_FLIGHT", 4))
+        configure_log_sampling(crawler.settings.getdict("LOG_SAMPLING"))
+        spider.metrics = get_metrics(crawler)
+        spider.metrics.crawler_type = spider.crawler_type
+        spider.metrics.add_sampler(spider.sample_metrics)
+        if spider.work_queue_spec:
+            spider.work_queue = open_work_queue(spider.work_queue_spec, spider.crawler_type, spider.db_config, crawler.settings)
+        crawler.signals.connect(close_pools, signal=signals.engine_stopped)
+        crawler.signals.connect(spider.release_on_idle, signal=signals.spider_idle)
+        crawler.signals.connect(spider.record_opened, signal=signals.spider_opened)
+        crawler.signals.connect(spider.record_first_request, signal=signals.request_reached_downloader)
+        return spider
+
+    def record_opened(self, spider):
+        self.opened_at = time.monotonic()
+        self.status_index.stats = self.crawler.stats
+        if self.checkpoints is not None:
+            self.checkpoints.start()
+        if self.work_queue is not None:
+            self.heartbeat_loop = task.LoopingCall(self.renew_leases)
+            self.heartbeat_loop.start(self.settings.getfloat("WORK_QUEUE_HEARTBEAT_INTERVAL", 60.0), now=False)
+
+    def record_first_request(self, request, spider):
+        """Record the time to first request once, as glenigan/startup/first_request_seconds."""
+        self.crawler.signals.disconnect(self.record_first_request, signal=signals.request_reached_downloader)
+        if self.opened_at is not None:
+            self.crawler.stats.set_value("glenigan/startup/first_request_seconds", time.monotonic() - self.opened_at)
+
+    def sample_metrics(self, metrics):
+        metrics.in_flight.set(value=len(self.assemblers))
+        metrics.queue_depth.set("gated_applications", value=len(self.gate.waiting))
+        metrics.queue_depth.set("gated_pages", value=len(self.gate.pages))
+
+    def release_on_idle(self, spider):
+        """Schedule whatever the gate still holds once nothing else is left to crawl; in distributed mode lease more work."""
+        requests = self.gate.unstick(self.assemblers)
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        if requests or self.waiting_retries or self.planning is not None:
+            raise DontCloseSpider
+        if self.work_queue is not None and self.lease_more():
+            raise DontCloseSpider
+
+    def lease_more(self):
+        """Finish the leased units (the crawl went idle, so their requests are done) and lease the next batch.
+
+        The units are completed only once the applications they found and the pipeline's rows are
+        written; otherwise they are released for another lease. Returns False once the queue has
+        nothing left that this or another worker could still lease.
+        """
+        if self.leasing:
+            return True
+        if self.leased_units is None:
+            return False
+        self.leasing = True
+        finished, self.leased_units = self.leased_units, []
+        d = self.flush_discovered()
+        d.addCallback(lambda _: self.flush_pipeline(raise_failure=True) if self.flush_pipeline is not None else None)
+        d.addCallbacks(lambda _: True, self.units_not_written)
+        d.addCallback(lambda written: threads.deferToThread(self.next_work_units, finished, written))
+        d.addCallback(self.schedule_work_units)
+        d.addErrback(lambda failure: logger.error(f"Work queue lease failed: {failure.value}"))
+        d.addBoth(self.leasing_done)
+        return True
+
+    def units_not_written(self, failure):
+        logger.error(f"Rows of the leased work units were not written, releasing them: {failure.value}")
+        return False
+
+    def next_work_units(self, finished, written=True):
+        """Runs in a worker thread: complete ``finished`` (release them unless ``written``) and lease a new batch; returns (units, outstanding)."""
+        unit_ids = [unit_id for unit_id, _, _ in finished]
+        if written:
+            self.work_queue.complete(unit_ids)
+        else:
+            self.work_queue.release(unit_ids)
+        units = self.work_queue.lease(self.settings.getint("WORK_QUEUE_BATCH_SIZE", 20))
+        return units, (self.work_queue.outstanding() if not units else None)
+
+    def schedule_work_units(self, result):
+        units, outstanding = result
+        if not units:
+            if outstanding:
+                logger.info(f"Waiting for {outstanding} work units leased by other workers")
+            else:
+                logger.info("Work queue is drained")
+                self.leased_units = None
+            return
+        self.leased_units = units
+        logger.info(f"Leased {len(units)} work units")
+        for request in self.work_unit_requests(units):
+            self.crawler.engine.crawl(request)
+
+    def leasing_done(self, _):
+        self.leasing = False
+
+    def work_unit_requests(self, units):
+        for _, kind, payload in units:
+            if kind == "search":
+                council_info = self.councils[payload["council_name"]]
+                self.status_index.load(council_info["code"])
+                yield self.search_request(payload["council_name"], council_info, DateShard.parse(payload["start"], payload["end"]))
+            else:
+                yield from self.gate.submit_application(
+                    payload["ref_no"], self.application_request(payload["ref_no"], payload["link"], payload["rescrape"])
+                )
+
+    def renew_leases(self):
+        if not self.leased_units:
+            return None
+        unit_ids = [unit_id for unit_id, _, _ in self.leased_units]
+        d = threads.deferToThread(self.work_queue.heartbeat, unit_ids)
+        d.addErrback(lambda failure: logger.error(f"Work queue heartbeat failed: {failure.value}"))
+        return d
+
+    def flush_discovered(self):
+        """Queue the applications found by leased searches as units any worker can take."""
+        if not self.discovered_units:
+            return defer.succeed(None)
+        units, self.discovered_units = self.discovered_units, []
+        return threads.deferToThread(self.work_queue.enqueue, units)
+
+    @property
+    def pool(self):
+        """The connection pool shared with GleniganPipeline."""
+        return get_pool_from_settings(self.db_config, self.settings)
+
     def start_requests(self):
         """Start scraping only for applications that have not been scraped."""
-        connection = pymysql.connect(**self.db_config)
-        cursor = connection.cursor()
-
+        if self.checkpoints is not None:
+            yield from self.resume_requests()
+        if self.crawl_mode == "repair":
+            yield from self.repair_requests(self.load_missing_tabs())
+            return
+        if self.crawl_mode == "fill":
+            yield from self.repair_requests(self.load_uncaptured_tabs())
+            return
+        if self.crawl_mode == "rescrape":
+            self.start_rescrape_plan()
+            return  # The planned applications are scheduled once the plan is ready
+        if self.work_queue is not None:
+            return  # Work is leased from the queue once the spider goes idle
         for council_name, council_info in self.councils.items():
-            # Fetch existing applications and their scrape_status
-            cursor.execute(f"SELECT ref_no, scrape_status FROM {self.get_app_table()} WHERE ref_no LIKE %s", (f"{council_info['code']}_%",))
-            existing_records = {row[0]: row[1] for row in cursor.fetchall()}
-
-            yield scrapy.Request(
-                url=council_info["url"],
-                callback=self.parse,
-                meta={"council_name": council_name, "council_code": council_info["code"], "url": council_info["url"], "existing_records": existing_records},
-            )
+            # Statuses load in a worker thread while the search forms are fetched
+            self.status_index.load(council_info["code"])
+            for shard in self.shards:
+                yield self.search_request(council_name, council_info, shard)
 
-        cursor.close()
-        connection.close()
+    def search_request(self, council_name, council_info, shard):
+        """Request the advanced search form for one date shard, in its own cookie jar."""
+        start, end = shard.form_dates()
+        return scrapy.Request(
+            url=council_info["url"],
+            callback=self.parse,
+            meta={
+                "council_name": council_name,
+                "council_code": council_info["code"],
+                "url": council_info["url"],
+                "shard": (start, end),
+                "cookiejar": f"{council_info['code']}:{shard.label}",
+            },
+            dont_filter=True,
+        )
+
+    def load_council_records(self, council_code):
+        """Fetch existing applications and their scrape_status for one council."""
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT ref_no, scrape_status FROM {self.get_app_table()} WHERE council_code = %s", (str(council_code),))
+                return cursor.fetchall()
 
     def parse(self, response):
         """Extract CSRF token and submit form request."""
@@ -66,18 +297,19 @@ class ScraperSpider(scrapy.Spider):
         if not csrf_token:
             return
 
+        start, end = response.meta["shard"]
         if self.crawler_type == "decision":
             form_data = {
                 "_csrf": csrf_token,
-                "date(applicationDecisionStart)": "18/02/2025",
-                "date(applicationDecisionEnd)": "20/02/2025",
+                "date(applicationDecisionStart)": start,
+                "date(applicationDecisionEnd)": end,
                 "searchType": "Application",
             }
         else:  # planning
             form_data = {
                 "_csrf": csrf_token,
-                "date(applicationValidatedStart)": "19/02/2025",
-                "date(applicationValidatedEnd)": "19/02/2025",
+                "date(applicationValidatedStart)": start,
+                "date(applicationValidatedEnd)": end,
                 "searchType": "Application",
             }
         post_url = response.meta["url"].replace("search.do?action=advanced", "advancedSearchResults.do")
@@ -93,17 +325,35 @@ class ScraperSpider(scrapy.Spider):
         """Return the table name for application data based on crawler_type."""
         return "decision_app" if self.crawler_type == "decision" else "plan_app"
 
+    def get_tab_hash_table(self):
+        """Return the table name for per-tab content fingerprints based on crawler_type."""
+        return "decision_tab_hash" if self.crawler_type == "decision" else "plan_tab_hash"
+
     def get_error_table(self):
         """Return the table name for errors based on crawler_type."""
         return "decision_error" if self.crawler_type == "decision" else "plan_error"
 
-    def parse_results(self, response):
+    async def parse_results(self, response):
         """Extract application details and immediately start HTML scraping."""
+        if response.meta.get("gated"):
+            self.gate.page_arrived()
+        self.crawler.stats.inc_value(f"glenigan/pages_fetched/{response.meta['council_name']}")
         applications = response.xpath('//li[contains(@class, "searchresult")]')
         if not applications:
+            if self.hit_result_cap(response):
+                for request in self.split_shard(response):
+                    yield request
+            return
+
+        # Ask once for the largest page size the portal offers and start over from its first page
+        resize_request = self.page_size_request(response, len(applications))
+        if resize_request is not None:
+            yield resize_request
             return
-        
-        existing_records = response.meta["existing_records"]
+
+        council_code = response.meta["council_code"]
+        # Join the status lookup started in start_requests
+        await maybe_deferred_to_future(self.status_index.load(council_code))
 
         for app in applications:
             link_tag = app.xpath(".//a")
@@ -112,10 +362,11 @@ class ScraperSpider(scrapy.Spider):
             sanitized_ref_no = self.sanitize_ref_no(f"{response.meta['council_code']}_{ref_no}")
 
             # Determine if we should scrape this application and whether it's a rescrape
-            if sanitized_ref_no in existing_records:
-                current_status = existing_records[sanitized_ref_no]
+            current_status = self.status_index.get(council_code, sanitized_ref_no)
+            if current_status is not None:
                 if current_status == "Yes(R)":
                     logger.info(f"Skipping already scraped application with Yes(R): {sanitized_ref_no}")
+                    self.metrics.application(sanitized_ref_no, "skipped")
                     continue  # Do not overwrite Yes(R)
                 elif current_status == "Yes":
                     if self.check_updates.lower() == "yes":
@@ -123,140 +374,490 @@ class ScraperSpider(scrapy.Spider):
                         rescrape = True
                     else:
                         logger.info(f"Skipping already scraped application: {sanitized_ref_no}")
+                        self.metrics.application(sanitized_ref_no, "skipped")
                         continue
                 elif current_status == "No":
                     logger.info(f"Scraping application with status No: {sanitized_ref_no}")
                     rescrape = False
+                elif current_status == "Partial":
+                    logger.info(f"Skipping partially scraped application, left to crawl_mode=repair: {sanitized_ref_no}")
+                    self.metrics.application(sanitized_ref_no, "skipped")
+                    continue
             else:
                 # logger.info(f"Inserting new application: {sanitized_ref_no}")
                 # self.insert_new_application(sanitized_ref_no, link)
                 rescrape = False
 
+            self.metrics.application(sanitized_ref_no, "rescraped" if rescrape else "scraped")
             # Pass the is_rescrape flag with the item and in meta for downstream use
-            yield ApplicationItem(ref_no=sanitized_ref_no, link=link, is_rescrape=rescrape)
-            yield scrapy.Request(
-                url=link,
-                callback=self.parse_html,
-                meta={
-                    "ref_no": sanitized_ref_no,
-                    "base_url": link,
-                    "all_html_content": "",
-                    "tab_index": 0,
-                    "rescrape": rescrape
-                },
-                dont_filter=True
+            yield ApplicationItem(ref_no=sanitized_ref_no, council_code=str(council_code), link=link, is_rescrape=rescrape)
+            if self.work_queue is not None:
+                self.discovered_units.append(application_unit(sanitized_ref_no, link, rescrape))
+                continue
+            for request in self.gate.submit_application(sanitized_ref_no, self.application_request(sanitized_ref_no, link, rescrape)):
+                yield request
+
+        for page_request in self.pagination_requests(response):
+            for request in self.gate.submit_page(page_request):
+                yield request
+        if self.checkpoints is not None:
+            match = PAGE_NUMBER.search(response.url)
+            self.checkpoints.page_done(response.meta.get("cookiejar"), int(match.group(1)) if match else 1)
+
+    def tab_profile(self, ref_no, rescrape=False):
+        """Return the tabs to fetch for an application: its council's profile, else TAB_PROFILES, else every tab."""
+        mode = "rescrape" if rescrape else "scrape"
+        profiles = self.settings.getdict("TAB_PROFILES").get(self.crawler_type, {})
+        council_profiles = self.council_tab_profiles.get(council_code_of(ref_no), {}).get(self.crawler_type, {})
+        tabs = council_profiles.get(mode, profiles.get(mode))
+        if not tabs:
+            return list(self.tabs)
+        return [tab_name for tab_name in self.tabs if tab_name in tabs]
+
+    def application_request(self, ref_no, link, rescrape):
+        """Request an application's main page; the application is checkpointed as started."""
+        meta = {
+            "ref_no": ref_no,
+            "base_url": link,
+            "rescrape": rescrape,
+            "tabs": self.tab_profile(ref_no, rescrape),
+        }
+        if self.checkpoints is not None:
+            self.checkpoints.start_app(ref_no, meta)
+        return scrapy.Request(
+            url=link,
+            callback=self.parse_html,
+            errback=self.handle_application_error,
+            meta=meta,
+            priority=APPLICATION_PRIORITY,
+            dont_filter=True,
+        )
+
+    def handle_application_error(self, failure):
+        """The main page could not be fetched; free the application's slot for the next one."""
+        ref_no = failure.request.meta["ref_no"]
+        logger.error(f"Main page failed for {ref_no}: {failure.value!r}")
+        self.log_error(ref_no, f"Failed to scrape main page: {failure.value!r}", url=failure.request.meta["base_url"])
+        self.metrics.application(ref_no, "failed")
+        self.gate.close(ref_no)
+        yield from self.gate.release()
+
+    def resume_requests(self):
+        """Pick up applications left unfinished by a previous run, fetching only their missing sections."""
+        for ref_no, meta, sections in self.checkpoints.unfinished_apps():
+            sections = {section: saved for section, saved in sections.items() if os.path.exists(saved[0])}
+            # Unchanged sections of a rescrape are never spooled, so a rescrape starts over
+            if "main" not in sections or meta["rescrape"]:
+                yield from self.gate.submit_application(ref_no, self.application_request(ref_no, meta["base_url"], meta["rescrape"]))
+                continue
+            assembler = TabAssembler(
+                ref_no, meta["base_url"], meta.get("tabs", self.tabs), meta["rescrape"],
+                spool_dir=self.settings.get("SPOOL_DIR", "spool"),
+            )
+            assembler.resume(sections)
+            self.assemblers[ref_no] = assembler
+            self.gate.opened(ref_no)
+            logger.info(f"Resuming {ref_no}, {len(sections)} sections already fetched")
+            for request in self.advance(assembler):
+                yield request
+
+    def repair_requests(self, rows):
+        """Fetch only the given tabs of saved applications ((ref_no, url, comma-separated tabs) rows); they are merged into the stored HTML."""
+        logger.info(f"Fetching missing tabs of {len(rows)} saved applications ({self.crawl_mode})")
+        for ref_no, url, missing_tabs in rows:
+            if ref_no in self.assemblers:
+                continue
+            assembler = TabAssembler(ref_no, url, self.tabs, spool_dir=self.settings.get("SPOOL_DIR", "spool"))
+            assembler.repair(missing_tabs.split(","))
+            self.assemblers[ref_no] = assembler
+            self.gate.opened(ref_no)
+            for request in self.advance(assembler):
+                yield request
+
+    def load_missing_tabs(self):
+        """Return (ref_no, url, comma-separated missing tabs) for every Partial application."""
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT e.ref_no, COALESCE(e.Url, a.Url), e.missing_tabs FROM {self.get_error_table()} e "
+                    f"JOIN {self.get_app_table()} a ON a.ref_no = e.ref_no "
+                    f"WHERE a.scrape_status = 'Partial' AND e.missing_tabs IS NOT NULL AND e.missing_tabs != ''"
+                )
+                return cursor.fetchall()
+
+    def start_rescrape_plan(self):
+        """Rescrape the most overdue saved applications, as many as fit in RESCRAPE_REQUEST_BUDGET requests.
+
+        The candidate scan runs in a worker thread; the spider is kept open until the plan is scheduled.
+        """
+        planner = RescrapePlanner.from_settings(self.settings)
+        self.planning = threads.deferToThread(self.plan_rescrape, planner)
+        self.planning.addCallback(self.schedule_rescrape, planner)
+        self.planning.addErrback(lambda failure: logger.error(f"Rescrape planning failed: {failure.value}"))
+        self.planning.addBoth(self.planning_done)
+
+    def plan_rescrape(self, planner):
+        """Runs in a worker thread: scan every council's saved applications and return the plan."""
+        council_codes = [council_info["code"] for council_info in self.councils.values()]
+        return planner.plan(
+            council_candidates(self.pool, self.crawler_type, council_codes),
+            # The main page and every tab of the rescrape profile; probing usually makes it fewer
+            cost=lambda ref_no: 1 + len(self.tab_profile(ref_no, rescrape=True)),
+        )
+
+    def schedule_rescrape(self, plan, planner):
+        logger.info(f"Rescraping {len(plan)} applications within {planner.budget} requests: {summarize(plan)}")
+        for _priority, ref_no, url, reason in plan:
+            self.crawler.stats.inc_value(f"glenigan/rescrape/planned/{reason}")
+            self.metrics.application(ref_no, "rescraped")
+            for request in self.gate.submit_application(ref_no, self.application_request(ref_no, url, True)):
+                self.crawler.engine.crawl(request)
+
+    def planning_done(self, _):
+        self.planning = None
+
+    def load_uncaptured_tabs(self):
+        """Return (ref_no, url, comma-separated tabs) for saved applications missing tabs of their full scrape profile.
+
+        Applications saved before captured_tabs was recorded (NULL) fetched every tab.
+        """
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT ref_no, Url, captured_tabs FROM {self.get_app_table()} "
+                    f"WHERE scrape_status IN ('Yes', 'Yes(R)') AND captured_tabs IS NOT NULL"
+                )
+                rows = []
+                for ref_no, url, captured_tabs in cursor.fetchall():
+                    captured = set(captured_tabs.split(","))
+                    missing = [tab_name for tab_name in self.tab_profile(ref_no) if tab_name not in captured]
+                    if missing:
+                        rows.append((ref_no, url, ",".join(missing)))
+                return rows
+
+    def page_size_request(self, response, result_count):
+        """Re-request the first page with the portal's largest resultsPerPage option, if it has one."""
+        if response.meta.get("page_size_requested") or not response.xpath('//a[contains(@class, "next")]'):
+            return None
+        select = response.xpath('//select[@name="searchCriteria.resultsPerPage"]')
+        sizes = [int(value) for value in select.xpath('./option/@value').getall() if value.isdigit()]
+        if not sizes or max(sizes) <= result_count:
+            return None
+        try:
+            return FormRequest.from_response(
+                response,
+                formxpath='//select[@name="searchCriteria.resultsPerPage"]/ancestor::form[1]',
+                formdata={"searchCriteria.resultsPerPage": str(max(sizes)), "searchCriteria.page": "1"},
+                callback=self.parse_results,
+                meta={**response.meta, "page_size_requested": True},
+                dont_filter=True,
             )
+        except ValueError:
+            return None  # No usable form around the selector; keep the default page size
+
+    def pagination_requests(self, response):
+        """Schedule every known results page at once, falling back to following the next link."""
+        site_root = response.meta["url"].split("/online-applications")[0]
+        search = response.meta.get("cookiejar")
+        scheduled = self.scheduled_pages.get(search)
+        if scheduled is None:
+            # Pages processed before a restart are not fetched again
+            scheduled = self.scheduled_pages[search] = {1} | (self.checkpoints.done_pages(search) if self.checkpoints is not None else set())
+        pages = {}
+        for href in response.xpath('//a[contains(@class, "page") or contains(@class, "next")]/@href').getall():
+            match = PAGE_NUMBER.search(href)
+            if match:
+                pages[int(match.group(1))] = href
+
+        # "Showing 1-100 of 2345" on the first page tells us every page number up front
+        showing = PAGE_RANGE.search(" ".join(response.xpath('//span[contains(@class, "showing")]//text()').getall()))
+        if pages and showing and int(showing.group(1)) == 1:
+            first, last, total = (int(group) for group in showing.groups())
+            page_size = last - first + 1
+            template = next(iter(pages.values()))
+            for page in range(2, -(-total // page_size) + 1):
+                pages.setdefault(page, PAGE_NUMBER.sub(f"searchCriteria.page={page}", template))
+
+        if not pages:
+            next_page_tag = response.xpath('//a[contains(@class, "next")]/@href').get()
+            if next_page_tag:
+                yield scrapy.Request(url=site_root + next_page_tag, callback=self.parse_results, meta=response.meta, priority=RESULTS_PRIORITY, dont_filter=True)
+            return
+
+        for page, href in sorted(pages.items()):
+            if page not in scheduled:
+                scheduled.add(page)
+                yield scrapy.Request(url=site_root + href, callback=self.parse_results, errback=self.handle_page_error, meta=response.meta, priority=RESULTS_PRIORITY, dont_filter=True)
 
-        # Handle pagination as before
-        next_page_tag = response.xpath('//a[contains(@class, "next")]/@href').get()
-        if next_page_tag:
-            next_page_url = response.meta["url"].split("/online-applications")[0] + next_page_tag
-            yield scrapy.Request(url=next_page_url, callback=self.parse_results, meta=response.meta)
+    def hit_result_cap(self, response):
+        """True if the portal refused the search because the window matched too many applications."""
+        message = " ".join(response.xpath('//div[contains(@class, "messagebox")]//text()').getall())
+        return "too many results" in message.lower()
+
+    def split_shard(self, response):
+        """Re-run a capped search as two smaller date windows."""
+        shard = DateShard.parse(*response.meta["shard"])
+        council_info = self.councils[response.meta["council_name"]]
+        halves = shard.split()
+        if len(halves) == 1:
+            logger.error(f"Result cap hit for single day {shard.label} at {response.meta['council_name']}, results are incomplete")
+            return []
+        logger.info(f"Result cap hit for {shard.label} at {response.meta['council_name']}, splitting into {halves[0].label} and {halves[1].label}")
+        return [self.search_request(response.meta["council_name"], council_info, half) for half in halves]
 
     def insert_new_application(self, ref_no, url):
         """Insert new application into the appropriate table with scrape_status = 'No'."""
-        connection = pymysql.connect(**self.db_config)
-        cursor = connection.cursor()
         table_name = self.get_app_table()
         try:
-            cursor.execute(
-                f"INSERT INTO {table_name} (ref_no, Url, scrape_status) VALUES (%s, %s, 'No')",
-                (ref_no, url)
-            )
-            connection.commit()
+            with self.pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"INSERT INTO {table_name} (ref_no, Url, scrape_status) VALUES (%s, %s, 'No')",
+                        (ref_no, url)
+                    )
+                connection.commit()
         except Exception as e:
             logger.error(f"Error inserting application {ref_no}: {e}")
-        finally:
-            cursor.close()
-            connection.close()
 
-    def parse_html(self, response):
-        """Extracts main HTML and starts scraping tabs."""
+    async def parse_html(self, response):
+        """Extracts main HTML and fans out requests for the tabs."""
         ref_no = response.meta['ref_no']
         base_url = response.meta['base_url']
-        all_html_content = f"\n<!-- Main Page -->\n{response.text}"
-        
-        yield scrapy.Request(
-            url=self.construct_tab_url(base_url, self.tabs[0]),
+        rescrape = response.meta.get("rescrape", False)
+        tabs = response.meta.get("tabs") or self.tab_profile(ref_no, rescrape)
+        if ref_no in self.assemblers:
+            logger.info(f"Application {ref_no} is already being scraped, skipping duplicate")
+            return
+
+        # A rescrape compares against the fingerprints of the previous scrape
+        stored = {}
+        if rescrape:
+            stored = await maybe_deferred_to_future(threads.deferToThread(self.load_tab_fingerprints, ref_no))
+            if ref_no in self.assemblers:
+                return
+
+        if len(tabs) < len(self.tabs):
+            self.crawler.stats.inc_value("glenigan/tabs/not_in_profile", len(self.tabs) - len(tabs))
+        assembler = TabAssembler(
+            ref_no, base_url, tabs, rescrape,
+            spool_dir=self.settings.get("SPOOL_DIR", "spool"),
+            stored=stored,
+            probe_tabs=self.settings.getlist("RESCRAPE_PROBE_TABS", ["summary", "dates"]),
+        )
+        assembler.set_main(response.text)
+        self.assemblers[ref_no] = assembler
+        self.checkpoint_section(assembler, "main")
+
+        for request in self.advance(assembler):
+            yield request
+
+    def load_tab_fingerprints(self, ref_no):
+        """Return {section: (hash, etag, last_modified)} stored for an application by the pipeline."""
+        try:
+            with self.pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SELECT tab, hash, etag, last_modified FROM {self.get_tab_hash_table()} WHERE ref_no = %s", (ref_no,))
+                    return {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"Could not load tab fingerprints for {ref_no}, rescraping all tabs: {e}")
+            return {}
+
+    def next_tab_request(self, assembler):
+        """Build the request for the next unrequested tab of an application, if any."""
+        tab_name = assembler.next_tab()
+        if tab_name is None:
+            return None
+        # Conditional request when the portal gave us validators last time
+        headers = {}
+        _, etag, last_modified = assembler.stored.get(tab_name, (None, None, None))
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return scrapy.Request(
+            url=self.construct_tab_url(assembler.base_url, tab_name),
             callback=self.parse_tab,
+            headers=headers,
+            priority=TAB_PRIORITY,
             meta={
-                "ref_no": ref_no,
-                "all_html_content": all_html_content,
-                "tab_index": 0,
-                "base_url": base_url,
-                "rescrape": response.meta.get("rescrape", False)
+                "ref_no": assembler.ref_no,
+                "tab_name": tab_name,
+                "base_url": assembler.base_url,
+                "rescrape": assembler.rescrape,
+                "tab_attempt": 0,
+                "handle_httpstatus_list": [304],
             },
+            errback=self.handle_tab_error,
             dont_filter=True
         )
 
+    def advance(self, assembler):
+        """Keep the application's tab requests topped up, or emit the item once every tab has arrived or failed."""
+        assembler.release_held()
+        limit = max(1, self.settings.getint("TAB_CONCURRENCY_PER_APPLICATION", len(self.tabs)))
+        while assembler.requested - assembler.settled < limit:
+            request = self.next_tab_request(assembler)
+            if request is None:
+                break
+            yield request
+        if assembler.done:
+            del self.assemblers[assembler.ref_no]
+            missing_tabs = assembler.missing_tabs
+            if missing_tabs:
+                # Keep what did arrive; the error row tells a repair crawl which tabs to fetch
+                logger.error(f"Saving {assembler.ref_no} without tabs: {', '.join(missing_tabs)}")
+                self.log_error(
+                    assembler.ref_no,
+                    "; ".join(f"{tab_name}: {assembler.failed[tab_name]}" for tab_name in missing_tabs),
+                    missing_tabs=missing_tabs,
+                    url=assembler.base_url,
+                )
+                self.crawler.stats.inc_value("glenigan/applications/partial")
+                self.metrics.application(assembler.ref_no, "partial")
+            changed_tabs = assembler.changed_tabs
+            if changed_tabs == []:
+                logger.info(f"No changes for {assembler.ref_no}, skipped {len(assembler.tabs) - assembler.requested} tabs")
+                self.crawler.stats.inc_value("glenigan/rescrape/unchanged")
+            yield HtmlScraperItem(
+                ref_no=assembler.ref_no,
+                url=assembler.base_url,
+                segments=assembler.segments(),
+                changed_tabs=changed_tabs,
+                fingerprints=assembler.fingerprints,
+                missing_tabs=missing_tabs,
+                captured_tabs=assembler.captured_tabs,
+                is_rescrape=assembler.rescrape,
+                is_repair=assembler.repairing,
+            )
+            self.gate.close(assembler.ref_no)
+            yield from self.gate.release()
+
+    def checkpoint_section(self, assembler, section):
+        """Record a spooled section so a restart does not fetch it again."""
+        if self.checkpoints is None:
+            return
+        path = assembler.main if section == "main" else assembler.pages.get(section)
+        if path:
+            self.checkpoints.section_done(assembler.ref_no, section, path, assembler.fingerprints.get(section))
+
     def parse_tab(self, response):
-        """Extract each tab's content and save once all tabs are scraped."""
+        """Store a tab's content and save the application once all tabs are scraped."""
+        ref_no = response.meta["ref_no"]
+        tab_name = response.meta["tab_name"]
+        assembler = self.assemblers.get(ref_no)
+        if assembler is None:
+            return
         try:
-            ref_no = response.meta["ref_no"]
-            all_html_content = response.meta["all_html_content"]
-            tab_index = response.meta["tab_index"]
-            base_url = response.meta["base_url"]
-
-            tab_name = self.tabs[tab_index]
-            all_html_content += f"\n<!-- Tab: {tab_name} -->\n{response.text}"
-
-            logger.info(f"Successfully scraped tab {tab_name} for {ref_no}")
-
-            next_tab_index = tab_index + 1
-            if next_tab_index < len(self.tabs):
-                yield scrapy.Request(
-                    url=self.construct_tab_url(base_url, self.tabs[next_tab_index]),
-                    callback=self.parse_tab,
-                    meta={
-                        "ref_no": ref_no,
-                        "all_html_content": all_html_content,
-                        "tab_index": next_tab_index,
-                        "base_url": base_url,
-                        "rescrape": response.meta.get("rescrape", False)
-                    },
-                    errback=self.handle_tab_error,
-                    dont_filter=True
-                )
+            if response.status == 304 and tab_name in assembler.stored:
+                assembler.not_modified(tab_name)
+                logger.info(f"Tab {tab_name} not modified for {ref_no}")
             else:
-                yield HtmlScraperItem(
-                    ref_no=ref_no,
-                    url=base_url,
-                    html_content=all_html_content,
-                    is_rescrape=response.meta.get("rescrape", False)
+                assembler.add(
+                    tab_name, response.text,
+                    etag=response.headers.get("ETag", b"").decode("latin-1") or None,
+                    last_modified=response.headers.get("Last-Modified", b"").decode("latin-1") or None,
                 )
+                logger.info(f"Successfully scraped tab {tab_name} for {ref_no}")
+            self.checkpoint_section(assembler, tab_name)
         except Exception as e:
-            self.log_error(ref_no, f"Failed to scrape tab: {self.tabs[tab_index]}, Error: {str(e)}")
-            logger.error(f"Failed to scrape tab {self.tabs[tab_index]} for {ref_no}: {e}")
+            assembler.fail(tab_name, str(e))
+            logger.error(f"Failed to scrape tab {tab_name} for {ref_no}: {e}")
+        yield from self.advance(assembler)
+
+    def handle_page_error(self, failure):
+        """A failed results page frees its place in the gate for the next one."""
+        request = failure.request
+        logger.error(f"Results page failed for {request.meta.get('council_name')}: {request.url} ({failure.value!r})")
+        if request.meta.get("gated"):
+            self.gate.page_arrived()
+            yield from self.gate.release()
 
     def handle_tab_error(self, failure):
         """Handles errors when a tab scraping request fails."""
         request = failure.request
         ref_no = request.meta.get("ref_no", "Unknown")
-        tab_index = request.meta.get("tab_index", -1)
-        tab_name = self.tabs[tab_index] if tab_index >= 0 else "Unknown"
+        tab_name = request.meta.get("tab_name", "Unknown")
         error_msg = repr(failure.value)
 
+        assembler = self.assemblers.get(ref_no)
+        if assembler is None:
+            return
+
+        # Re-schedule just this tab, backing off further on every attempt
+        attempt = request.meta.get("tab_attempt", 0) + 1
+        if attempt <= self.settings.getint("TAB_RETRY_TIMES", 2):
+            delay = self.settings.getfloat("TAB_RETRY_BACKOFF", 10.0) * 2 ** (attempt - 1)
+            logger.warning(f"Tab {tab_name} failed for {ref_no} ({error_msg}), retry {attempt} in {delay:.0f}s")
+            self.crawler.stats.inc_value("glenigan/tabs/retried")
+            retry = request.replace(dont_filter=True)
+            retry.meta["tab_attempt"] = attempt
+            self.schedule_retry(retry, delay)
+            return
+
         logger.error(f"Tab scraping failed for {ref_no}, Tab: {tab_name}, Error: {error_msg}")
+        assembler.fail(tab_name, error_msg)
+        yield from self.advance(assembler)
+
+    def schedule_retry(self, request, delay):
+        """Hand a request to the engine after ``delay`` seconds.
+
+        The wait happens here rather than in a downloader middleware, so a waiting retry takes
+        no downloader slot and a council in a brownout cannot hold up the others.
+        """
+        from twisted.internet import reactor
+
+        d = task.deferLater(reactor, delay, self.crawler.engine.crawl, request)
+        self.waiting_retries.add(d)
+        d.addErrback(lambda failure: failure.trap(defer.CancelledError))
+        d.addBoth(lambda _: self.waiting_retries.discard(d))
 
-        # Save error in the database
-        self.log_error(ref_no, f"Failed to scrape tab {tab_name}: {error_msg}")
-        
-    def log_error(self, ref_no, error_msg):
-        """Logs errors into the appropriate table."""
+    def log_error(self, ref_no, error_msg, missing_tabs=None, url=None):
+        """Queues an error row; rows are written to the error table in batches."""
+        self.pending_errors[ref_no] = (ref_no, error_msg, ",".join(missing_tabs) if missing_tabs else None, url)
+        logger.info(f"Error logged for {ref_no}: {error_msg}")
+        if self.error_flush_loop is None:
+            self.error_flush_loop = task.LoopingCall(self.flush_errors)
+            self.error_flush_loop.start(self.settings.getfloat("ERROR_LOG_FLUSH_INTERVAL", 5.0), now=False)
+        if len(self.pending_errors) >= self.settings.getint("ERROR_LOG_BATCH_SIZE", 100):
+            self.flush_errors()
+
+    def flush_errors(self):
+        """Writes the queued error rows in a worker thread."""
+        if not self.pending_errors:
+            return defer.succeed(None)
+        rows, self.pending_errors = list(self.pending_errors.values()), {}
+        d = self.error_flush_lock.run(threads.deferToThread, self.write_errors, rows)
+        d.addErrback(lambda failure: logger.error(f"Database logging failed for {len(rows)} errors: {failure.value}"))
+        return d
+
+    def write_errors(self, rows):
         table_name = self.get_error_table()
-        try:
-            connection = pymysql.connect(**self.db_config)
-            cursor = connection.cursor()
-            cursor.execute(
-                f"INSERT INTO {table_name} (ref_no, error) VALUES (%s, %s) ON DUPLICATE KEY UPDATE error = %s",
-                (ref_no, error_msg, error_msg)
-            )
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f"INSERT INTO {table_name} (ref_no, error, missing_tabs, Url) VALUES (%s, %s, %s, %s) "
+                    f"ON DUPLICATE KEY UPDATE error = VALUES(error), missing_tabs = VALUES(missing_tabs), Url = VALUES(Url)",
+                    rows
+                )
             connection.commit()
-            logger.info(f"Error logged for {ref_no}: {error_msg}")
-            cursor.close()
-            connection.close()
-        except Exception as e:
-            logger.error(f"Database logging failed for {ref_no}: {str(e)}")
+
+    def closed(self, reason):
+        """Flush any error rows and checkpoints still queued when the spider finishes."""
+        for retry in list(self.waiting_retries):
+            retry.cancel()
+        if self.error_flush_loop is not None and self.error_flush_loop.running:
+            self.error_flush_loop.stop()
+        d = self.flush_errors()
+        if self.work_queue is not None:
+            if self.heartbeat_loop is not None and self.heartbeat_loop.running:
+                self.heartbeat_loop.stop()
+            # Hand unfinished units straight back instead of waiting for their leases to expire
+            unfinished = [unit_id for unit_id, _, _ in self.leased_units or []]
+            d.addBoth(lambda _: threads.deferToThread(self.work_queue.release, unfinished))
+            d.addErrback(lambda failure: logger.error(f"Could not release work units: {failure.value}"))
+        if self.checkpoints is not None:
+            d.addBoth(lambda _: self.checkpoints.close(finished=reason == "finished"))
+        return d
 
     def construct_tab_url(self, base_url, tab_name):
         """Constructs the correct tab URL."""
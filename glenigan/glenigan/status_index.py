@@ -0,0 +1,127 @@
+import time
+from array import array
+
+from twisted.internet import defer, threads
+
+from glenigan.logger_config import logger
+
+# Ordered by progress; a status is never replaced by a lower one
+STATUS_CODES = {"No": 1, "Partial": 2, "Yes": 3, "Yes(R)": 4}
+STATUS_NAMES = {code: status for status, code in STATUS_CODES.items()}
+
+
+def council_code_of(ref_no):
+    """Return the council code prefix of a sanitized ref_no (``<code>_<ref>``)."""
+    return ref_no.split("_", 1)[0]
+
+
+class CouncilStatuses:
+    """Compact, read-mostly map of ref_no -> scrape_status for one council.
+
+    The ref_nos are kept sorted in a single bytes buffer with an offsets array and a
+    parallel array of one-byte status codes, and are looked up by binary search.
+    Statuses committed during the crawl go into a small overlay dict.
+    """
+
+    def __init__(self, rows):
+        rows = sorted((ref_no.encode("utf-8"), STATUS_CODES.get(status, 0)) for ref_no, status in rows)
+        offsets = array("I", [0])
+        for key, _ in rows:
+            offsets.append(offsets[-1] + len(key))
+        self.keys = b"".join(key for key, _ in rows)
+        self.offsets = offsets
+        self.codes = bytes(code for _, code in rows)
+        self.overlay = {}
+
+    def __len__(self):
+        return len(self.codes) + len(self.overlay)
+
+    def find(self, ref_no):
+        """Return the position of ref_no in the sorted buffer, or -1."""
+        target = ref_no.encode("utf-8")
+        lo, hi = 0, len(self.codes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key = self.keys[self.offsets[mid]:self.offsets[mid + 1]]
+            if key < target:
+                lo = mid + 1
+            elif key > target:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def get(self, ref_no):
+        if ref_no in self.overlay:
+            return self.overlay[ref_no]
+        position = self.find(ref_no)
+        return STATUS_NAMES.get(self.codes[position]) if position >= 0 else None
+
+    def set(self, ref_no, status):
+        self.overlay[ref_no] = status
+
+
+class StatusIndex:
+    """Spider-level index of already-scraped applications, loaded lazily per council.
+
+    ``load_rows(council_code)`` must return an iterable of (ref_no, scrape_status)
+    rows. ``load`` runs it in a worker thread so the crawl can start while the
+    statuses are fetched; ``get`` falls back to a blocking load if nobody asked
+    for the council beforehand.
+    """
+
+    def __init__(self, load_rows, stats=None):
+        self.load_rows = load_rows
+        self.stats = stats
+        self.councils = {}
+        self.waiters = {}
+
+    def load(self, council_code):
+        """Start loading a council in a worker thread; the Deferred fires once it is available."""
+        council_code = str(council_code)
+        if council_code in self.councils:
+            return defer.succeed(self.councils[council_code])
+        waiter = defer.Deferred()
+        if council_code not in self.waiters:
+            self.waiters[council_code] = []
+            started = time.monotonic()
+            d = threads.deferToThread(self.load_rows, council_code)
+            d.addCallbacks(self.loaded, self.load_failed, callbackArgs=(council_code, started), errbackArgs=(council_code,))
+        self.waiters[council_code].append(waiter)
+        return waiter
+
+    def loaded(self, rows, council_code, started):
+        statuses = self.councils.setdefault(council_code, CouncilStatuses(rows))
+        elapsed = time.monotonic() - started
+        logger.info(f"Loaded {len(statuses)} existing records for council {council_code} in {elapsed:.3f}s")
+        if self.stats:
+            self.stats.inc_value("glenigan/status_index/load_seconds", elapsed)
+        for waiter in self.waiters.pop(council_code, []):
+            waiter.callback(statuses)
+
+    def load_failed(self, failure, council_code):
+        logger.error(f"Failed to load existing records for council {council_code}: {failure.value}")
+        for waiter in self.waiters.pop(council_code, []):
+            waiter.errback(failure)
+
+    def council(self, council_code):
+        council_code = str(council_code)
+        statuses = self.councils.get(council_code)
+        if statuses is None:
+            statuses = self.councils[council_code] = CouncilStatuses(self.load_rows(council_code))
+            logger.info(f"Loaded {len(statuses)} existing records for council {council_code}")
+        return statuses
+
+    def get(self, council_code, ref_no):
+        return self.council(council_code).get(ref_no)
+
+    def update(self, ref_no, status, only_new=False):
+        """Record a status the pipeline has committed; a status is never downgraded (see STATUS_CODES)."""
+        council_code = council_code_of(ref_no)
+        statuses = self.councils.get(council_code)
+        if statuses is None:
+            return  # Not loaded yet; it will be read from the database when needed
+        current_status = statuses.get(ref_no)
+        if current_status is not None and (only_new or STATUS_CODES.get(current_status, 0) > STATUS_CODES.get(status, 0)):
+            return
+        statuses.set(ref_no, status)
@@ -0,0 +1,240 @@
+"""Content-addressed storage for application tabs.
+
+Each section (main page or tab) is split into its head (the site chrome up to
+``<body``) and the rest. Per-request tokens (csrf fields, session ids, nonces; see
+fingerprint.strip_tokens) are removed from each part, which is then stored once, as a gzip
+blob named by the SHA-1 of what is left, under objects/<2 hex>/<38 hex>.gz.
+A SQLite manifest maps (ref_no, section) to the hashes of its parts. So identical
+tabs (makeComment, empty comment lists) and the chrome shared by every page are
+written once per portal rather than once per application.
+
+A rescrape or repair only replaces the manifest rows of the sections it fetched.
+Readers rebuild the concatenated dump format on demand: the pages as fetched, less
+their per-request tokens.
+
+Usage:
+    python -m glenigan.tabstore migrate html_dumps tab_store
+    python -m glenigan.tabstore read tab_store <ref_no>
+    python -m glenigan.tabstore stats tab_store
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from glenigan.assembler import section_header, split_sections
+from glenigan.fingerprint import strip_tokens
+from glenigan.logger_config import logger
+
+MANIFEST_FILENAME = "manifest.sqlite"
+BODY_START = re.compile(r"<body", re.IGNORECASE)
+
+# Manifest order of sections: the main page first, then tabs in the order the spider fetches them
+SECTION_ORDER = ["main", "summary", "details", "contacts", "dates", "makeComment", "neighbourComments", "consulteeComments", "constraints", "documents", "relatedCases"]
+
+
+def section_position(section):
+    return SECTION_ORDER.index(section) if section in SECTION_ORDER else len(SECTION_ORDER)
+
+
+def split_parts(html):
+    """Split a page into (head, rest) at ``<body``; a page without one is a single part."""
+    match = BODY_START.search(html)
+    if match is None or match.start() == 0:
+        return [html]
+    return [html[:match.start()], html[match.start():]]
+
+
+class TabStore:
+    """Writes sections as deduplicated blobs and records each application's manifest."""
+
+    def __init__(self, directory="tab_store"):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self.manifest = sqlite3.connect(os.path.join(directory, MANIFEST_FILENAME), check_same_thread=False)
+        self.manifest.execute("PRAGMA journal_mode=WAL")
+        self.manifest.execute("""
+            CREATE TABLE IF NOT EXISTS sections (
+                ref_no TEXT NOT NULL,
+                section TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                parts TEXT NOT NULL,
+                length INTEGER NOT NULL,
+                url TEXT,
+                written_at REAL NOT NULL,
+                PRIMARY KEY (ref_no, section)
+            )
+        """)
+        self.manifest.commit()
+        self.lock = threading.Lock()
+        self.known = set()  # hashes seen to exist, to skip the stat on repeats
+
+    def blob_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], f"{digest[2:]}.gz")
+
+    def put(self, text):
+        """Store one part, less its per-request tokens, unless an equal one is stored already; returns (hash, bytes written)."""
+        raw = strip_tokens(text).encode("utf-8")
+        digest = hashlib.sha1(raw).hexdigest()
+        if digest in self.known:
+            return digest, 0
+        path = self.blob_path(digest)
+        written = 0
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = gzip.compress(raw, compresslevel=6, mtime=0)
+            # Writer threads may race on the same blob; both write the same bytes and the rename is atomic
+            temporary = f"{path}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as file:
+                file.write(data)
+            os.replace(temporary, path)
+            written = len(data)
+        with self.lock:
+            self.known.add(digest)
+        return digest, written
+
+    def write(self, ref_no, sections, url=None):
+        """Store {section: html} for an application; returns (logical bytes, bytes written).
+
+        Sections not given keep what was stored for them before, so a partial
+        rescrape is merged simply by writing the sections it fetched.
+        """
+        rows = []
+        logical = written = 0
+        for section, html in sections:
+            digests = []
+            for part in split_parts(html):
+                digest, size = self.put(part)
+                digests.append(digest)
+                written += size
+            length = len(html.encode("utf-8"))
+            logical += length
+            rows.append((ref_no, section, section_position(section), ",".join(digests), length, url, time.time()))
+        with self.lock:
+            self.manifest.executemany(
+                "INSERT OR REPLACE INTO sections (ref_no, section, position, parts, length, url, written_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.manifest.commit()
+        return logical, written
+
+    def write_segments(self, ref_no, segments, url=None):
+        """Store spooled (section, path) segments; see write()."""
+        def read(path):
+            with open(path, "r", encoding="utf-8") as file:
+                return file.read()
+        return self.write(ref_no, ((section, read(path)) for section, path in segments), url=url)
+
+    def close(self):
+        with self.lock:
+            self.manifest.commit()
+            self.manifest.close()
+
+
+class TabStoreReader:
+    """Rebuilds applications from a TabStore directory."""
+
+    def __init__(self, directory="tab_store"):
+        self.directory = directory
+        self.manifest = sqlite3.connect(os.path.join(directory, MANIFEST_FILENAME))
+
+    def blob(self, digest):
+        with open(os.path.join(self.directory, "objects", digest[:2], f"{digest[2:]}.gz"), "rb") as file:
+            return gzip.decompress(file.read()).decode("utf-8")
+
+    def sections(self, ref_no):
+        """Return an ordered {section: html} for ref_no (empty if it is not stored)."""
+        rows = self.manifest.execute(
+            "SELECT section, parts FROM sections WHERE ref_no = ? ORDER BY position, section", (ref_no,)
+        ).fetchall()
+        return {section: "".join(self.blob(digest) for digest in parts.split(",")) for section, parts in rows}
+
+    def read(self, ref_no):
+        """Return ref_no in the concatenated dump format, or None if it is not stored."""
+        sections = self.sections(ref_no)
+        if not sections:
+            return None
+        return "".join(section_header(section) + html for section, html in sections.items())
+
+    def refs(self):
+        for (ref_no,) in self.manifest.execute("SELECT DISTINCT ref_no FROM sections ORDER BY ref_no"):
+            yield ref_no
+
+    def stats(self):
+        """Return (applications, sections, logical bytes, distinct blobs, blob bytes on disk)."""
+        applications, sections, logical = self.manifest.execute(
+            "SELECT COUNT(DISTINCT ref_no), COUNT(*), COALESCE(SUM(length), 0) FROM sections"
+        ).fetchone()
+        blobs = stored = 0
+        for root, _, names in os.walk(os.path.join(self.directory, "objects")):
+            for name in names:
+                if name.endswith(".gz"):
+                    blobs += 1
+                    stored += os.path.getsize(os.path.join(root, name))
+        return applications, sections, logical, blobs, stored
+
+    def close(self):
+        self.manifest.close()
+
+
+def migrate_dumps(dump_dir, store, delete=False):
+    """One-off import of an existing html_dumps directory into a tab store."""
+    migrated = 0
+    for name in sorted(os.listdir(dump_dir)):
+        if not name.endswith(".html"):
+            continue
+        path = os.path.join(dump_dir, name)
+        with open(path, "r", encoding="utf-8") as file:
+            store.write(name[:-len(".html")], split_sections(file.read()).items())
+        if delete:
+            os.remove(path)
+        migrated += 1
+        if migrated % 1000 == 0:
+            logger.info(f"Migrated {migrated} dumps")
+    logger.info(f"Migrated {migrated} dumps from {dump_dir} to {store.directory}")
+    return migrated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Content-addressed tab store tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="import an html_dumps directory")
+    migrate.add_argument("dump_dir")
+    migrate.add_argument("store_dir")
+    migrate.add_argument("--delete", action="store_true", help="remove each dump once stored")
+    read = commands.add_parser("read", help="print one application's HTML in the dump format")
+    read.add_argument("store_dir")
+    read.add_argument("ref_no")
+    stats = commands.add_parser("stats", help="print how much deduplication saves")
+    stats.add_argument("store_dir")
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        store = TabStore(args.store_dir)
+        try:
+            migrate_dumps(args.dump_dir, store, delete=args.delete)
+        finally:
+            store.close()
+    elif args.command == "read":
+        reader = TabStoreReader(args.store_dir)
+        html = reader.read(args.ref_no)
+        reader.close()
+        if html is None:
+            sys.exit(f"{args.ref_no} is not in {args.store_dir}")
+        sys.stdout.write(html)
+    else:
+        reader = TabStoreReader(args.store_dir)
+        applications, sections, logical, blobs, stored = reader.stats()
+        reader.close()
+        print(f"{applications} applications, {sections} sections, {logical / 1e6:.1f} MB of HTML "
+              f"in {blobs} blobs taking {stored / 1e6:.1f} MB ({logical / stored if stored else 0:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
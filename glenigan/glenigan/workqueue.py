@@ -0,0 +1,283 @@
+"""Lease-based work queue for running several spider processes against one crawl.
+
+A coordinator enqueues one "search" unit per (council, date shard). Workers started
+with ``-a work_queue=...`` lease units in batches and crawl them. Applications found
+by a search go back into the queue as "application" units, so any worker can scrape
+them. A lease expires unless its worker keeps renewing it, and expired units are
+leased again. Units from a worker that crashed are therefore picked up by the
+others. The queue lives in MySQL next to plan_app/decision_app. A SQLite file can
+stand in for it when running several workers on one machine.
+
+Usage:
+    python -m glenigan.workqueue enqueue sqlite:work.sqlite --crawler-type planning \\
+        --start-date 01/02/2025 --end-date 28/02/2025 --shard-days 7 --councils councils.json
+    python -m glenigan.workqueue status sqlite:work.sqlite
+    scrapy crawl scraper -a work_queue=sqlite:work.sqlite -s CHECKPOINT_PATH=worker1_{crawler_type}.sqlite
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+
+from glenigan.db import get_pool, load_db_config
+from glenigan.logger_config import logger
+from glenigan.shards import shard_range
+
+# Applications are leased before searches so started work finishes first
+SEARCH_PRIORITY = 0
+APPLICATION_PRIORITY = 10
+
+
+def queue_table(crawler_type):
+    return "decision_work" if crawler_type == "decision" else "plan_work"
+
+
+def search_unit(council_name, shard):
+    start, end = shard.form_dates()
+    return {
+        "unit_key": f"search:{council_name}:{shard.label}",
+        "kind": "search",
+        "payload": {"council_name": council_name, "start": start, "end": end},
+        "priority": SEARCH_PRIORITY,
+    }
+
+
+def application_unit(ref_no, link, rescrape):
+    return {
+        "unit_key": f"application:{ref_no}",
+        "kind": "application",
+        "payload": {"ref_no": ref_no, "link": link, "rescrape": rescrape},
+        "priority": APPLICATION_PRIORITY,
+    }
+
+
+class WorkQueue:
+    """Work units in a table, leased to one worker at a time with an expiry.
+
+    ``dialect`` is "mysql" (``connect`` is a glenigan.db.ConnectionPool) or "sqlite"
+    (``connect`` is a database file path). Timestamps are Unix seconds taken from the
+    workers' clocks, so nodes should keep their clocks in sync.
+    """
+
+    def __init__(self, dialect, connect, table="plan_work", lease_seconds=300, max_attempts=3, worker_id=None):
+        self.dialect = dialect
+        self.connect = connect
+        self.table = table
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor inside a transaction that locks out other writers in SQLite."""
+        if self.dialect == "sqlite":
+            connection = sqlite3.connect(self.connect, timeout=30, isolation_level=None)
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                cursor = connection.cursor()
+                try:
+                    yield cursor
+                except Exception:
+                    connection.execute("ROLLBACK")
+                    raise
+                connection.execute("COMMIT")
+            finally:
+                connection.close()
+        else:
+            with self.connect.connection() as connection:
+                with connection.cursor() as cursor:
+                    yield cursor
+                connection.commit()
+
+    def sql(self, statement):
+        return statement.replace("%s", "?") if self.dialect == "sqlite" else statement
+
+    def placeholders(self, count):
+        return ", ".join(["?" if self.dialect == "sqlite" else "%s"] * count)
+
+    def create_table(self):
+        if self.dialect == "sqlite":
+            statements = [
+                f"""CREATE TABLE IF NOT EXISTS {self.table} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    unit_key TEXT NOT NULL UNIQUE,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )""",
+                f"CREATE INDEX IF NOT EXISTS idx_{self.table}_status ON {self.table} (status, priority, id)",
+            ]
+        else:
+            statements = [
+                f"""CREATE TABLE IF NOT EXISTS {self.table} (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    unit_key VARCHAR(255) NOT NULL UNIQUE,
+                    kind VARCHAR(16) NOT NULL,
+                    payload TEXT NOT NULL,
+                    priority INT NOT NULL DEFAULT 0,
+                    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+                    lease_owner VARCHAR(64),
+                    lease_expires DOUBLE,
+                    attempts INT NOT NULL DEFAULT 0,
+                    INDEX idx_status (status, priority, id)
+                )""",
+            ]
+        with self.transaction() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    def enqueue(self, units):
+        """Add units; a unit_key that is already queued (or done) is left alone, so enqueueing is idempotent."""
+        if not units:
+            return
+        verb = "INSERT OR IGNORE" if self.dialect == "sqlite" else "INSERT IGNORE"
+        with self.transaction() as cursor:
+            cursor.executemany(
+                self.sql(f"{verb} INTO {self.table} (unit_key, kind, payload, priority) VALUES (%s, %s, %s, %s)"),
+                [(unit["unit_key"], unit["kind"], json.dumps(unit["payload"]), unit["priority"]) for unit in units],
+            )
+
+    def lease(self, limit):
+        """Lease up to ``limit`` pending or expired units to this worker; returns [(id, kind, payload)]."""
+        now = time.time()
+        lock = "" if self.dialect == "sqlite" else " FOR UPDATE SKIP LOCKED"
+        with self.transaction() as cursor:
+            cursor.execute(
+                self.sql(
+                    f"SELECT id, kind, payload FROM {self.table} "
+                    f"WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < %s)) AND attempts < %s "
+                    f"ORDER BY priority DESC, id LIMIT %s{lock}"
+                ),
+                (now, self.max_attempts, limit),
+            )
+            rows = cursor.fetchall()
+            if rows:
+                cursor.execute(
+                    self.sql(
+                        f"UPDATE {self.table} SET status = 'leased', lease_owner = %s, lease_expires = %s, attempts = attempts + 1 "
+                        f"WHERE id IN ({self.placeholders(len(rows))})"
+                    ),
+                    (self.worker_id, now + self.lease_seconds, *[row[0] for row in rows]),
+                )
+        return [(unit_id, kind, json.loads(payload)) for unit_id, kind, payload in rows]
+
+    def heartbeat(self, unit_ids):
+        """Extend this worker's leases on ``unit_ids``."""
+        if not unit_ids:
+            return
+        with self.transaction() as cursor:
+            cursor.execute(
+                self.sql(
+                    f"UPDATE {self.table} SET lease_expires = %s "
+                    f"WHERE status = 'leased' AND lease_owner = %s AND id IN ({self.placeholders(len(unit_ids))})"
+                ),
+                (time.time() + self.lease_seconds, self.worker_id, *unit_ids),
+            )
+
+    def complete(self, unit_ids):
+        """Mark units done; harmless if another worker already finished them."""
+        if not unit_ids:
+            return
+        with self.transaction() as cursor:
+            cursor.execute(
+                self.sql(f"UPDATE {self.table} SET status = 'done', lease_owner = NULL WHERE id IN ({self.placeholders(len(unit_ids))})"),
+                tuple(unit_ids),
+            )
+
+    def release(self, unit_ids):
+        """Hand this worker's unfinished units back without waiting for the leases to expire."""
+        if not unit_ids:
+            return
+        with self.transaction() as cursor:
+            cursor.execute(
+                self.sql(
+                    f"UPDATE {self.table} SET status = 'pending', lease_owner = NULL, lease_expires = NULL, attempts = attempts - 1 "
+                    f"WHERE status = 'leased' AND lease_owner = %s AND id IN ({self.placeholders(len(unit_ids))})"
+                ),
+                (self.worker_id, *unit_ids),
+            )
+
+    def outstanding(self):
+        """Number of units that are not done and can still be leased (now or once a lease expires)."""
+        with self.transaction() as cursor:
+            cursor.execute(
+                self.sql(f"SELECT COUNT(*) FROM {self.table} WHERE status IN ('pending', 'leased') AND attempts < %s"),
+                (self.max_attempts,),
+            )
+            return cursor.fetchone()[0]
+
+    def counts(self):
+        """Return {(kind, status): count}, with units that ran out of attempts counted as 'failed'."""
+        with self.transaction() as cursor:
+            cursor.execute(
+                self.sql(
+                    f"SELECT kind, CASE WHEN status != 'done' AND attempts >= %s THEN 'failed' ELSE status END, COUNT(*) "
+                    f"FROM {self.table} GROUP BY 1, 2"
+                ),
+                (self.max_attempts,),
+            )
+            return {(kind, status): count for kind, status, count in cursor.fetchall()}
+
+
+def open_work_queue(spec, crawler_type="planning", db_config=None, settings=None):
+    """Open the queue named by ``spec``: "mysql" or "sqlite:<path>"."""
+    options = {}
+    if settings is not None:
+        options = {
+            "lease_seconds": settings.getint("WORK_QUEUE_LEASE_SECONDS", 300),
+            "max_attempts": settings.getint("WORK_QUEUE_MAX_ATTEMPTS", 3),
+        }
+    if spec.startswith("sqlite:"):
+        queue = WorkQueue("sqlite", spec[len("sqlite:"):], queue_table(crawler_type), **options)
+    elif spec == "mysql":
+        queue = WorkQueue("mysql", get_pool(db_config), queue_table(crawler_type), **options)
+    else:
+        raise ValueError(f"Unknown work queue {spec!r}, expected 'mysql' or 'sqlite:<path>'")
+    queue.create_table()
+    return queue
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Distributed crawl work queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue = commands.add_parser("enqueue", help="queue one search unit per council and date shard")
+    enqueue.add_argument("queue", help="'mysql' or 'sqlite:<path>'")
+    enqueue.add_argument("--crawler-type", default="planning", choices=["planning", "decision"])
+    enqueue.add_argument("--start-date", required=True)
+    enqueue.add_argument("--end-date", required=True)
+    enqueue.add_argument("--shard-days", type=int, default=1)
+    enqueue.add_argument("--councils", required=True, help="councils.json")
+    enqueue.add_argument("--db-config", help="database.ini, for a mysql queue")
+    status = commands.add_parser("status", help="print unit counts by kind and status")
+    status.add_argument("queue")
+    status.add_argument("--crawler-type", default="planning", choices=["planning", "decision"])
+    status.add_argument("--db-config")
+    args = parser.parse_args(argv)
+
+    db_config = load_db_config(args.db_config) if args.db_config else None
+    queue = open_work_queue(args.queue, args.crawler_type, db_config)
+    if args.command == "enqueue":
+        with open(args.councils, "r") as file:
+            councils = json.load(file)
+        units = [
+            search_unit(council_name, shard)
+            for council_name in councils
+            for shard in shard_range(args.start_date, args.end_date, args.shard_days)
+        ]
+        queue.enqueue(units)
+        logger.info(f"Queued {len(units)} search units for {len(councils)} councils in {queue.table}")
+    else:
+        for (kind, unit_status), count in sorted(queue.counts().items()):
+            print(f"{kind:<12} {unit_status:<8} {count}")
+
+
+if __name__ == "__main__":
+    main()
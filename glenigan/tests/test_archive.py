@@ -0,0 +1,65 @@
+from glenigan.archive import ArchiveReader, SegmentArchive
+from glenigan.assembler import split_sections
+
+
+def page(**sections):
+    return "".join(
+        ("\n<!-- Main Page -->\n" if section == "main" else f"\n<!-- Tab: {section} -->\n") + body
+        for section, body in sections.items()
+    )
+
+
+def test_records_round_trip_through_the_index(tmp_path):
+    archive = SegmentArchive(str(tmp_path))
+    first = page(main="<p>one</p>", summary="<p>summary one</p>")
+    second = page(main="<p>two</p>")
+    archive.write("101_A", [first[:10], first[10:]], url="http://portal/a")
+    archive.write("101_B", [second])
+    archive.close()
+
+    reader = ArchiveReader(str(tmp_path))
+    header, html = reader.read_record("101_A")
+    assert html == first
+    assert header["ref_no"] == "101_A" and header["url"] == "http://portal/a"
+    assert reader.read("101_B") == second
+    assert reader.read("101_C") is None
+    assert list(reader.refs()) == ["101_A", "101_B"]
+    reader.close()
+
+
+def test_segments_rotate_once_full_and_reopen_at_the_last_one(tmp_path):
+    archive = SegmentArchive(str(tmp_path), segment_size=1)
+    segments = [archive.write(f"101_{number}", [page(main="x" * 100)])[0] for number in range(3)]
+    archive.close()
+    assert segments == ["segment-00001.gz", "segment-00002.gz", "segment-00003.gz"]
+
+    archive = SegmentArchive(str(tmp_path), segment_size=1)
+    assert archive.segment_name() == "segment-00003.gz"
+    archive.close()
+    reader = ArchiveReader(str(tmp_path))
+    assert [split_sections(reader.read(f"101_{number}"))["main"] for number in range(3)] == ["x" * 100] * 3
+    reader.close()
+
+
+def test_a_later_full_record_replaces_the_earlier_one(tmp_path):
+    archive = SegmentArchive(str(tmp_path))
+    archive.write("101_A", [page(main="old", summary="old summary")])
+    archive.write("101_A", [page(main="new")])
+    archive.close()
+    reader = ArchiveReader(str(tmp_path))
+    assert split_sections(reader.read("101_A")) == {"main": "new"}
+    reader.close()
+
+
+def test_partial_records_overlay_the_last_full_record(tmp_path):
+    archive = SegmentArchive(str(tmp_path))
+    archive.write("101_A", [page(main="old main", summary="old summary", dates="old dates")])
+    archive.write("101_A", [page(summary="new summary")], partial=True)
+    archive.write("101_A", [page(dates="new dates")], partial=True)
+    archive.close()
+    reader = ArchiveReader(str(tmp_path))
+    sections = split_sections(reader.read("101_A"))
+    assert sections == {"main": "old main", "summary": "new summary", "dates": "new dates"}
+    assert list(sections) == ["main", "summary", "dates"]
+    assert len(reader.locate("101_A")) == 3
+    reader.close()
@@ -0,0 +1,166 @@
+import os
+
+from glenigan.assembler import TabAssembler, discard_segments, fill_fingerprints, iter_html, merge_sections, split_sections
+from glenigan.fingerprint import content_hash
+
+TABS = ["summary", "details", "dates"]
+SAVED = {"main": "<html>main</html>", "summary": "<p>summary</p>", "details": "<p>details</p>", "dates": "<p>dates</p>"}
+
+
+def make_assembler(tmp_path, **kwargs):
+    return TabAssembler("25_00001_FUL", "http://portal/app", TABS, spool_dir=str(tmp_path), **kwargs)
+
+
+def stored_fingerprints(sections=SAVED):
+    return {section: (content_hash(html), f'"{section}"', None) for section, html in sections.items()}
+
+
+def request_all(assembler):
+    tabs = []
+    while (tab_name := assembler.next_tab()) is not None:
+        tabs.append(tab_name)
+    return tabs
+
+
+def test_tabs_are_requested_in_order_and_done_once_all_settle(tmp_path):
+    assembler = make_assembler(tmp_path)
+    assembler.set_main("<html>main</html>")
+    assert request_all(assembler) == TABS
+    assembler.add("dates", "<p>dates</p>")
+    assembler.fail("details", "timeout")
+    assert not assembler.done
+    assembler.add("summary", "<p>summary</p>")
+    assert assembler.done
+    assert assembler.missing_tabs == ["details"]
+    assert assembler.captured_tabs == ["summary", "dates"]
+    assert assembler.changed_tabs is None
+
+
+def test_segments_follow_tab_order_whatever_the_arrival_order(tmp_path):
+    assembler = make_assembler(tmp_path)
+    assembler.set_main("<html>main</html>")
+    request_all(assembler)
+    for tab_name in reversed(TABS):
+        assembler.add(tab_name, f"<p>{tab_name}</p>")
+    assert [section for section, _ in assembler.segments()] == ["main"] + TABS
+    html = "".join(iter_html(assembler.segments(), chunk_size=4))
+    assert split_sections(html) == {"main": "<html>main</html>", **{tab_name: f"<p>{tab_name}</p>" for tab_name in TABS}}
+
+
+def test_sections_are_spooled_to_files_and_discarded(tmp_path):
+    assembler = make_assembler(tmp_path)
+    assembler.set_main("<html>main</html>")
+    request_all(assembler)
+    assembler.add("summary", "<p>summary</p>")
+    paths = [path for _, path in assembler.segments()]
+    assert all(os.path.exists(path) for path in paths)
+    assembler.discard()
+    assert not any(os.path.exists(path) for path in paths)
+    assert not os.path.exists(assembler.directory)
+
+
+def test_merge_sections_replaces_only_the_given_sections(tmp_path):
+    existing = "\n<!-- Main Page -->\nold main\n<!-- Tab: summary -->\nold summary\n<!-- Tab: dates -->\nold dates"
+    path = tmp_path / "summary.html"
+    path.write_text("new summary", encoding="utf-8")
+    merged = split_sections(merge_sections(existing, [("summary", str(path))]))
+    assert merged == {"main": "old main", "summary": "new summary", "dates": "old dates"}
+    assert list(merged) == ["main", "summary", "dates"]
+
+
+def test_discard_segments_ignores_files_already_gone(tmp_path):
+    directory = tmp_path / "spooled"
+    directory.mkdir()
+    kept = directory / "main.html"
+    kept.write_text("x", encoding="utf-8")
+    discard_segments([("main", str(kept)), ("summary", str(directory / "summary.html"))])
+    assert not directory.exists()
+
+
+def test_unchanged_probe_finishes_without_the_held_tabs(tmp_path):
+    assembler = make_assembler(tmp_path, rescrape=True, stored=stored_fingerprints(), probe_tabs=("summary",))
+    assembler.set_main(SAVED["main"])
+    assert request_all(assembler) == ["summary"]
+    assembler.add("summary", SAVED["summary"])
+    assert not assembler.release_held()
+    assert assembler.done
+    assert assembler.changed_tabs == []
+    assert assembler.segments() == []
+
+
+def test_changed_probe_releases_the_held_tabs(tmp_path):
+    assembler = make_assembler(tmp_path, rescrape=True, stored=stored_fingerprints(), probe_tabs=("summary",))
+    assembler.set_main(SAVED["main"])
+    assert request_all(assembler) == ["summary"]
+    assembler.add("summary", "<p>summary, amended</p>")
+    assert assembler.release_held()
+    assert request_all(assembler) == ["details", "dates"]
+    assembler.add("details", SAVED["details"])
+    assembler.add("dates", "<p>dates, extended</p>")
+    assert assembler.done
+    assert assembler.changed_tabs == ["summary", "dates"]
+    assert assembler.captured_tabs == TABS
+
+
+def test_not_modified_keeps_the_stored_fingerprint(tmp_path):
+    stored = stored_fingerprints()
+    assembler = make_assembler(tmp_path, rescrape=True, stored=stored)
+    request_all(assembler)
+    assembler.not_modified("summary")
+    assert assembler.fingerprints["summary"] == stored["summary"]
+    assert "summary" in assembler.unchanged
+
+
+def test_new_sections_are_hashed_later_by_fill_fingerprints(tmp_path):
+    assembler = make_assembler(tmp_path)
+    assembler.set_main(SAVED["main"])
+    request_all(assembler)
+    assembler.add("summary", SAVED["summary"], etag='"v1"')
+    assert assembler.fingerprints["summary"] == (None, '"v1"', None)
+    fill_fingerprints(assembler.fingerprints, assembler.segments())
+    assert assembler.fingerprints["summary"] == (content_hash(SAVED["summary"]), '"v1"', None)
+    assert assembler.fingerprints["main"][0] == content_hash(SAVED["main"])
+
+
+def test_resume_restores_spooled_sections_and_queues_the_rest(tmp_path):
+    first = make_assembler(tmp_path)
+    first.set_main(SAVED["main"])
+    request_all(first)
+    first.add("summary", SAVED["summary"])
+    spooled = {section: (path, first.fingerprints[section]) for section, path in first.segments()}
+
+    resumed = make_assembler(tmp_path)
+    resumed.resume(spooled)
+    assert request_all(resumed) == ["details", "dates"]
+    resumed.add("details", SAVED["details"])
+    resumed.add("dates", SAVED["dates"])
+    assert resumed.done
+    assert [section for section, _ in resumed.segments()] == ["main"] + TABS
+
+
+def test_resume_with_every_tab_spooled_fetches_the_last_one_again(tmp_path):
+    first = make_assembler(tmp_path)
+    first.set_main(SAVED["main"])
+    request_all(first)
+    for tab_name in TABS:
+        first.add(tab_name, SAVED[tab_name])
+    spooled = {section: (path, None) for section, path in first.segments()}
+
+    resumed = make_assembler(tmp_path)
+    resumed.resume(spooled)
+    assert request_all(resumed) == ["dates"]
+    assert not resumed.done
+    resumed.add("dates", SAVED["dates"])
+    assert resumed.done
+
+
+def test_repair_fetches_only_the_missing_tabs(tmp_path):
+    assembler = make_assembler(tmp_path)
+    assembler.repair(["dates", "summary"])
+    assert request_all(assembler) == ["summary", "dates"]
+    assembler.add("summary", SAVED["summary"])
+    assembler.fail("dates", "HTTP 503")
+    assert assembler.done
+    assert assembler.changed_tabs == ["summary"]
+    assert assembler.missing_tabs == ["dates"]
+    assert assembler.captured_tabs == ["summary"]
@@ -0,0 +1,37 @@
+import pytest
+
+from glenigan.fingerprint import content_hash, normalize_html, strip_tokens
+
+
+@pytest.mark.parametrize("first, second", [
+    ('<input type="hidden" name="_csrf" value="a1"/><p>x</p>', '<input type="hidden" name="_csrf" value="b2"/><p>x</p>'),
+    ('<meta name="_csrf" content="a1"/>', '<meta name="_csrf" content="b2"/>'),
+    ('<a href="/a.do;jsessionid=ABC.node1?x=1">', '<a href="/a.do;jsessionid=XYZ.node2?x=1">'),
+    ('<script nonce="abc">', '<script nonce="xyz">'),
+    ('<img src="a.png?_=1739970000123">', '<img src="a.png?_=1739970999999">'),
+    ("<p>Last updated: 19 Feb 2025 14:05</p>", "<p>Last Updated: 20 Feb 2025 09:15</p>"),
+    ("<p>Generated on 19/02/2025 9:05 PM</p>", "<p>Generated on 19/02/2025 10:40 AM</p>"),
+    ("<td>2025-02-19 14:05:10</td>", "<td>2025-02-19 16:00:00</td>"),
+    ("<p>a   b\n\tc</p>", "<p>a b c</p>"),
+])
+def test_volatile_markup_does_not_change_the_hash(first, second):
+    assert content_hash(first) == content_hash(second)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("<td>Scale 1:50</td>", "<td>Scale 1:100</td>"),
+    ("<td>Ratio 3:2</td>", "<td>Ratio 4:3</td>"),
+    ("<td>Decided 19/02/2025</td>", "<td>Decided 20/02/2025</td>"),
+    ("<td>Meeting at 14:05</td>", "<td>Meeting at 15:05</td>"),
+])
+def test_real_content_changes_the_hash(first, second):
+    assert content_hash(first) != content_hash(second)
+
+
+def test_strip_tokens_keeps_timestamps_and_whitespace():
+    html = '<meta name="_csrf" content="a1"/>\n<p>Last updated: 19 Feb 2025 14:05</p>  <a href="/a.do;jsessionid=X1">'
+    assert strip_tokens(html) == '\n<p>Last updated: 19 Feb 2025 14:05</p>  <a href="/a.do">'
+
+
+def test_pages_without_volatile_markup_only_lose_whitespace():
+    assert normalize_html("<p> Scale 1:50 at 12 High St </p>") == "<p> Scale 1:50 at 12 High St </p>"
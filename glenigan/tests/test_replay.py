@@ -0,0 +1,30 @@
+from glenigan.replay import ReplayStore, request_key
+
+SEARCH = "http://portal/online-applications/advancedSearchResults.do"
+
+
+def test_query_order_and_method_case_do_not_matter():
+    assert request_key("get", "http://portal/app.do?b=2&a=1") == request_key("GET", "http://portal/app.do?a=1&b=2")
+
+
+def test_post_bodies_ignore_field_order_and_csrf_tokens():
+    first = request_key("POST", SEARCH, b"date=19%2F02%2F2025&_csrf=one&council=1")
+    second = request_key("POST", SEARCH, b"council=1&_csrf=two&date=19%2F02%2F2025")
+    assert first == second
+    assert first != request_key("POST", SEARCH, b"council=2&_csrf=one&date=19%2F02%2F2025")
+
+
+def test_get_bodies_and_cookiejars():
+    assert request_key("GET", SEARCH, b"ignored=1") == request_key("GET", SEARCH)
+    assert request_key("GET", SEARCH, cookiejar="1:20250201-20250207") != request_key("GET", SEARCH, cookiejar="1:20250208-20250214")
+    assert request_key("GET", SEARCH) != request_key("POST", SEARCH)
+
+
+def test_store_round_trip_and_last_response_wins(tmp_path):
+    store = ReplayStore(str(tmp_path / "replay.sqlite"), commit_every=1)
+    key = request_key("GET", SEARCH)
+    store.put(key, "GET", SEARCH, 503, {"Retry-After": ["5"]}, b"busy")
+    store.put(key, "GET", SEARCH, 200, {"Content-Type": ["text/html"]}, b"<html>ok</html>")
+    assert store.get(key) == (200, {"Content-Type": ["text/html"]}, b"<html>ok</html>")
+    assert store.get(request_key("GET", SEARCH + "?page=2")) is None
+    store.close()
@@ -0,0 +1,76 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from glenigan.rescrape import RescrapePlanner, summarize
+
+NOW = datetime(2025, 6, 1, 12, 0)
+
+
+def candidate(ref_no, scraped_days_ago, changed_days_ago=None, validated=None, decided=None, decision=None):
+    return (
+        ref_no,
+        f"http://portal/{ref_no}",
+        NOW - timedelta(days=scraped_days_ago) if scraped_days_ago is not None else None,
+        NOW - timedelta(days=changed_days_ago) if changed_days_ago is not None else None,
+        validated,
+        decided,
+        decision,
+    )
+
+
+@pytest.mark.parametrize("last_changed_at, validated, decided, decision, reason", [
+    (NOW - timedelta(days=3), None, date(2020, 1, 1), "Approved", "changed_recently"),
+    (None, date(2025, 5, 20), None, "Pending Consideration", "new"),
+    (None, date(2024, 1, 1), None, "Pending Decision", "undecided"),
+    (None, date(2024, 1, 1), date(2025, 5, 25), "Approved", "decided_recently"),
+    (None, date(2020, 1, 1), date(2020, 3, 1), "Refused", "decided"),
+    (None, None, None, "Approved", "decided"),
+    (None, None, None, None, "unknown"),
+    (NOW - timedelta(days=90), None, None, "Not Available", "undecided"),
+])
+def test_classify(last_changed_at, validated, decided, decision, reason):
+    assert RescrapePlanner().classify(NOW, last_changed_at, validated, decided, decision) == reason
+
+
+def test_priority_is_age_over_interval_capped_at_max_age():
+    planner = RescrapePlanner(intervals={"undecided": 10}, max_age_days=100)
+    assert planner.priority(NOW, NOW - timedelta(days=5), "undecided") == 0.5
+    assert planner.priority(NOW, NOW - timedelta(days=500), "undecided") == 10.0
+    assert planner.priority(NOW, None, "undecided") == 10.0
+
+
+def test_plan_keeps_the_most_overdue_within_the_budget():
+    planner = RescrapePlanner(budget=10)
+    candidates = [
+        candidate("A", scraped_days_ago=10, decision="Pending Decision"),  # undecided, 10/7
+        candidate("B", scraped_days_ago=30, decision="Pending Decision"),  # undecided, 30/7
+        candidate("C", scraped_days_ago=3, changed_days_ago=3),  # changed_recently, 3/2
+        candidate("D", scraped_days_ago=1, decision="Pending Decision"),  # not due
+        candidate("E", scraped_days_ago=20, decision="Pending Decision"),  # undecided, 20/7
+    ]
+    plan = planner.plan(iter(candidates), cost=lambda ref_no: 4, now=NOW)
+    assert [ref_no for _, ref_no, _, _ in plan] == ["B", "E"]
+    assert summarize(plan) == {"undecided": 2}
+
+
+def test_plan_with_room_for_everything_due_orders_by_priority():
+    planner = RescrapePlanner(budget=100)
+    candidates = [
+        candidate("A", scraped_days_ago=10, decision="Pending Decision"),
+        candidate("B", scraped_days_ago=3, changed_days_ago=3),
+        candidate("C", scraped_days_ago=400, decided=date(2020, 1, 1), decision="Approved"),
+        candidate("D", scraped_days_ago=100, decided=date(2020, 1, 1), decision="Approved"),
+    ]
+    plan = planner.plan(candidates, cost=lambda ref_no: 1, now=NOW)
+    assert [ref_no for _, ref_no, _, _ in plan] == ["C", "B", "A"]
+    assert plan[0][3] == "decided" and plan[1][3] == "changed_recently"
+
+
+def test_plan_respects_per_application_costs():
+    planner = RescrapePlanner(budget=5)
+    candidates = [candidate(ref_no, scraped_days_ago=days, decision="Pending Decision") for ref_no, days in (("A", 70), ("B", 60), ("C", 50))]
+    costs = {"A": 4, "B": 2, "C": 1}
+    plan = planner.plan(candidates, cost=costs.get, now=NOW)
+    assert [ref_no for _, ref_no, _, _ in plan] == ["A"]
+    assert sum(costs[ref_no] for _, ref_no, _, _ in plan) <= 5
@@ -0,0 +1,77 @@
+from scrapy import Request
+
+from glenigan.scheduling import ApplicationGate
+
+
+def page(number):
+    return Request(f"http://portal/results?searchCriteria.page={number}")
+
+
+def submit(gate, count, start=0):
+    released = []
+    for number in range(start, start + count):
+        released.extend(gate.submit_application(f"101_{number}", f"app {number}"))
+    return released
+
+
+def test_without_a_cap_everything_is_released():
+    gate = ApplicationGate()
+    assert submit(gate, 5) == [f"app {number}" for number in range(5)]
+    pages = [page(number) for number in range(2, 5)]
+    assert [gate.submit_page(request) for request in pages] == [[request] for request in pages]
+    assert all(request.meta["gated"] for request in pages)
+    assert len(gate) == 0
+
+
+def test_applications_beyond_the_cap_wait_until_one_closes():
+    gate = ApplicationGate(max_open=2)
+    assert submit(gate, 3) == ["app 0", "app 1"]
+    assert len(gate) == 1
+    gate.close("101_0")
+    assert gate.release() == ["app 2"]
+    assert gate.open == {"101_1", "101_2"}
+
+
+def test_pages_wait_while_applications_do():
+    gate = ApplicationGate(max_open=1, max_pages=4)
+    submit(gate, 2)
+    assert gate.submit_page(page(2)) == []
+    gate.close("101_0")
+    assert gate.release() == ["app 1"]
+    gate.close("101_1")
+    released = gate.release()
+    assert [request.url for request in released] == [page(2).url]
+
+
+def test_up_to_max_pages_are_in_flight_while_there_is_room():
+    gate = ApplicationGate(max_open=10, max_pages=3)
+    released = [request for number in range(2, 7) for request in gate.submit_page(page(number))]
+    assert len(released) == 3
+    assert gate.pages_in_flight == 3
+    gate.page_arrived()
+    assert len(gate.release()) == 1
+    assert len(gate.pages) == 1
+
+
+def test_no_pages_are_released_when_the_gate_is_full():
+    gate = ApplicationGate(max_open=2, max_pages=3)
+    submit(gate, 2)
+    assert gate.submit_page(page(2)) == []
+    assert gate.pages_in_flight == 0
+
+
+def test_unstick_forgets_finished_applications_and_lost_pages():
+    gate = ApplicationGate(max_open=2, max_pages=1)
+    submit(gate, 3)
+    gate.pages_in_flight = 1
+    assert gate.unstick(active=["101_1"]) == ["app 2"]
+    assert gate.open == {"101_1", "101_2"}
+    assert gate.pages_in_flight == 0
+
+
+def test_applications_started_outside_the_gate_count_against_the_cap():
+    gate = ApplicationGate(max_open=1)
+    gate.opened("101_resumed")
+    assert submit(gate, 1) == []
+    gate.close("101_resumed")
+    assert gate.release() == ["app 0"]
@@ -0,0 +1,46 @@
+from datetime import date
+
+import pytest
+
+from glenigan.shards import DateShard, shard_range
+
+
+def test_shards_cover_the_range_without_gaps_or_overlap():
+    shards = shard_range("01/02/2025", "10/02/2025", shard_days=3)
+    assert shards == [
+        DateShard(date(2025, 2, 1), date(2025, 2, 3)),
+        DateShard(date(2025, 2, 4), date(2025, 2, 6)),
+        DateShard(date(2025, 2, 7), date(2025, 2, 9)),
+        DateShard(date(2025, 2, 10), date(2025, 2, 10)),
+    ]
+    assert sum(shard.days for shard in shards) == 10
+
+
+def test_single_day_and_non_positive_shard_days():
+    assert shard_range("19/02/2025", "19/02/2025", shard_days=7) == [DateShard(date(2025, 2, 19), date(2025, 2, 19))]
+    assert len(shard_range("01/02/2025", "03/02/2025", shard_days=0)) == 3
+
+
+def test_end_before_start_is_rejected():
+    with pytest.raises(ValueError):
+        shard_range("02/02/2025", "01/02/2025")
+
+
+@pytest.mark.parametrize("days", [2, 3, 7, 31])
+def test_split_halves_the_window(days):
+    shard = DateShard(date(2025, 1, 1), date(2025, 1, days))
+    first, second = shard.split()
+    assert first.start == shard.start and second.end == shard.end
+    assert (second.start - first.end).days == 1
+    assert first.days == days // 2
+
+
+def test_single_day_cannot_be_split():
+    shard = DateShard(date(2025, 1, 1), date(2025, 1, 1))
+    assert shard.split() == [shard]
+
+
+def test_form_dates_and_label():
+    shard = DateShard.parse("01/02/2025", "07/02/2025")
+    assert shard.form_dates() == ("01/02/2025", "07/02/2025")
+    assert shard.label == "20250201-20250207"
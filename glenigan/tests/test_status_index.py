@@ -0,0 +1,55 @@
+from glenigan.status_index import CouncilStatuses, StatusIndex, council_code_of
+
+ROWS = [("101_25_00003_FUL", "Yes"), ("101_25_00001_FUL", "No"), ("101_25_00002_HOU", "Partial"), ("101_24_09999_FUL", "Yes(R)")]
+
+
+def test_binary_search_finds_every_row_and_misses_the_rest():
+    statuses = CouncilStatuses(ROWS)
+    for ref_no, status in ROWS:
+        assert statuses.get(ref_no) == status
+    assert statuses.get("101_25_00000_FUL") is None
+    assert statuses.get("101_25_00004_FUL") is None
+    assert statuses.get("") is None
+    assert len(statuses) == len(ROWS)
+
+
+def test_empty_council_has_no_statuses():
+    statuses = CouncilStatuses([])
+    assert statuses.get("101_25_00001_FUL") is None
+    assert len(statuses) == 0
+
+
+def test_overlay_wins_over_the_loaded_rows():
+    statuses = CouncilStatuses(ROWS)
+    statuses.set("101_25_00001_FUL", "Yes")
+    statuses.set("101_25_00010_FUL", "No")
+    assert statuses.get("101_25_00001_FUL") == "Yes"
+    assert statuses.get("101_25_00010_FUL") == "No"
+
+
+def test_non_ascii_ref_nos_sort_by_bytes():
+    statuses = CouncilStatuses([("101_é", "Yes"), ("101_z", "No"), ("101_a", "Partial")])
+    assert [statuses.get(ref_no) for ref_no in ("101_a", "101_z", "101_é")] == ["Partial", "No", "Yes"]
+
+
+def test_update_never_downgrades_and_only_new_keeps_existing():
+    index = StatusIndex(lambda council_code: ROWS if council_code == "101" else [])
+    assert index.get("101", "101_25_00003_FUL") == "Yes"
+    index.update("101_25_00003_FUL", "No")
+    assert index.get("101", "101_25_00003_FUL") == "Yes"
+    index.update("101_25_00003_FUL", "Yes(R)")
+    assert index.get("101", "101_25_00003_FUL") == "Yes(R)"
+    index.update("101_25_00002_HOU", "No", only_new=True)
+    assert index.get("101", "101_25_00002_HOU") == "Partial"
+    index.update("101_25_00020_FUL", "No", only_new=True)
+    assert index.get("101", "101_25_00020_FUL") == "No"
+
+
+def test_update_before_load_is_left_to_the_database():
+    loads = []
+    index = StatusIndex(lambda council_code: loads.append(council_code) or [])
+    index.update("202_25_00001_FUL", "Yes")
+    assert loads == []
+    assert index.get("202", "202_25_00001_FUL") is None
+    assert loads == ["202"]
+    assert council_code_of("202_25_00001_FUL") == "202"
@@ -0,0 +1,62 @@
+from glenigan.assembler import split_sections
+from glenigan.tabstore import TabStore, TabStoreReader, split_parts
+
+HEAD = "<html><head><title>Application</title></head>"
+
+
+def comment_page(token, body="<p>Make a comment</p>"):
+    return f'{HEAD}<body><form><input type="hidden" name="_csrf" value="{token}"/></form>{body}</body></html>'
+
+
+def test_sections_round_trip_in_tab_order(tmp_path):
+    store = TabStore(str(tmp_path))
+    store.write("101_A", [("dates", f"{HEAD}<body>dates</body>"), ("main", f"{HEAD}<body>main</body>"), ("summary", "no body tag")])
+    store.close()
+    reader = TabStoreReader(str(tmp_path))
+    assert reader.sections("101_A") == {"main": f"{HEAD}<body>main</body>", "summary": "no body tag", "dates": f"{HEAD}<body>dates</body>"}
+    assert split_sections(reader.read("101_A")) == reader.sections("101_A")
+    assert reader.read("101_B") is None
+    assert list(reader.refs()) == ["101_A"]
+    reader.close()
+
+
+def test_parts_differing_only_in_tokens_are_stored_once(tmp_path):
+    store = TabStore(str(tmp_path))
+    logical = written = 0
+    for number in range(50):
+        sizes = store.write(f"101_{number}", [("makeComment", comment_page(f"token-{number}"))])
+        logical += sizes[0]
+        written += sizes[1]
+    store.close()
+    reader = TabStoreReader(str(tmp_path))
+    applications, sections, _, blobs, _ = reader.stats()
+    assert (applications, sections, blobs) == (50, 50, 2)
+    assert 'name="_csrf"' not in reader.read("101_7")
+    assert written < logical / 10
+    reader.close()
+
+
+def test_real_differences_are_kept(tmp_path):
+    store = TabStore(str(tmp_path))
+    store.write("101_A", [("constraints", comment_page("a", "<td>Scale 1:50</td><p>Last updated 19 Feb 2025 14:05</p>"))])
+    store.write("101_B", [("constraints", comment_page("b", "<td>Scale 1:100</td><p>Last updated 20 Feb 2025 09:00</p>"))])
+    store.close()
+    reader = TabStoreReader(str(tmp_path))
+    assert "Scale 1:50" in reader.read("101_A") and "14:05" in reader.read("101_A")
+    assert "Scale 1:100" in reader.read("101_B") and "09:00" in reader.read("101_B")
+    reader.close()
+
+
+def test_writing_some_sections_keeps_the_others(tmp_path):
+    store = TabStore(str(tmp_path))
+    store.write("101_A", [("main", "main v1"), ("summary", "summary v1")])
+    store.write("101_A", [("summary", "summary v2")])
+    store.close()
+    reader = TabStoreReader(str(tmp_path))
+    assert reader.sections("101_A") == {"main": "main v1", "summary": "summary v2"}
+    reader.close()
+
+
+def test_split_parts_cuts_at_the_body():
+    assert split_parts(f"{HEAD}<BODY>x</BODY>") == [HEAD, "<BODY>x</BODY>"]
+    assert split_parts("<body>x</body>") == ["<body>x</body>"]
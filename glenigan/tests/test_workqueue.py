@@ -0,0 +1,83 @@
+from datetime import date
+
+from glenigan.shards import DateShard
+from glenigan.workqueue import WorkQueue, application_unit, search_unit
+
+
+def open_queue(tmp_path, worker_id, **kwargs):
+    queue = WorkQueue("sqlite", str(tmp_path / "work.sqlite"), worker_id=worker_id, **kwargs)
+    queue.create_table()
+    return queue
+
+
+def units(count):
+    return [application_unit(f"101_{number}", f"http://portal/{number}", False) for number in range(count)]
+
+
+def test_enqueue_is_idempotent_and_applications_lease_first(tmp_path):
+    queue = open_queue(tmp_path, "a")
+    search = search_unit("Council 0", DateShard(date(2025, 2, 1), date(2025, 2, 7)))
+    queue.enqueue([search])
+    queue.enqueue(units(2))
+    queue.enqueue(units(2) + [search])
+    leased = queue.lease(10)
+    assert [kind for _, kind, _ in leased] == ["application", "application", "search"]
+    assert leased[0][2] == {"ref_no": "101_0", "link": "http://portal/0", "rescrape": False}
+    assert leased[2][2] == {"council_name": "Council 0", "start": "01/02/2025", "end": "07/02/2025"}
+
+
+def test_a_leased_unit_is_not_leased_again_until_it_expires(tmp_path):
+    first = open_queue(tmp_path, "a")
+    second = open_queue(tmp_path, "b")
+    first.enqueue(units(3))
+    assert len(first.lease(2)) == 2
+    assert [payload["ref_no"] for _, _, payload in second.lease(10)] == ["101_2"]
+    assert second.lease(10) == []
+
+
+def test_expired_leases_are_picked_up_by_other_workers(tmp_path):
+    crashed = open_queue(tmp_path, "a", lease_seconds=-1)
+    other = open_queue(tmp_path, "b")
+    crashed.enqueue(units(1))
+    crashed.lease(1)
+    assert [payload["ref_no"] for _, _, payload in other.lease(1)] == ["101_0"]
+
+
+def test_heartbeat_keeps_a_lease_from_expiring(tmp_path):
+    worker = open_queue(tmp_path, "a", lease_seconds=-1)
+    other = open_queue(tmp_path, "b")
+    worker.enqueue(units(1))
+    unit_ids = [unit_id for unit_id, _, _ in worker.lease(1)]
+    worker.lease_seconds = 300
+    worker.heartbeat(unit_ids)
+    assert other.lease(1) == []
+
+
+def test_units_are_given_up_after_max_attempts(tmp_path):
+    queue = open_queue(tmp_path, "a", lease_seconds=-1, max_attempts=2)
+    queue.enqueue(units(1))
+    assert len(queue.lease(1)) == 1
+    assert len(queue.lease(1)) == 1
+    assert queue.lease(1) == []
+    assert queue.outstanding() == 0
+
+
+def test_release_hands_units_back_without_counting_the_attempt(tmp_path):
+    worker = open_queue(tmp_path, "a", max_attempts=1)
+    other = open_queue(tmp_path, "b", max_attempts=1)
+    worker.enqueue(units(1))
+    unit_ids = [unit_id for unit_id, _, _ in worker.lease(1)]
+    other.release(unit_ids)
+    assert other.lease(1) == []
+    worker.release(unit_ids)
+    assert [unit_id for unit_id, _, _ in other.lease(1)] == unit_ids
+
+
+def test_completed_units_are_not_leased_or_requeued(tmp_path):
+    queue = open_queue(tmp_path, "a")
+    queue.enqueue(units(2))
+    leased = queue.lease(2)
+    queue.complete([unit_id for unit_id, _, _ in leased])
+    queue.enqueue(units(2))
+    assert queue.lease(2) == []
+    assert queue.outstanding() == 0